@@ -16,6 +16,7 @@ from datetime import timedelta
 import django.utils
 import django.utils.encoding
 import os
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -55,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ecomapp.middleware.QueryBudgetMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     'django.middleware.security.SecurityMiddleware',
@@ -147,12 +149,147 @@ STATICFILES_DIRS = [
 
 MEDIA_ROOT = 'static/images'
 
+# Media is served by ecomapp.media.serve_media. Set MEDIA_SENDFILE to
+# 'x-accel-redirect' (nginx, with an internal location at
+# MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' (Apache,
+# lighttpd) to have the web server send the files.
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# Cache lifetime of media without a content hash in its name
+MEDIA_CACHE_MAX_AGE = 3600
+
+# Resized copies of product images (longest side in pixels), written under
+# MEDIA_ROOT/derived/ and exposed as imageVariants by the product API
+PRODUCT_IMAGE_VARIANTS = {'grid': 400, 'detail': 800, 'zoom': 1600}
+PRODUCT_IMAGE_FORMATS = ['webp', 'jpeg']
+PRODUCT_IMAGE_QUALITY = 82
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGIN = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['X-Did-You-Mean', 'Idempotent-Replayed']
+
+# Cursor pagination for /api/products/ (used when ?page_size= or ?cursor= is given)
+PRODUCTS_PAGE_SIZE = 24
+PRODUCTS_MAX_PAGE_SIZE = 100
+
+# Rows fetched and serialized at a time by ?format=ndjson listings
+PRODUCTS_STREAM_CHUNK_SIZE = 500
+
+# Most ids accepted by /api/products/batch/
+PRODUCTS_BATCH_MAX = 100
+
+# In-memory facet index used for tag, arrival and category filters.
+# Each process rebuilds its copy after FACET_INDEX_MAX_AGE seconds.
+FACET_INDEX_ENABLED = True
+FACET_INDEX_MAX_AGE = 300
+
+# Upper bounds of the price buckets counted by /api/products/facets/
+PRODUCT_PRICE_BUCKETS = [100, 500, 1000, 2500, 5000]
+
+# Search box suggestions from the in-memory autocomplete index, which each
+# process rebuilds after AUTOCOMPLETE_MAX_AGE seconds
+AUTOCOMPLETE_LIMIT = 8
+AUTOCOMPLETE_MAX_LIMIT = 20
+AUTOCOMPLETE_MAX_AGE = 300
+
+# Typo-tolerant ?keyword= searches with ?fuzzy=1 (see ecomapp/fuzzy.py): the
+# most edits allowed per word, the trigram similarity a word needs before its
+# edit distance is computed, and how many of the best matches passing the
+# other filters a listing returns. Each process rebuilds its index after
+# FUZZY_INDEX_MAX_AGE seconds.
+FUZZY_SEARCH_MAX_DISTANCE = 2
+FUZZY_SEARCH_MIN_SIMILARITY = 0.3
+FUZZY_SEARCH_MAX_RESULTS = 500
+FUZZY_INDEX_MAX_AGE = 300
+
+# Precomputed "similar products" (see ecomapp/recommendations.py): how many
+# neighbours each product keeps, how the score is weighted, how many products
+# a tag can be on before it stops producing candidates, and how many
+# tag-sharing candidates are scored per product. A request refreshes them for
+# at most SIMILAR_PRODUCTS_REFRESH_LIMIT changed products; run
+# rebuild_similar_products after bigger changes, like deleting a popular tag
+SIMILAR_PRODUCTS_COUNT = 8
+SIMILAR_PRODUCTS_WEIGHTS = {'tags': 0.6, 'category': 0.25, 'price': 0.15}
+SIMILAR_PRODUCTS_TAG_LIMIT = 500
+SIMILAR_PRODUCTS_MAX_CANDIDATES = 100
+SIMILAR_PRODUCTS_REFRESH_LIMIT = 100
+
+# How long an Idempotency-Key on orders/create/, products/update-stock/ and
+# products/adjust-stock/ replays its first response; purge_idempotency_keys deletes older keys
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# How long a cart reservation holds stock before it has to be extended;
+# expire_reservations deletes lapsed ones
+RESERVATION_TTL = 15 * 60
+
+# Sharded stock counters (see ecomapp/stock_shards.py, turned on per product
+# with rebalance_stock_shards): how long a product's summed shards are cached,
+# and how often a purchase copies the sum back to Products.stockCount
+STOCK_SHARD_CACHE_TIMEOUT = 5
+STOCK_SHARD_SYNC_INTERVAL = 30
+
+# Most lines a products/adjust-stock/ batch may have
+STOCK_ADJUST_MAX_LINES = 500
+
+# Response cache for /api/products/. Use a shared backend such as Redis or
+# Memcached when running several worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+CATALOG_CACHE_ENABLED = True
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 60
+
+# Sampled span tracing for the ecomapp views (see ecomapp/tracing.py).
+# Off by default; when enabled, TRACING_SAMPLE_RATE of requests are traced.
+TRACING_ENABLED = False
+TRACING_SAMPLE_RATE = 0.01
+
+# Per-route query and latency budgets, keyed by URL name. Requests over
+# budget are logged by ecomapp.middleware.QueryBudgetMiddleware.
+SERVER_TIMING = True
+QUERY_BUDGET_DEFAULT = {'queries': 50, 'ms': 1000}
+QUERY_BUDGETS = {
+    'getProducts': {'queries': 8, 'ms': 300},
+    'getProduct': {'queries': 2, 'ms': 100},
+    'similar-products': {'queries': 2, 'ms': 100},
+    'getProductsBatch': {'queries': 2, 'ms': 150},
+    'product-facets': {'queries': 5, 'ms': 150},
+    'product-autocomplete': {'queries': 0, 'ms': 20},
+    'my-orders': {'queries': 4, 'ms': 300},
+    'wishlist': {'queries': 3, 'ms': 200},
+    # 13 with an Idempotency-Key and a delivery location, one more for a
+    # sharded product. A line no single shard covers takes up to 5 more
+    # statements; rebalance_stock_shards keeps that rare.
+    'create-order': {'queries': 14, 'ms': 500},
+    'reservation-item': {'queries': 6, 'ms': 200},
+    # 5 however many lines; each sharded product adds from 1 to 5, the
+    # most when a write-off has to be taken from several shards
+    'adjust-stock': {'queries': 10, 'ms': 300},
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'ecomapp': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=5),
@@ -15,13 +15,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+import re
+
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from ecomapp.media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('ecomapp.urls')),
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
 ]
-
-urlpatterns+=static(settings.MEDIA_URL, document_root = settings.MEDIA_ROOT)
\ No newline at end of file
@@ -4,6 +4,7 @@ from django.utils import timezone
 from datetime import timedelta
 from django.utils.html import format_html, mark_safe
 from .models import Products, Category, Order, OrderItem, TagType, Tag
+from .search import fts_enabled, search_products
 
 @admin.register(TagType)
 class TagTypeAdmin(admin.ModelAdmin):
@@ -59,7 +60,7 @@ class CategoryAdmin(admin.ModelAdmin):
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['productName', 'category', 'price', 'stockCount', 'rating', 'get_tags']
     list_filter = ['category', 'createdAt', 'tags__tag_type']
-    search_fields = ['productName', 'description']
+    search_fields = ['productName', 'productBrand', 'productInfo']
     ordering = ['productName']
     filter_horizontal = ['tags']
     readonly_fields = ['get_tags_display']
@@ -76,6 +77,12 @@ class ProductAdmin(admin.ModelAdmin):
         })
     ]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index when it is available
+        if search_term and fts_enabled(queryset.db):
+            return search_products(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
     def formatted_price(self, obj):
         if obj.price is None:
             return '-'
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class EcomappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ecomapp'
+
+    def ready(self):
+        from . import signals
+        post_migrate.connect(signals.create_search_schema, sender=self)
+        post_migrate.connect(signals.populate_similar_products, sender=self)
@@ -0,0 +1,273 @@
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+# Shown first when popularity ties
+KIND_ORDER = {'category': 0, 'brand': 1, 'tag': 2, 'product': 3}
+
+# Rankings are memoized per prefix, and revised in place as terms change
+MEMO_SIZE = 10000
+
+_END = '\U0010ffff'
+
+
+def normalize(text):
+    """Lowercase, drop accents and collapse whitespace"""
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.lower().split())
+
+
+def phrases(label):
+    """The label from each word on, so "Lego City Bus" is found by "ci" and "bu" too"""
+    text = normalize(label)
+    starts = [0] + [match.end() for match in re.finditer(r'[\s\-/]+', text)]
+    return list(dict.fromkeys(text[start:] for start in starts if start < len(text)))
+
+
+class SuggestionIndex:
+    """
+    Per-process typeahead index over product names, brands, categories and
+    tag names.
+
+    Every suggestion ("term") is filed under each of its phrases() in one
+    sorted list of (phrase, term) pairs, so the suggestions for a prefix are
+    the slice found with two bisections. Terms are ranked by popularity:
+    units sold for products, and the units sold of their products for
+    brands, categories and tags, which only appear while some product uses
+    them. Like the facet index, it is built on first use, kept current by the
+    signal handlers in signals.py and rebuilt after AUTOCOMPLETE_MAX_AGE
+    seconds to pick up changes made by other processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def rebuild(self):
+        from .models import Category, Products, Tag
+
+        with self._lock:
+            self._keys = []
+            self._terms = {}
+            self._products = {}
+            self._memo = {}
+            self._touched = {}
+            self._category_names = dict(Category.objects.values_list('id', 'name'))
+            self._tag_names = {
+                tag_id: (name, type_name)
+                for tag_id, name, type_name in Tag.objects.values_list('id', 'name', 'tag_type__name')
+            }
+
+            tags = {}
+            for product_id, tag_id in Products.tags.through.objects.values_list('products_id', 'tag_id').iterator():
+                tags.setdefault(product_id, set()).add(tag_id)
+            # Aggregates are summed first and filed once each
+            totals = {}
+            rows = Products.objects.values_list('_id', 'productName', 'productBrand', 'category_id', 'unitsSold')
+            for product_id, name, brand, category_id, units in rows.iterator():
+                units = units or 0
+                product_tags = tags.get(product_id, set())
+                self._products[product_id] = (name, brand, category_id, units, product_tags)
+                if name:
+                    self._terms[('product', product_id)] = {'label': name, 'popularity': units, 'products': 1}
+                    self._file(('product', product_id), name, sort=False)
+                for term, label, extra in self._aggregates(brand, category_id, product_tags):
+                    total = totals.get(term)
+                    if total is None:
+                        total = totals[term] = {'label': label, 'popularity': 0, 'products': 0, **extra}
+                    total['popularity'] += units
+                    total['products'] += 1
+            for term, total in totals.items():
+                if total['label']:
+                    self._terms[term] = total
+                    self._file(term, total['label'], sort=False)
+
+            self._keys.sort()
+            self._touched = {}
+            self._built_at = time.monotonic()
+
+    def _ensure_built(self):
+        max_age = getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 300)
+        if self._built_at is None or time.monotonic() - self._built_at > max_age:
+            self.rebuild()
+
+    # Terms
+
+    def _file(self, term, label, sort=True):
+        for phrase in phrases(label):
+            if sort:
+                insort(self._keys, (phrase, term))
+            else:
+                self._keys.append((phrase, term))
+
+    def _unfile(self, term, label):
+        for phrase in phrases(label):
+            position = bisect_left(self._keys, (phrase, term))
+            if position < len(self._keys) and self._keys[position] == (phrase, term):
+                del self._keys[position]
+
+    def _adjust(self, term, label, units, products, **extra):
+        """Add units and products to an aggregate term, filing or unfiling it as it gains or loses its last product"""
+        entry = self._terms.get(term)
+        if entry is None:
+            if products <= 0 or not label:
+                return
+            self._touch(term, label)
+            entry = self._terms[term] = {'label': label, 'popularity': 0, 'products': 0, **extra}
+            self._file(term, label)
+        entry['popularity'] += units
+        entry['products'] += products
+        self._touch(term, entry['label'])
+        if entry['products'] <= 0:
+            self._unfile(term, entry['label'])
+            del self._terms[term]
+
+    def _touch(self, term, label):
+        if self._memo:
+            self._touched.setdefault(term, set()).add(label)
+
+    def _rank(self, term):
+        entry = self._terms[term]
+        return -entry['popularity'], KIND_ORDER[term[0]], entry['label'].lower()
+
+    def _revise_memo(self):
+        """Bring the memoized results up to date with the terms changed since the last call"""
+        touched, self._touched = self._touched, {}
+        # Removed terms first, so no ranking still holds one when the others are re-sorted
+        for term, labels in sorted(touched.items(), key=lambda item: item[0] in self._terms):
+            prefixes = {phrase[:end] for label in labels for phrase in phrases(label) for end in range(1, len(phrase) + 1)}
+            current = phrases(self._terms[term]['label']) if term in self._terms else []
+            for prefix in prefixes & self._memo.keys():
+                matches = any(phrase.startswith(prefix) for phrase in current)
+                by_limit = self._memo[prefix]
+                for limit, ranked in list(by_limit.items()):
+                    if not self._revise(ranked, limit, term, matches):
+                        del by_limit[limit]
+                if not by_limit:
+                    del self._memo[prefix]
+
+    def _revise(self, ranked, limit, term, matches):
+        """
+        Update one memoized ranking in place, returning False when it has to be
+        recomputed. Rankings hold limit + 1 terms; the extra one is the best
+        term not shown, which any other term has to beat to get in. Shorter
+        rankings hold every term with the prefix.
+        """
+        complete = len(ranked) <= limit
+        if term in ranked:
+            if not matches:
+                ranked.remove(term)
+                return complete
+            ranked.sort(key=self._rank)
+            return complete or ranked[-1] != term
+        if matches and (complete or self._rank(term) < self._rank(ranked[-1])):
+            ranked.append(term)
+            ranked.sort(key=self._rank)
+            del ranked[limit + 1:]
+        return True
+
+    def _aggregates(self, brand, category_id, tag_ids):
+        if brand and brand.strip():
+            yield ('brand', normalize(brand)), brand.strip(), {}
+        if category_id is not None:
+            yield ('category', category_id), self._category_names.get(category_id), {}
+        for tag_id in tag_ids:
+            name, type_name = self._tag_names.get(tag_id, (None, None))
+            yield ('tag', tag_id), name, {'tag_type': type_name}
+
+    def _add_product(self, product_id, name, brand, category_id, units, tag_ids):
+        self._products[product_id] = (name, brand, category_id, units, set(tag_ids))
+        if name:
+            self._terms[('product', product_id)] = {'label': name, 'popularity': units, 'products': 1}
+            self._file(('product', product_id), name)
+            self._touch(('product', product_id), name)
+        for term, label, extra in self._aggregates(brand, category_id, tag_ids):
+            self._adjust(term, label, units, 1, **extra)
+
+    def _remove_product(self, product_id):
+        state = self._products.pop(product_id, None)
+        if state is None:
+            return None
+        name, brand, category_id, units, tag_ids = state
+        if self._terms.pop(('product', product_id), None) is not None:
+            self._unfile(('product', product_id), name)
+            self._touch(('product', product_id), name)
+        for term, label, _ in self._aggregates(brand, category_id, tag_ids):
+            self._adjust(term, label, -units, -1)
+        return state
+
+    # Incremental updates, called from the signal handlers
+
+    def update_product(self, product_id, name, brand, category_id, units):
+        with self._lock:
+            if self._built_at is None:
+                return
+            state = self._remove_product(product_id)
+            tag_ids = state[4] if state else set()
+            self._add_product(product_id, name, brand, category_id, units or 0, tag_ids)
+            self._revise_memo()
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove_product(product_id)
+            self._revise_memo()
+
+    def set_tags(self, product_id, tag_ids):
+        with self._lock:
+            if self._built_at is None or product_id not in self._products:
+                return
+            name, brand, category_id, units, _ = self._remove_product(product_id)
+            self._add_product(product_id, name, brand, category_id, units, tag_ids)
+            self._revise_memo()
+
+    def product_tags(self, product_id):
+        with self._lock:
+            state = self._products.get(product_id) if self._built_at is not None else None
+            return set(state[4]) if state else set()
+
+    # Queries
+
+    def suggest(self, prefix, limit=8):
+        """The most popular terms with a phrase starting with prefix"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            self._ensure_built()
+            ranked = self._memo.get(prefix, {}).get(limit)
+            if ranked is None:
+                start = bisect_left(self._keys, (prefix,))
+                end = bisect_left(self._keys, (prefix + _END,), start)
+                terms = {term for _, term in self._keys[start:end]}
+                ranked = heapq.nsmallest(limit + 1, terms, key=self._rank)
+                if len(self._memo) >= MEMO_SIZE:
+                    self._memo.clear()
+                self._memo.setdefault(prefix, {})[limit] = ranked
+            return [self._suggestion(term) for term in ranked[:limit]]
+
+    def _suggestion(self, term):
+        kind, key = term
+        entry = self._terms[term]
+        suggestion = {'type': kind, 'label': entry['label']}
+        if kind == 'product':
+            suggestion['id'] = key
+        elif kind == 'tag':
+            suggestion['tag_type'] = entry['tag_type']
+        return suggestion
+
+
+suggestion_index = SuggestionIndex()
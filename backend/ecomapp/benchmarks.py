@@ -0,0 +1,174 @@
+"""
+Endpoint benchmarks driven through the Django test client.
+
+Each catalog size gets a fresh test database seeded with seed_catalog(). Every
+scenario is timed over a number of requests, with queries counted per request
+and peak Python memory measured in a separate tracemalloc pass (tracemalloc
+slows everything down, so it is kept out of the timings).
+"""
+import logging
+import math
+import random
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .models import Products, Category, TagType
+from .seed import seed_catalog
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(timings, queries, peak_bytes):
+    return {
+        'requests': len(timings),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': max(queries),
+        'peak_kib': round(peak_bytes / 1024, 1),
+    }
+
+
+class EndpointBenchmark:
+    def __init__(self, iterations=20, seed=0):
+        self.iterations = iterations
+        self.rng = random.Random(seed)
+        self.client = APIClient()
+        self.user = None
+
+    def scenarios(self):
+        """Yield (name, request) pairs; request() makes one call and returns the response"""
+        products = list(Products.objects.values_list('_id', flat=True))
+        in_stock = list(Products.objects.filter(stockCount__gte=1000).values_list('_id', 'price')[:200])
+        categories = list(Category.objects.values_list('name', flat=True))
+        tag_type = TagType.objects.exclude(name='Arrival').prefetch_related('tags').first()
+        shopper = User.objects.filter(order__isnull=False).first() or User.objects.first()
+        admin = User.objects.filter(is_staff=True).first() or User.objects.create_superuser(
+            f'bench-admin-{self.rng.randrange(10 ** 6)}', 'bench@example.com', 'benchmark-password')
+
+        filter_mix = [
+            {},
+            {'page_size': 24},
+            {'arrival': 'new'},
+            {'category': self.rng.choice(categories)} if categories else {},
+            {'keyword': 'robot'},
+            {'price_min': 100, 'price_max': 2500},
+        ]
+        if tag_type is not None:
+            values = ','.join(tag.name for tag in tag_type.tags.all()[:2])
+            filter_mix.append({tag_type.name: values, 'arrival': 'classic,recent'})
+
+        # Product name words with one letter dropped, for the fuzzy search
+        name_words = [
+            word for name in Products.objects.values_list('productName', flat=True)[:500]
+            for word in name.split() if len(word) > 5 and word.isalpha()
+        ]
+        typos = []
+        for word in self.rng.sample(name_words, min(len(name_words), 50)):
+            position = self.rng.randrange(len(word))
+            typos.append(word[:position] + word[position + 1:])
+
+        def as_user(user):
+            # Switching users logs the test client out, which runs session queries
+            if user is not self.user:
+                self.client.force_authenticate(user=user)
+                self.user = user
+
+        def get(name, params=None, user=None, **kwargs):
+            def request():
+                as_user(user)
+                return self.client.get(reverse(name, kwargs=kwargs or None), params)
+            return request
+
+        yield 'getProducts (all)', get('getProducts')
+        yield 'getProducts (filter mix)', lambda: get('getProducts', self.rng.choice(filter_mix))()
+        if typos:
+            yield 'getProducts (fuzzy)', lambda: get(
+                'getProducts', {'keyword': self.rng.choice(typos), 'fuzzy': 1, 'page_size': 24})()
+        yield 'getProduct', lambda: get('getProduct', pk=self.rng.choice(products))()
+        yield 'get_my_orders', get('my-orders', user=shopper)
+        yield 'get_sales_stats', get('sales-stats', user=admin)
+        yield 'get_tag_types', get('tag-types')
+
+        def create_order():
+            as_user(shopper)
+            lines = self.rng.sample(in_stock, min(len(in_stock), 3))
+            return self.client.post(reverse('create-order'), {
+                'payment_method': 'Cash',
+                'shipping_price': '50.00',
+                'total_price': str(sum(price for _, price in lines) + 50),
+                'order_items': [{'product_id': pk, 'quantity': 1, 'price': str(price)} for pk, price in lines],
+            }, format='json')
+        yield 'create_order', create_order
+
+    def measure(self, request):
+        request()  # warm up per-process indexes and connections
+        timings, queries = [], []
+        for _ in range(self.iterations):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = request()
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f'Benchmark request failed with {response.status_code}: {response.content[:200]}')
+            queries.append(len(context.captured_queries))
+
+        tracemalloc.start()
+        request()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return summarize(timings, queries, peak)
+
+    def run(self, log=None):
+        log = log or (lambda message: None)
+        results = {}
+        for name, request in self.scenarios():
+            results[name] = self.measure(request)
+            log(f"  {name:<26} p50 {results[name]['p50_ms']:>9.2f}ms  p95 {results[name]['p95_ms']:>9.2f}ms  "
+                f"p99 {results[name]['p99_ms']:>9.2f}ms  {results[name]['queries']:>3} queries  "
+                f"{results[name]['peak_kib']:>10.1f} KiB")
+        return results
+
+
+def run_benchmarks(sizes, iterations=20, seed=0, use_cache=False, log=None):
+    """Benchmark every endpoint scenario at each catalog size, each in a fresh test database"""
+    log = log or (lambda message: None)
+    report = {'iterations': iterations, 'seed': seed, 'cache': use_cache, 'sizes': {}}
+    # The budget middleware would warn on every large request; the report covers it
+    budget_logger = logging.getLogger('ecomapp.performance')
+    budget_level = budget_logger.level
+    budget_logger.setLevel(logging.ERROR)
+    try:
+        for size in sizes:
+            _benchmark_size(report, size, iterations, seed, use_cache, log)
+    finally:
+        budget_logger.setLevel(budget_level)
+    return report
+
+
+def _benchmark_size(report, size, iterations, seed, use_cache, log):
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(CATALOG_CACHE_ENABLED=use_cache, ALLOWED_HOSTS=['testserver'], SERVER_TIMING=False):
+            started = time.perf_counter()
+            seed_catalog(products=size, categories=max(4, size // 500), users=max(10, size // 100),
+                         orders=max(20, size // 10), wishlist=max(20, size // 10), seed=seed)
+            log(f'Catalog of {size} products seeded in {time.perf_counter() - started:.1f}s')
+            report['sizes'][str(size)] = EndpointBenchmark(iterations, seed).run(log)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        for alias in connections:
+            connections[alias].close()
@@ -0,0 +1,184 @@
+"""
+Response cache and resource versions for the catalog endpoints.
+
+Each cacheable resource ('catalog', 'categories', 'tag_types') has a version
+counter and a last-modified time that signals.py bumps whenever the underlying
+rows change. Listing cache entries are keyed on a canonical form of the query
+string together with the catalog version, so old entries are never read again
+and simply expire, and the same versions produce the ETag and Last-Modified
+validators for conditional GETs. Every process must see the same versions,
+so in production CACHES should point at a shared backend (Redis, Memcached)
+rather than the per-process LocMemCache used in development.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .filters import RESERVED_PARAMS, TRUE_VALUES, parse_price
+
+VERSION_KEY = 'ecomapp:%s:version'
+MODIFIED_KEY = 'ecomapp:%s:modified'
+HITS_KEY = 'ecomapp:products:hits'
+MISSES_KEY = 'ecomapp:products:misses'
+
+# Parameters whose values are passed through untouched
+_OPAQUE_PARAMS = {'cursor', 'page_size'}
+
+
+def _state_cache():
+    # Generation and counters live apart from the responses so they are never
+    # evicted to make room for entries
+    return caches['default']
+
+
+def _response_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _incr(key):
+    cache = _state_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+def resource_version(resource):
+    cache = _state_cache()
+    version = cache.get(VERSION_KEY % resource)
+    if version is None:
+        # Start from the clock so a lost counter can't reuse an old version
+        cache.add(VERSION_KEY % resource, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY % resource)
+    return version
+
+
+def resource_modified(resource):
+    cache = _state_cache()
+    modified = cache.get(MODIFIED_KEY % resource)
+    if modified is None:
+        cache.add(MODIFIED_KEY % resource, time.time(), timeout=None)
+        modified = cache.get(MODIFIED_KEY % resource)
+    return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+
+def bump_resource_version(*resources):
+    cache = _state_cache()
+    now = time.time()
+    for resource in resources:
+        try:
+            cache.incr(VERSION_KEY % resource)
+        except ValueError:
+            cache.add(VERSION_KEY % resource, int(now * 1000), timeout=None)
+        cache.set(MODIFIED_KEY % resource, now, timeout=None)
+
+
+def catalog_generation():
+    return resource_version('catalog')
+
+
+def bump_catalog_generation():
+    bump_resource_version('catalog')
+
+
+def canonical_query(params):
+    """
+    Normalize product listing parameters so equivalent requests share an entry:
+    parameters are sorted, tag values lower-cased and sorted, empty filters
+    dropped and price bounds written in a single decimal form.
+    """
+    items = []
+    for key in params.keys():
+        value = params.get(key)
+        if key in _OPAQUE_PARAMS:
+            items.append((key, value))
+        elif key in ('price_min', 'price_max'):
+            price = parse_price(value)
+            if price is not None:
+                items.append((key, format(price.normalize(), 'f')))
+        elif key in ('fields', 'exclude'):
+            # Field names are case-sensitive
+            items.append((key, ','.join(sorted({v.strip() for v in value.split(',') if v.strip()}))))
+        elif key == 'fuzzy':
+            if value.lower() in TRUE_VALUES:
+                items.append((key, '1'))
+        elif key in ('keyword', 'category'):
+            value = ' '.join(value.lower().split())
+            if value:
+                items.append((key, value))
+        elif value:
+            # arrival and the tag type filters are comma-separated OR lists
+            values = sorted({v.lower() for v in value.split(',')})
+            name = key if key in RESERVED_PARAMS else key.lower()
+            items.append((name, ','.join(values)))
+    return urlencode(sorted(items))
+
+
+def listing_cache_key(params):
+    digest = hashlib.sha1(canonical_query(params).encode()).hexdigest()
+    return f'ecomapp:products:{catalog_generation()}:{digest}'
+
+
+def get_cached_listing(key):
+    if not getattr(settings, 'CATALOG_CACHE_ENABLED', True):
+        return None
+    data = _response_cache().get(key)
+    _incr(HITS_KEY if data is not None else MISSES_KEY)
+    return data
+
+
+def set_cached_listing(key, data):
+    if getattr(settings, 'CATALOG_CACHE_ENABLED', True):
+        _response_cache().set(key, data, timeout=getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60))
+
+
+# Validators for django.views.decorators.http.condition. The Accept header is
+# part of each ETag because DRF serves JSON and the browsable API from one URL.
+
+def _etag(request, *parts):
+    parts += (request.META.get('HTTP_ACCEPT', ''),)
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def products_etag(request):
+    return _etag(request, 'products', catalog_generation(), canonical_query(request.GET))
+
+
+def facets_etag(request):
+    return _etag(request, 'facets', catalog_generation(), canonical_query(request.GET))
+
+
+def product_etag(request, pk):
+    return _etag(request, 'product', pk, catalog_generation(), canonical_query(request.GET))
+
+
+def categories_etag(request):
+    return _etag(request, 'categories', resource_version('categories'))
+
+
+def tag_types_etag(request):
+    return _etag(request, 'tag_types', resource_version('tag_types'))
+
+
+def last_modified(resource):
+    def func(request, *args, **kwargs):
+        return resource_modified(resource)
+    return func
+
+
+def cache_stats():
+    cache = _state_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        'generation': catalog_generation(),
+    }
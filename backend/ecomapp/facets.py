@@ -0,0 +1,344 @@
+import json
+import threading
+import time
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+
+def bits_to_ids(bits):
+    """Return the positions of the set bits, in ascending order"""
+    ids = []
+    digits = bin(bits)[:1:-1]
+    position = digits.find('1')
+    while position != -1:
+        ids.append(position)
+        position = digits.find('1', position + 1)
+    return ids
+
+
+def ids_to_bits(ids):
+    # Set the bits in a buffer first; OR-ing into an int copies it every time
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for product_id in ids:
+        buffer[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def restrict_to(queryset, bits):
+    """Limit a Products queryset to the ids in a bitset"""
+    ids = bits_to_ids(bits)
+    if connections[queryset.db].vendor == 'sqlite':
+        # A single JSON parameter avoids SQLite's limit on bound variables
+        return queryset.filter(_id__in=RawSQL('SELECT value FROM json_each(%s)', [json.dumps(ids)]))
+    return queryset.filter(_id__in=ids)
+
+
+class FacetIndex:
+    """
+    Per-process index of product ids by tag, category, arrival status and
+    price bucket.
+
+    Each facet value maps to a Python int used as a bitset (bit n is set when
+    the product with _id n has that value), so the OR-within-type and
+    AND-across-type filters of getProducts become bitwise operations. The
+    signal handlers in signals.py keep it current within this process; other
+    processes pick up changes when the index reaches FACET_INDEX_MAX_AGE.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def rebuild(self):
+        from .models import Products, Tag, Category
+
+        with self._lock:
+            self._price_bounds = [Decimal(str(bound)) for bound in getattr(settings, 'PRODUCT_PRICE_BUCKETS', [])]
+            self._product_category = {}
+            self._product_price = {}
+            self._product_tags = {}
+            category_ids = {}
+            bucket_ids = [[] for _ in range(len(self._price_bounds) + 1)]
+
+            rows = Products.objects.values_list('_id', 'category_id', 'price')
+            for product_id, category_id, price in rows.iterator():
+                self._product_category[product_id] = category_id
+                self._product_price[product_id] = price
+                self._product_tags[product_id] = set()
+                if category_id is not None:
+                    category_ids.setdefault(category_id, []).append(product_id)
+                if price is not None:
+                    bucket_ids[self._bucket(price)].append(product_id)
+
+            tag_ids = {}
+            through = Products.tags.through.objects.values_list('products_id', 'tag_id')
+            for product_id, tag_id in through.iterator():
+                self._product_tags.setdefault(product_id, set()).add(tag_id)
+                tag_ids.setdefault(tag_id, []).append(product_id)
+
+            self._all = ids_to_bits(self._product_category)
+            self._category_bits = {key: ids_to_bits(ids) for key, ids in category_ids.items()}
+            self._tag_bits = {key: ids_to_bits(ids) for key, ids in tag_ids.items()}
+            self._bucket_bits = [ids_to_bits(ids) for ids in bucket_ids]
+            self._load_names(Tag, Category)
+            self._built_at = time.monotonic()
+
+    def _load_names(self, Tag, Category):
+        self._tag_lookup = {}
+        self._tag_names = {}
+        for tag_id, name, type_name in Tag.objects.values_list('id', 'name', 'tag_type__name'):
+            if type_name is not None:
+                key = (type_name.lower(), name.lower())
+                self._tag_lookup.setdefault(key, []).append(tag_id)
+                self._tag_names.setdefault(key, (type_name, name))
+        self._category_lookup = {}
+        self._category_names = {}
+        for category_id, name in Category.objects.values_list('id', 'name'):
+            self._category_lookup.setdefault(name.lower(), []).append(category_id)
+            self._category_names.setdefault(name.lower(), name)
+
+    def _bucket(self, price):
+        return bisect_right(self._price_bounds, price)
+
+    def _ensure_built(self):
+        max_age = getattr(settings, 'FACET_INDEX_MAX_AGE', 300)
+        if self._built_at is None or time.monotonic() - self._built_at > max_age:
+            self.rebuild()
+
+    # Incremental updates, called from the signal handlers
+
+    def update_product(self, product_id, category_id, price=None):
+        with self._lock:
+            if self._built_at is None:
+                return
+            bit = 1 << product_id
+            old_category = self._product_category.get(product_id)
+            if old_category is not None and old_category != category_id:
+                self._category_bits[old_category] &= ~bit
+            if category_id is not None:
+                self._category_bits[category_id] = self._category_bits.get(category_id, 0) | bit
+            self._product_category[product_id] = category_id
+            self._set_price(product_id, price)
+            self._product_tags.setdefault(product_id, set())
+            self._all |= bit
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            bit = 1 << product_id
+            for tag_id in self._product_tags.pop(product_id, set()):
+                self._tag_bits[tag_id] &= ~bit
+            category_id = self._product_category.pop(product_id, None)
+            if category_id is not None:
+                self._category_bits[category_id] &= ~bit
+            self._set_price(product_id, None)
+            self._product_price.pop(product_id, None)
+            self._all &= ~bit
+
+    def _set_price(self, product_id, price):
+        bit = 1 << product_id
+        if price is not None:
+            # Unsaved assignments may still hold an int, float or string
+            price = Decimal(str(price))
+        old_price = self._product_price.get(product_id)
+        if old_price is not None:
+            self._bucket_bits[self._bucket(old_price)] &= ~bit
+        if price is not None:
+            self._bucket_bits[self._bucket(price)] |= bit
+        self._product_price[product_id] = price
+
+    def add_tags(self, product_id, tag_ids):
+        with self._lock:
+            if self._built_at is None:
+                return
+            bit = 1 << product_id
+            for tag_id in tag_ids:
+                self._tag_bits[tag_id] = self._tag_bits.get(tag_id, 0) | bit
+            self._product_tags.setdefault(product_id, set()).update(tag_ids)
+
+    def remove_tags(self, product_id, tag_ids):
+        with self._lock:
+            if self._built_at is None:
+                return
+            bit = 1 << product_id
+            for tag_id in list(tag_ids):
+                if tag_id in self._tag_bits:
+                    self._tag_bits[tag_id] &= ~bit
+            self._product_tags.get(product_id, set()).difference_update(tag_ids)
+
+    def clear_tags(self, product_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self.remove_tags(product_id, set(self._product_tags.get(product_id, set())))
+
+    def drop_tag(self, tag_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            for product_id in bits_to_ids(self._tag_bits.pop(tag_id, 0)):
+                self._product_tags.get(product_id, set()).discard(tag_id)
+
+    def drop_category(self, category_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            for product_id in bits_to_ids(self._category_bits.pop(category_id, 0)):
+                self._product_category[product_id] = None
+
+    def refresh_names(self):
+        from .models import Tag, Category
+
+        with self._lock:
+            if self._built_at is not None:
+                self._load_names(Tag, Category)
+
+    # Queries
+
+    def match(self, filters):
+        """
+        Return the bitset of products matching the tag, arrival and category
+        filters, or None when the filters contain none of them.
+        """
+        if not getattr(settings, 'FACET_INDEX_ENABLED', True):
+            return None
+        if not (filters['tags'] or filters['arrival'] or filters['category']):
+            return None
+
+        with self._lock:
+            self._ensure_built()
+            result = self._all
+
+            for tag_type, tag_values in filters['tags'].items():
+                result &= self._tags_bits(tag_type, tag_values)
+
+            if filters['arrival']:
+                result &= self._tags_bits('Arrival', filters['arrival'])
+
+            if filters['category']:
+                result &= self._category_name_bits(filters['category'])
+
+            return result
+
+    def category_only(self, filters):
+        """
+        Return the ids of the category filter when it is the only tag, arrival
+        or category filter, else None. Filtering on these in SQL lets
+        products_category_price_idx serve the listing's price sorts.
+        """
+        if not getattr(settings, 'FACET_INDEX_ENABLED', True):
+            return None
+        if not filters['category'] or filters['tags'] or filters['arrival']:
+            return None
+        with self._lock:
+            self._ensure_built()
+            return list(self._category_lookup.get(filters['category'].lower(), []))
+
+    def counts(self, filters, matches=None):
+        """
+        Count the products for every tag, arrival status, category and price
+        bucket under the given filters. Each facet is counted with all the
+        filters except its own, so picking one value leaves the counts of its
+        alternatives intact. `matches` is the bitset of keyword matches when
+        the filters include a keyword. Counts always come from the index,
+        whatever FACET_INDEX_ENABLED says.
+        """
+        with self._lock:
+            self._ensure_built()
+            base = self._all if matches is None else self._all & matches
+
+            # The products selected by each facet that has a filter
+            selected = {}
+
+            def select(facet, bits):
+                selected[facet] = selected.get(facet, base) & bits
+
+            for tag_type, tag_values in filters['tags'].items():
+                select(tag_type.lower(), self._tags_bits(tag_type, tag_values))
+            if filters['arrival']:
+                select('arrival', self._tags_bits('Arrival', filters['arrival']))
+            if filters['category']:
+                select('category', self._category_name_bits(filters['category']))
+            if filters['price_min'] is not None or filters['price_max'] is not None:
+                select('price', self._price_bits(filters['price_min'], filters['price_max']))
+
+            excluding = {}
+
+            def without(facet):
+                if facet not in excluding:
+                    bits = base
+                    for other, other_bits in selected.items():
+                        if other != facet:
+                            bits &= other_bits
+                    excluding[facet] = bits
+                return excluding[facet]
+
+            tags, arrival = {}, {}
+            for key, tag_ids in self._tag_lookup.items():
+                type_name, name = self._tag_names[key]
+                bits = 0
+                for tag_id in tag_ids:
+                    bits |= self._tag_bits.get(tag_id, 0)
+                count = (without(key[0]) & bits).bit_count()
+                if key[0] == 'arrival':
+                    arrival[key[1]] = count
+                else:
+                    tags.setdefault(type_name, {})[name] = count
+
+            categories = {}
+            for key, name in self._category_names.items():
+                categories[name] = (without('category') & self._category_name_bits(key)).bit_count()
+
+            price = []
+            lower_bounds = [Decimal(0)] + self._price_bounds
+            upper_bounds = self._price_bounds + [None]
+            for bucket, bits in enumerate(self._bucket_bits):
+                price.append({
+                    'min': str(lower_bounds[bucket]),
+                    'max': str(upper_bounds[bucket]) if upper_bounds[bucket] is not None else None,
+                    'count': (without('price') & bits).bit_count(),
+                })
+
+            return {
+                'total': without(None).bit_count(),
+                'tags': tags,
+                'arrival': arrival,
+                'categories': categories,
+                'price': price,
+            }
+
+    def _category_name_bits(self, name):
+        bits = 0
+        for category_id in self._category_lookup.get(name.lower(), []):
+            bits |= self._category_bits.get(category_id, 0)
+        return bits
+
+    def _price_bits(self, price_min, price_max):
+        return ids_to_bits(
+            product_id for product_id, price in self._product_price.items()
+            if price is not None
+            and (price_min is None or price >= price_min)
+            and (price_max is None or price <= price_max)
+        )
+
+    def _tags_bits(self, tag_type, tag_values):
+        bits = 0
+        for value in tag_values:
+            for tag_id in self._tag_lookup.get((tag_type.lower(), value.lower()), []):
+                bits |= self._tag_bits.get(tag_id, 0)
+        return bits
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,52 @@
+"""
+Sparse fieldsets for product responses.
+
+The product, wishlist and order endpoints accept `fields=` or `exclude=` with
+a comma-separated list of product fields. The serializers drop the other
+fields (see SparseFieldsMixin), and project_products() defers the unused
+columns and leaves out the category and listing joins when nothing reads them.
+"""
+from .models import Products
+
+# Serializer fields that are read from a related row rather than a column
+_RELATED = {'category': 'category', 'tags': 'listing', 'arrival_status': 'listing'}
+
+_COLUMNS = [field.name for field in Products._meta.concrete_fields if not field.primary_key]
+
+
+class InvalidFieldset(ValueError):
+    pass
+
+
+def _split(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+def parse_fieldset(params, allowed):
+    """
+    Return the fields of `allowed` selected by the fields/exclude parameters,
+    in their usual order, or None when every field is wanted.
+    """
+    requested, excluded = _split(params.get('fields')), _split(params.get('exclude'))
+    if not requested and not excluded:
+        return None
+    unknown = (requested | excluded) - set(allowed)
+    if unknown:
+        raise InvalidFieldset(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [field for field in allowed if (not requested or field in requested) and field not in excluded]
+
+
+def project_products(queryset, fields, prefix=''):
+    """
+    Load only what the product fields need. `prefix` is the path to the
+    product from the queryset's model, e.g. 'product__' for wishlist entries.
+    """
+    if fields is None:
+        return queryset.select_related(f'{prefix}category', f'{prefix}listing')
+
+    related = {_RELATED[field] for field in fields if field in _RELATED}
+    needed = set(fields) | related
+    deferred = [f'{prefix}{column}' for column in _COLUMNS if column not in needed]
+    if related:
+        queryset = queryset.select_related(*[f'{prefix}{name}' for name in sorted(related)])
+    return queryset.defer(*deferred) if deferred else queryset
@@ -0,0 +1,84 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+
+from .fuzzy import fuzzy_search_products
+from .search import search_products
+
+# Query parameters with a fixed meaning; every other parameter is a tag type filter
+RESERVED_PARAMS = {
+    'arrival', 'category', 'keyword', 'price_min', 'price_max', 'cursor', 'page_size',
+    'fields', 'exclude', 'sort', 'format', 'fuzzy',
+}
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+def parse_price(value):
+    """Return the price bound as a Decimal, or None if it is missing or invalid"""
+    if value in (None, ''):
+        return None
+    try:
+        price = Decimal(str(value))
+    except (InvalidOperation, ValueError, TypeError):
+        return None
+    return price if price.is_finite() else None
+
+
+def parse_product_filters(params):
+    """Read the product filters out of the request query parameters"""
+    tag_filters = {}
+    for param, value in params.items():
+        if param in RESERVED_PARAMS:
+            continue
+        if value:
+            tag_filters[param] = value.split(',')
+
+    arrival = params.get('arrival', '')
+    return {
+        'arrival': arrival.split(',') if arrival else [],
+        'category': params.get('category', ''),
+        'keyword': params.get('keyword', ''),
+        'fuzzy': params.get('fuzzy', '').lower() in TRUE_VALUES,
+        'price_min': parse_price(params.get('price_min')),
+        'price_max': parse_price(params.get('price_max')),
+        'tags': tag_filters,
+    }
+
+
+def apply_product_filters(queryset, filters, facets=True):
+    """
+    Apply the filters from parse_product_filters to a Products queryset.
+    Pass facets=False when the tag, arrival and category filters have
+    already been applied through the facet index.
+    """
+    if filters['price_min'] is not None:
+        queryset = queryset.filter(price__gte=filters['price_min'])
+    if filters['price_max'] is not None:
+        queryset = queryset.filter(price__lte=filters['price_max'])
+
+    if facets:
+        # Tag values are OR'ed within a tag type and AND'ed across tag types
+        for tag_type, tag_values in filters['tags'].items():
+            tag_q = Q()
+            for tag_value in tag_values:
+                tag_q |= Q(tags__tag_type__name__iexact=tag_type, tags__name__iexact=tag_value)
+            queryset = queryset.filter(tag_q).distinct()
+
+        # Arrival status is stored as a tag of the 'Arrival' type
+        if filters['arrival']:
+            arrival_q = Q()
+            for value in filters['arrival']:
+                arrival_q |= Q(tags__name__iexact=value.title(), tags__tag_type__name='Arrival')
+            queryset = queryset.filter(arrival_q).distinct()
+
+        if filters['category']:
+            queryset = queryset.filter(category__name__iexact=filters['category']).distinct()
+
+    # Last, so fuzzy search keeps its best matches among the filtered products
+    if filters['keyword'] and filters['fuzzy']:
+        queryset, _ = fuzzy_search_products(queryset, filters['keyword'])
+    elif filters['keyword']:
+        queryset = search_products(queryset, filters['keyword'])
+
+    return queryset
@@ -0,0 +1,247 @@
+"""
+Typo-tolerant keyword search.
+
+With ?fuzzy=1, getProducts matches keywords against the words of product
+names and brands by edit distance instead of through FTS5. The per-process
+FuzzyIndex keeps every distinct word with the products using it, and a
+trigram index over the words: a misspelled word shares most of its trigrams
+with the intended one, so only words with enough trigrams in common have
+their edit distance computed, and that computation gives up as soon as the
+distance exceeds the bound. Like the facet index it is built on first use,
+kept current by the signal handlers in signals.py and rebuilt after
+FUZZY_INDEX_MAX_AGE seconds.
+
+Every keyword word has to be matched by some word of the product. Products
+are ranked by how closely their words match, and a "did you mean" suggestion
+replaces each keyword word missing from the catalog by its closest word.
+"""
+import json
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import IntegerField, Value
+from django.db.models.expressions import RawSQL
+
+from .autocomplete import normalize
+from .facets import ids_to_bits, restrict_to
+
+DEFAULT_MAX_DISTANCE = 2
+DEFAULT_MIN_SIMILARITY = 0.3
+DEFAULT_MAX_RESULTS = 500
+
+
+def words(text):
+    return re.findall(r'\w+', normalize(text))
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_distance(word):
+    """Short words tolerate fewer typos, or everything would match them"""
+    bound = getattr(settings, 'FUZZY_SEARCH_MAX_DISTANCE', DEFAULT_MAX_DISTANCE)
+    if len(word) <= 2:
+        return 0
+    if len(word) <= 5:
+        return min(bound, 1)
+    return bound
+
+
+def bounded_distance(a, b, bound):
+    """Levenshtein distance between a and b, or None once it exceeds bound"""
+    if abs(len(a) - len(b)) > bound:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, char_b in enumerate(b, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            )
+            row_min = min(row_min, current[j])
+        if row_min > bound:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= bound else None
+
+
+class FuzzyIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def rebuild(self):
+        from .models import Products
+
+        with self._lock:
+            self._postings = {}
+            self._grams = {}
+            self._products = {}
+            for product_id, name, brand in Products.objects.values_list('_id', 'productName', 'productBrand').iterator():
+                self._add(product_id, name, brand)
+            self._built_at = time.monotonic()
+
+    def _ensure_built(self):
+        max_age = getattr(settings, 'FUZZY_INDEX_MAX_AGE', 300)
+        if self._built_at is None or time.monotonic() - self._built_at > max_age:
+            self.rebuild()
+
+    def _add(self, product_id, name, brand):
+        product_words = set(words(name)) | set(words(brand))
+        self._products[product_id] = product_words
+        for word in product_words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = set()
+                for gram in trigrams(word):
+                    self._grams.setdefault(gram, set()).add(word)
+            postings.add(product_id)
+
+    def _remove(self, product_id):
+        for word in self._products.pop(product_id, ()):
+            postings = self._postings[word]
+            postings.discard(product_id)
+            if not postings:
+                del self._postings[word]
+                for gram in trigrams(word):
+                    self._grams[gram].discard(word)
+
+    # Incremental updates, called from the signal handlers
+
+    def update_product(self, product_id, name, brand):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove(product_id)
+            self._add(product_id, name, brand)
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove(product_id)
+
+    # Queries
+
+    def similar_words(self, word):
+        """[(distance, similarity, word)] for the catalog words within the edit distance bound, closest first"""
+        bound = max_distance(word)
+        if bound == 0:
+            return [(0, 1.0, word)] if word in self._postings else []
+        min_similarity = getattr(settings, 'FUZZY_SEARCH_MIN_SIMILARITY', DEFAULT_MIN_SIMILARITY)
+        grams = trigrams(word)
+        shared = {}
+        for gram in grams:
+            for other in self._grams.get(gram, ()):
+                shared[other] = shared.get(other, 0) + 1
+
+        matches = []
+        for other, count in shared.items():
+            similarity = count / (len(grams) + len(trigrams(other)) - count)
+            if similarity < min_similarity:
+                continue
+            distance = bounded_distance(word, other, bound)
+            if distance is not None:
+                matches.append((distance, similarity, other))
+        # Closest first, then the more common word
+        matches.sort(key=lambda match: (match[0], -match[1], -len(self._postings[match[2]]), match[2]))
+        return matches
+
+    def search(self, keyword):
+        """
+        Return (ranked product ids, suggestion) with every matching product.
+        The suggestion is the keyword with its unknown words corrected, or
+        None when every word is known.
+        """
+        query = words(keyword)
+        if not query:
+            return [], None
+        with self._lock:
+            self._ensure_built()
+            scores = None
+            corrected = []
+            for word in query:
+                matches = self.similar_words(word)
+                corrected.append(matches[0][2] if matches else word)
+                if scores is not None and not scores:
+                    continue
+                word_scores = {}
+                for distance, similarity, other in matches:
+                    score = 1 - distance / len(word) + similarity
+                    for product_id in self._postings[other]:
+                        if score > word_scores.get(product_id, -1):
+                            word_scores[product_id] = score
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {pid: score + word_scores[pid] for pid, score in scores.items() if pid in word_scores}
+
+        ranked = sorted(scores, key=lambda pid: (-scores[pid], pid))
+        return ranked, (' '.join(corrected) if corrected != query else None)
+
+    def did_you_mean(self, keyword):
+        """The suggestion search() would give, without collecting products"""
+        query = words(keyword)
+        with self._lock:
+            self._ensure_built()
+            corrected = []
+            for word in query:
+                matches = self.similar_words(word)
+                corrected.append(matches[0][2] if matches else word)
+        return ' '.join(corrected) if corrected != query else None
+
+
+fuzzy_index = FuzzyIndex()
+
+
+def fuzzy_search_products(queryset, keyword):
+    """
+    Filter a Products queryset to the fuzzy keyword matches, annotated with
+    search_rank (their position, lower is more relevant) like search_products.
+    At most FUZZY_SEARCH_MAX_RESULTS matches are kept: the best ones that
+    pass the queryset's own filters, so apply those first. Returns
+    (queryset, suggestion).
+    """
+    ranked, suggestion = fuzzy_index.search(keyword)
+    limit = getattr(settings, 'FUZZY_SEARCH_MAX_RESULTS', DEFAULT_MAX_RESULTS)
+    if len(ranked) > limit:
+        # Take the filtered matches a limit's worth at a time, best first
+        kept = []
+        for start in range(0, len(ranked), limit):
+            batch = ranked[start:start + limit]
+            passing = set(restrict_to(queryset, ids_to_bits(batch)).values_list('_id', flat=True))
+            kept += [product_id for product_id in batch if product_id in passing]
+            if len(kept) >= limit:
+                break
+        ranked = kept[:limit]
+    if not ranked:
+        return queryset.none().annotate(search_rank=Value(0, output_field=IntegerField())), suggestion
+    return restrict_to(queryset, ids_to_bits(ranked)).annotate(search_rank=_rank(queryset, ranked)), suggestion
+
+
+def _rank(queryset, ranked):
+    """Each product's position in ranked, as an SQL expression"""
+    column = f'"{queryset.model._meta.db_table}"."_id"'
+    if connections[queryset.db].vendor == 'sqlite':
+        # The position is the key of the id in one JSON array parameter, as
+        # restrict_to() passes ids, so the query binds two variables in all
+        return RawSQL(
+            f'(SELECT key FROM json_each(%s) WHERE value = {column})', [json.dumps(ranked)], output_field=IntegerField(),
+        )
+    # One simple CASE rather than Case(When(...)) per match, which costs the
+    # ORM more to build than the query takes to run
+    whens = ' '.join(['WHEN %s THEN %s'] * len(ranked))
+    params = [value for position, product_id in enumerate(ranked) for value in (product_id, position)]
+    return RawSQL(f'CASE {column} {whens} END', params, output_field=IntegerField())
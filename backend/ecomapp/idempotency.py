@@ -0,0 +1,117 @@
+"""
+Idempotency-Key support for write endpoints.
+
+Clients that may retry a write (on a timeout, say) send the same
+Idempotency-Key header with every attempt. The first attempt runs the view
+and stores its response under the key; retries get the stored response back
+from one indexed lookup, marked with Idempotent-Replayed: true, without the
+view running again. A key sent with a different request body is rejected.
+
+The view and the stored response are written in one transaction. When two
+attempts with the same key race, the one committing second fails on the
+unique key, its writes are rolled back and it replays the first one's
+response. Conflicts (409) and server errors aren't stored, so those can be
+retried with the same key. Keys are kept for IDEMPOTENCY_KEY_TTL seconds;
+purge_idempotency_keys deletes expired ones.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = 24 * 60 * 60
+
+# Outcomes a retry may change
+UNSTORED_STATUSES = {status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS}
+
+
+class KeyTaken(Exception):
+    """A concurrent request with the same key committed first"""
+
+
+def request_scope(request):
+    # Keys are per endpoint and per user, so nobody can replay another user's response
+    user_id = request.user.pk if request.user.is_authenticated else '-'
+    return f'{request.resolver_match.url_name}:{user_id}'
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response(
+            {'detail': f'{HEADER} was already used with a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view):
+    """Honour Idempotency-Key on a DRF function view; goes below @api_view"""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        scope, fingerprint = request_scope(request), request_fingerprint(request)
+        now = timezone.now()
+        record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+        if record is not None:
+            if record.expires_at > now:
+                return replay(record, fingerprint)
+            record.delete()
+
+        try:
+            with transaction.atomic():
+                response = view(request, *args, **kwargs)
+                if response.status_code < 500 and response.status_code not in UNSTORED_STATUSES:
+                    try:
+                        IdempotencyKey.objects.create(
+                            key=key,
+                            scope=scope,
+                            fingerprint=fingerprint,
+                            status_code=response.status_code,
+                            response=response.data,
+                            expires_at=now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', DEFAULT_TTL)),
+                        )
+                    except IntegrityError:
+                        # Leaving the block rolls the whole attempt back
+                        raise KeyTaken
+        except KeyTaken:
+            # Everything this attempt wrote has been rolled back
+            return replay(IdempotencyKey.objects.get(scope=scope, key=key), fingerprint)
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys(batch_size=1000):
+    """Delete expired keys a batch at a time; returns how many were deleted"""
+    deleted = 0
+    now = timezone.now()
+    while True:
+        batch = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=batch).delete()[0]
@@ -0,0 +1,140 @@
+"""
+Resized product image derivatives.
+
+Each product image gets a copy per PRODUCT_IMAGE_VARIANTS size (grid, detail,
+zoom) in every PRODUCT_IMAGE_FORMATS format, stored under derived/ in the
+media storage. File names carry a hash of the source bytes and the variant
+settings, so a file never changes once written and can be cached forever;
+a new upload or new settings produce new names. The names are kept in
+Products.imageVariants together with the source image name they were made
+from, and ProductsSerializer turns them into URLs.
+
+Derivatives are generated once a product saved with a new image is
+committed (see signals.py), after catalog imports, and for existing images by
+the generate_image_variants command.
+This module avoids importing models at load time so the command's worker
+processes can use it without the app registry.
+"""
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger('ecomapp.images')
+
+DERIVED_DIR = 'derived'
+
+DEFAULT_VARIANTS = {'grid': 400, 'detail': 800, 'zoom': 1600}
+DEFAULT_FORMATS = ['webp', 'jpeg']
+DEFAULT_QUALITY = 82
+
+_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def variant_settings():
+    return (
+        getattr(settings, 'PRODUCT_IMAGE_VARIANTS', DEFAULT_VARIANTS),
+        getattr(settings, 'PRODUCT_IMAGE_FORMATS', DEFAULT_FORMATS),
+        getattr(settings, 'PRODUCT_IMAGE_QUALITY', DEFAULT_QUALITY),
+    )
+
+
+def _settings_key():
+    return hashlib.sha256(repr(variant_settings()).encode()).hexdigest()[:12]
+
+
+def _encode(image, format, quality):
+    if format == 'jpeg' and image.mode != 'RGB':
+        # JPEG has no alpha channel; flatten transparent images onto white
+        background = Image.new('RGB', image.size, 'white')
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif format == 'webp' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    options = {'optimize': True} if format == 'jpeg' else {'method': 4}
+    buffer = BytesIO()
+    image.save(buffer, format=format.upper(), quality=quality, **options)
+    return buffer.getvalue()
+
+
+def generate_variants(source_name, storage=None):
+    """
+    Write the derivatives of one media file and return its imageVariants
+    manifest: {'source': name, 'settings': key, 'grid': {'webp': name, 'jpeg': name}, ...}.
+    Derivatives already present under the same name are not rewritten.
+    """
+    storage = storage or default_storage
+    variants, formats, quality = variant_settings()
+    with storage.open(source_name, 'rb') as f:
+        data = f.read()
+
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    source_hash = hashlib.sha256(data).hexdigest()
+    manifest = {'source': source_name, 'settings': _settings_key()}
+    original = None
+    for variant, size in variants.items():
+        manifest[variant] = {}
+        for format in formats:
+            spec = f'{source_hash}:{variant}:{size}:{format}:{quality}'
+            digest = hashlib.sha256(spec.encode()).hexdigest()[:12]
+            name = f'{DERIVED_DIR}/{stem}-{variant}-{digest}.{_EXTENSIONS[format]}'
+            if not storage.exists(name):
+                if original is None:
+                    original = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+                    original.load()
+                resized = original.copy()
+                resized.thumbnail((size, size), Image.LANCZOS)
+                storage.save(name, ContentFile(_encode(resized, format, quality)))
+            manifest[variant][format] = name
+    return manifest
+
+
+def variants_current(image_name, manifest):
+    """True when the manifest was made from this image with the current settings"""
+    if not image_name:
+        return not manifest
+    return bool(manifest) and manifest.get('source') == image_name and manifest.get('settings') == _settings_key()
+
+
+def variant_urls(manifest, storage=None):
+    """Turn a manifest into {'grid': {'webp': url, 'jpeg': url}, ...}"""
+    storage = storage or default_storage
+    return {
+        variant: {format: storage.url(name) for format, name in files.items()}
+        for variant, files in (manifest or {}).items()
+        if isinstance(files, dict)
+    }
+
+
+def refresh_product_variants(product):
+    """Bring one product's derivatives up to date; returns True if it changed"""
+    from .models import Products
+
+    image_name = product.image.name if product.image else ''
+    if variants_current(image_name, product.imageVariants):
+        return False
+    try:
+        product.imageVariants = generate_variants(image_name) if image_name else {}
+    except (OSError, UnidentifiedImageError) as e:
+        # A missing or unreadable upload shouldn't stop the product saving
+        logger.warning('Could not make image variants for product %s from %s: %s', product._id, image_name, e)
+        return False
+    # update() rather than save() so the post_save handlers don't run again, and
+    # only while the product still has this image
+    unchanged = Q(image=image_name) if image_name else Q(image='') | Q(image__isnull=True)
+    return bool(Products.objects.filter(unchanged, _id=product._id).update(imageVariants=product.imageVariants))
+
+
+def variants_job(source_name):
+    """generate_variants() for worker processes: returns (name, manifest, error)"""
+    try:
+        return source_name, generate_variants(source_name), None
+    except (OSError, UnidentifiedImageError) as e:
+        return source_name, None, str(e)
@@ -0,0 +1,251 @@
+"""
+Bulk catalog import from CSV or JSON Lines.
+
+Rows are matched to existing products by sku. Each batch runs in one
+transaction: existing products are loaded with a single query and written
+back with bulk_update, new ones go in with bulk_create, and rows that list
+tags have their product's tag links replaced through bulk writes to the
+through table. Categories, tag types and tags are resolved through in-memory
+name lookups and created the first time they are seen. Bulk writes skip model
+signals, so every batch ends with catalog_bulk_changed(), and similar
+products are recomputed once the whole file is in.
+
+Columns are the Products field names (productName, productBrand, productInfo,
+image, price, rating, numReviews, stockCount) plus sku, category and tags.
+Tags are "Type:Value" pairs, separated by "|" in CSV; JSONL rows may also give
+a list of pairs or an object mapping each tag type to a value or list of values.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from .caching import bump_catalog_generation
+from .models import Category, Products, Tag, TagType
+from .recommendations import refresh_similar
+
+TEXT_FIELDS = ['productName', 'productBrand', 'productInfo', 'image']
+DECIMAL_FIELDS = ['price', 'rating']
+INTEGER_FIELDS = ['numReviews', 'stockCount']
+
+_MISSING = object()
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_rows(stream, format):
+    """Yield (line number, record) pairs from a CSV or JSONL text stream"""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_number, line
+
+
+def parse_tags(value):
+    """Return the (tag type, tag name) pairs of a tags cell; the type may be None"""
+    if isinstance(value, dict):
+        pairs = []
+        for tag_type, names in value.items():
+            for name in names if isinstance(names, list) else [names]:
+                pairs.append((tag_type, str(name)))
+    else:
+        if isinstance(value, str):
+            value = value.split('|')
+        elif not isinstance(value, list):
+            raise ImportRowError('tags must be a string, list or object')
+        pairs = []
+        for item in value:
+            tag_type, _, name = str(item).rpartition(':')
+            pairs.append((tag_type or None, name))
+
+    tags = []
+    for tag_type, name in pairs:
+        tag_type = tag_type.strip() if tag_type else None
+        name = name.strip()
+        if name and (tag_type, name) not in tags:
+            tags.append((tag_type, name))
+    return tags
+
+
+def parse_row(record):
+    """Return (sku, field values, category name or _MISSING, tags or None) for one input row"""
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise ImportRowError(f'invalid JSON: {e}')
+    if not isinstance(record, dict):
+        raise ImportRowError('row must be an object')
+
+    sku = str(record.get('sku') or '').strip()
+    if not sku:
+        raise ImportRowError('sku is required')
+
+    values = {}
+    for field in TEXT_FIELDS:
+        if field in record:
+            values[field] = str(record[field]).strip() if record[field] not in (None, '') else None
+    for field in DECIMAL_FIELDS:
+        if field in record:
+            try:
+                values[field] = Decimal(str(record[field])) if record[field] not in (None, '') else None
+            except InvalidOperation:
+                raise ImportRowError(f'{field} is not a number: {record[field]!r}')
+    for field in INTEGER_FIELDS:
+        if field in record:
+            try:
+                values[field] = int(record[field]) if record[field] not in (None, '') else 0
+            except (TypeError, ValueError):
+                raise ImportRowError(f'{field} is not a whole number: {record[field]!r}')
+
+    category = _MISSING
+    if 'category' in record:
+        category = str(record['category']).strip() if record['category'] not in (None, '') else None
+    tags = parse_tags(record['tags'] or '') if 'tags' in record else None
+    return sku, values, category, tags
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=1000, log=None):
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.counts = {'created': 0, 'updated': 0, 'skipped': 0, 'categories': 0, 'tag_types': 0, 'tags': 0}
+        self.categories = {name.lower(): pk for pk, name in Category.objects.values_list('id', 'name')}
+        self.tag_types = {name.lower(): pk for pk, name in TagType.objects.values_list('id', 'name')}
+        self.tags = {}
+        self.product_ids = set()
+        for pk, name, tag_type_id in Tag.objects.values_list('id', 'name', 'tag_type_id'):
+            self.tags.setdefault((tag_type_id, name.lower()), pk)
+
+    def run(self, rows):
+        """Import (line number, record) pairs and return the counts"""
+        started = time.perf_counter()
+        imported = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.batch_size))
+            if not chunk:
+                break
+            batch = {}
+            for line_number, record in chunk:
+                try:
+                    sku, values, category, tags = parse_row(record)
+                except ImportRowError as e:
+                    self.counts['skipped'] += 1
+                    self.log(f'Line {line_number}: skipped, {e}')
+                    continue
+                # A sku repeated within a batch keeps its last row
+                batch[sku] = (values, category, tags)
+            self.import_batch(batch)
+            imported += len(batch)
+            elapsed = time.perf_counter() - started
+            self.log(f'{imported} rows imported ({imported / elapsed:.0f} rows/s)')
+        if self.product_ids:
+            refresh_similar(self.product_ids, bulk=True)
+            bump_catalog_generation()
+        self.counts['seconds'] = round(time.perf_counter() - started, 3)
+        return self.counts
+
+    def import_batch(self, batch):
+        from .signals import catalog_bulk_changed
+
+        if not batch:
+            return
+        with transaction.atomic():
+            self._resolve_categories({category for _, category, _ in batch.values() if category not in (None, _MISSING)})
+            self._resolve_tags({tag for _, _, tags in batch.values() for tag in tags or ()})
+
+            existing = Products.objects.in_bulk(list(batch), field_name='sku')
+            new, changed, fields = [], [], set()
+            for sku, (values, category, tags) in batch.items():
+                product = existing.get(sku)
+                if product is None:
+                    product = Products(sku=sku)
+                    new.append(product)
+                else:
+                    changed.append(product)
+                for field, value in values.items():
+                    setattr(product, field, value)
+                    fields.add(field)
+                if category is not _MISSING:
+                    product.category_id = self.categories[category.lower()] if category else None
+                    fields.add('category')
+
+            Products.objects.bulk_create(new, batch_size=self.batch_size)
+            if changed and fields:
+                Products.objects.bulk_update(changed, sorted(fields), batch_size=self.batch_size)
+            self.counts['created'] += len(new)
+            self.counts['updated'] += len(changed)
+
+            product_ids = {product.sku: product._id for product in new + changed}
+            if None in product_ids.values():
+                # The backend can't return ids from a bulk insert
+                product_ids = dict(Products.objects.filter(sku__in=list(batch)).values_list('sku', '_id'))
+            self._replace_tags(batch, product_ids)
+            self.product_ids.update(product_ids.values())
+            catalog_bulk_changed(product_ids.values(), similar=False)
+
+    def _resolve_categories(self, names):
+        missing = {}
+        for name in names:
+            if name.lower() not in self.categories:
+                missing.setdefault(name.lower(), name)
+        if not missing:
+            return
+        Category.objects.bulk_create([Category(name=name) for name in missing.values()], ignore_conflicts=True)
+        for pk, name in Category.objects.filter(name__in=missing.values()).values_list('id', 'name'):
+            self.categories[name.lower()] = pk
+        self.counts['categories'] += len(missing)
+
+    def _resolve_tags(self, tags):
+        missing_types = {}
+        for tag_type, _ in tags:
+            if tag_type is not None and tag_type.lower() not in self.tag_types:
+                missing_types.setdefault(tag_type.lower(), tag_type)
+        if missing_types:
+            TagType.objects.bulk_create([TagType(name=name) for name in missing_types.values()], ignore_conflicts=True)
+            for pk, name in TagType.objects.filter(name__in=missing_types.values()).values_list('id', 'name'):
+                self.tag_types[name.lower()] = pk
+            self.counts['tag_types'] += len(missing_types)
+
+        missing = {}
+        for tag_type, name in tags:
+            key = (self.tag_types[tag_type.lower()] if tag_type else None, name.lower())
+            if key not in self.tags:
+                missing.setdefault(key, Tag(name=name, tag_type_id=key[0]))
+        if missing:
+            Tag.objects.bulk_create(missing.values())
+            type_ids = {tag_type_id for tag_type_id, _ in missing}
+            created = Tag.objects.filter(name__in=[tag.name for tag in missing.values()])
+            for pk, name, tag_type_id in created.values_list('id', 'name', 'tag_type_id'):
+                if tag_type_id in type_ids:
+                    self.tags.setdefault((tag_type_id, name.lower()), pk)
+            self.counts['tags'] += len(missing)
+
+    def _tag_id(self, tag_type, name):
+        return self.tags[(self.tag_types[tag_type.lower()] if tag_type else None, name.lower())]
+
+    def _replace_tags(self, batch, product_ids):
+        tagged = {sku: tags for sku, (_, _, tags) in batch.items() if tags is not None}
+        if not tagged:
+            return
+        Through = Products.tags.through
+        Through.objects.filter(products_id__in=[product_ids[sku] for sku in tagged]).delete()
+        links = {
+            (product_ids[sku], self._tag_id(tag_type, name))
+            for sku, tags in tagged.items()
+            for tag_type, name in tags
+        }
+        Through.objects.bulk_create(
+            [Through(products_id=product_id, tag_id=tag_id) for product_id, tag_id in links],
+            batch_size=self.batch_size,
+        )
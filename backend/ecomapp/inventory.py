@@ -0,0 +1,160 @@
+"""
+Stock adjustments.
+
+adjust_stock() applies a batch of (product, delta) lines all or nothing in one
+transaction. The products are read (and locked, where the database has row
+locks) in one query with their stock and the units other users have
+reserved, and the lines are run through in order before anything is
+written: a line fails when it takes more than the lines before it left over
+those reservations. If a product doesn't exist or a line fails, nothing is
+written and the error has a status for every line. The changes are then
+written per product with one conditional UPDATE, which only changes products
+that still cover the lowest point their lines reach, so a concurrent write on
+a database without row locks fails the batch rather than taking the same
+units twice. Sharded products (see stock_shards.py) are taken from their
+shards, and restocks are added to a random shard.
+
+Every line is appended to the InventoryLedger with the product's stock after
+it, so the stock of a product can be audited, or rebuilt from a known point,
+by replaying its ledger.
+"""
+import uuid
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.db.models.functions import Coalesce
+from rest_framework import status
+
+from .models import InventoryLedger, Products
+from .reservations import reserved_by_others, with_available
+from .stock_shards import add_sharded, take_sharded
+
+DEFAULT_MAX_LINES = 500
+
+
+class AdjustmentError(Exception):
+    """A batch that can't be applied, with the response status and a result per line"""
+
+    def __init__(self, detail, status=status.HTTP_400_BAD_REQUEST, lines=None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+        self.lines = lines
+
+
+def parse_adjustments(items):
+    """Return [(product id, delta)], raising AdjustmentError for malformed lines"""
+    if not isinstance(items, list) or not items:
+        raise AdjustmentError('No adjustments')
+    max_lines = getattr(settings, 'STOCK_ADJUST_MAX_LINES', DEFAULT_MAX_LINES)
+    if len(items) > max_lines:
+        raise AdjustmentError(f'At most {max_lines} adjustments can be made at once')
+    lines = []
+    for item in items:
+        try:
+            product_id, delta = int(item['product_id']), int(item['delta'])
+        except (KeyError, TypeError, ValueError):
+            raise AdjustmentError('Each adjustment needs an integer product_id and delta')
+        if delta == 0:
+            raise AdjustmentError('Invalid delta')
+        lines.append((product_id, delta))
+    return lines
+
+
+def _results(lines, statuses):
+    return [
+        {'product_id': product_id, 'delta': delta, 'status': status}
+        for (product_id, delta), status in zip(lines, statuses)
+    ]
+
+
+def take_plain(changes, user=None):
+    """
+    Apply {product id: (net delta, lowest running delta)} to unsharded
+    products in one UPDATE. Each product has to cover its lowest point plus
+    the units other users hold. Returns False when one no longer does,
+    which leaves the caller's transaction to roll back.
+    """
+    held = reserved_by_others(user)
+    enough = reduce(or_, (
+        Q(_id=product_id, stockCount__gte=held - low) if low < 0 else Q(_id=product_id)
+        for product_id, (_, low) in changes.items()
+    ))
+    updated = Products.objects.filter(enough).update(
+        stockCount=Case(*[
+            When(_id=product_id, then=Coalesce(F('stockCount'), 0) + net) for product_id, (net, _) in changes.items()
+        ]),
+    )
+    return updated == len(changes)
+
+
+def adjust_stock(lines, user=None, reason=''):
+    """
+    Apply [(product id, delta)] in one transaction and record them in the
+    ledger. Returns (results, products): a result per line with the
+    product's stock after it, and the adjusted products. Raises
+    AdjustmentError, with a status per line and nothing written, when a
+    product doesn't exist or a line takes more than is left, after the lines
+    before it, over other users' reservations.
+    """
+    product_ids = list(dict.fromkeys(product_id for product_id, _ in lines))
+
+    with transaction.atomic():
+        products = with_available(Products.objects.select_for_update(), user).in_bulk(product_ids, field_name='_id')
+        if len(products) != len(product_ids):
+            raise AdjustmentError('Product not found', status.HTTP_404_NOT_FOUND, _results(
+                lines, ['ok' if product_id in products else 'not_found' for product_id, _ in lines],
+            ))
+
+        # Run through the lines in order; a line fails when it takes stock that isn't there
+        stock = {product_id: product.stock for product_id, product in products.items()}
+        low = dict.fromkeys(product_ids, 0)
+        statuses, stock_after = [], []
+        for product_id, delta in lines:
+            if delta < 0 and stock[product_id] + delta < products[product_id].reserved:
+                statuses.append('insufficient_stock')
+                stock_after.append(stock[product_id])
+                continue
+            stock[product_id] += delta
+            low[product_id] = min(low[product_id], stock[product_id] - products[product_id].stock)
+            statuses.append('ok')
+            stock_after.append(stock[product_id])
+        if 'insufficient_stock' in statuses:
+            raise AdjustmentError('Not enough stock available', status.HTTP_400_BAD_REQUEST, _results(lines, statuses))
+
+        net = {product_id: stock[product_id] - products[product_id].stock for product_id in product_ids}
+        sharded = {product_id: product.stockShards for product_id, product in products.items() if product.stockShards}
+        plain = {product_id: (net[product_id], low[product_id]) for product_id in product_ids if product_id not in sharded}
+        applied = not plain or take_plain(plain, user)
+        for product_id, shards in sharded.items():
+            # Take the lowest point first, so the shards had to cover it, then add back the rest
+            if low[product_id] < 0 and not take_sharded(
+                product_id, shards, -low[product_id], count_sold=False, held=reserved_by_others(user, product_id),
+            ):
+                applied = False
+                break
+            if net[product_id] > low[product_id]:
+                add_sharded(product_id, shards, net[product_id] - low[product_id])
+        if not applied:
+            # Stock was taken since the read, on a database without row locks or from a shard
+            raise AdjustmentError('Stock changed while adjusting it, please try again', status.HTTP_409_CONFLICT)
+
+        batch = uuid.uuid4()
+        recorded_by = user if user is not None and user.is_authenticated else None
+        InventoryLedger.objects.bulk_create([
+            InventoryLedger(
+                batch=batch, product_id=product_id, delta=delta, stock_after=after, reason=reason, user=recorded_by,
+            )
+            for (product_id, delta), after in zip(lines, stock_after)
+        ])
+
+    for product_id, product in products.items():
+        product.stockCount = stock[product_id]
+    results = [
+        {'product_id': product_id, 'delta': delta, 'status': 'ok', 'stockCount': after}
+        for (product_id, delta), after in zip(lines, stock_after)
+    ]
+    return results, list(products.values())
@@ -0,0 +1,78 @@
+"""
+Maintenance of the ProductListing projection.
+
+Product responses need each product's tags (with their type and color) and its
+arrival status. Computing those per product costs several queries, so they are
+rendered once into ProductListing whenever a product, tag or tag type changes,
+and serializers read them through a single select_related join.
+"""
+from django.db.models import Prefetch
+
+from .models import Products, ProductListing, Tag
+
+REFRESH_BATCH_SIZE = 500
+
+
+def tag_sort_key(tag):
+    # Same order as Tag.Meta.ordering, untyped tags first
+    return (tag.tag_type is not None, tag.tag_type.name if tag.tag_type else '', tag.name)
+
+
+def render_tags(tags):
+    return [
+        {
+            'id': tag.id,
+            'name': tag.name,
+            'tag_type': tag.tag_type.name if tag.tag_type else 'Uncategorized',
+            'color': tag.tag_type.color if tag.tag_type else 'secondary',
+        }
+        for tag in sorted(tags, key=tag_sort_key)
+    ]
+
+
+def arrival_status(tags):
+    for tag in sorted(tags, key=tag_sort_key):
+        if tag.tag_type and tag.tag_type.name == 'Arrival':
+            return tag.name.lower()
+    return 'classic'
+
+
+def build_listing(product):
+    """Render the projection row for a product with its tags prefetched"""
+    tags = list(product.tags.all())
+    return ProductListing(
+        product=product,
+        tags=render_tags(tags),
+        arrival_status=arrival_status(tags),
+    )
+
+
+def refresh_listings(product_ids):
+    """Re-render the projection for the given products"""
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), REFRESH_BATCH_SIZE):
+        batch = product_ids[start:start + REFRESH_BATCH_SIZE]
+        products = Products.objects.filter(_id__in=batch).prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.select_related('tag_type'))
+        )
+        ProductListing.objects.bulk_create(
+            [build_listing(product) for product in products],
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['tags', 'arrival_status', 'updated_at'],
+        )
+
+
+def rebuild_all_listings():
+    refresh_listings(Products.objects.values_list('_id', flat=True).iterator())
+    return ProductListing.objects.count()
+
+
+def get_listing(product):
+    """Return the product's projection row, rendering it if it is missing"""
+    try:
+        return product.listing
+    except ProductListing.DoesNotExist:
+        refresh_listings([product.pk])
+        product.listing = ProductListing.objects.get(product_id=product.pk)
+        return product.listing
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand
+from ecomapp.benchmarks import run_benchmarks
+
+class Command(BaseCommand):
+    help = 'Benchmarks the catalog endpoints at several catalog sizes, each in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000', help='Comma-separated catalog sizes')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per scenario')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cache', action='store_true', help='Leave the product listing cache enabled')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        report = run_benchmarks(
+            sizes,
+            iterations=options['iterations'],
+            seed=options['seed'],
+            use_cache=options['cache'],
+            log=self.stdout.write,
+        )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from ecomapp.reservations import expire_reservations
+
+class Command(BaseCommand):
+    help = 'Deletes cart reservations that have passed their expiry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reservations deleted per query')
+
+    def handle(self, *args, **options):
+        count = expire_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Expired {count} reservations'))
@@ -0,0 +1,62 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from ecomapp.caching import bump_catalog_generation
+from ecomapp.images import variants_current, variants_job
+from ecomapp.models import Products
+
+class Command(BaseCommand):
+    help = 'Generates the resized image variants for products that are missing them or have out-of-date ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes resizing images (1 resizes in this process)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Products updated per query')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        started = time.perf_counter()
+        stale = {}
+        for product_id, image, manifest in Products.objects.exclude(image='').exclude(image=None).values_list(
+                '_id', 'image', 'imageVariants').iterator():
+            if not variants_current(image, manifest):
+                stale.setdefault(image, []).append(product_id)
+        if not stale:
+            self.stdout.write(self.style.SUCCESS('All image variants are up to date'))
+            return
+        self.stdout.write(f'Generating variants for {len(stale)} images used by '
+                          f'{sum(len(ids) for ids in stale.values())} products')
+
+        if options['workers'] == 1:
+            results = map(variants_job, stale)
+        else:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=options['workers'])
+            results = executor.map(variants_job, stale, chunksize=4)
+
+        updated, failed = [], 0
+        try:
+            for image, manifest, error in results:
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{image}: {error}')
+                    continue
+                updated += [Products(_id=product_id, imageVariants=manifest) for product_id in stale[image]]
+        finally:
+            if options['workers'] > 1:
+                executor.shutdown()
+
+        Products.objects.bulk_update(updated, ['imageVariants'], batch_size=options['batch_size'])
+        # bulk_update sends no signals; product responses include the variant URLs
+        bump_catalog_generation()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {len(updated)} products from {len(stale) - failed} images in {elapsed:.1f}s'
+            + (f', {failed} images failed' if failed else '')
+        ))
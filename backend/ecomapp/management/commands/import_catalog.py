@@ -0,0 +1,52 @@
+import os
+import sys
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from ecomapp.importer import CatalogImporter, read_rows
+
+class Command(BaseCommand):
+    help = 'Imports products from a CSV or JSON Lines file, matching existing products by sku'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction')
+        parser.add_argument('--image-workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes resizing the imported images (see generate_image_variants)')
+        parser.add_argument('--skip-image-variants', action='store_true',
+                            help='Leave resizing the imported images to a later generate_image_variants run')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format']
+        if format is None:
+            extension = os.path.splitext(path)[1].lower()
+            if extension not in ('.csv', '.jsonl', '.ndjson'):
+                raise CommandError('Cannot tell the format from the file name; pass --format csv or --format jsonl')
+            format = 'csv' if extension == '.csv' else 'jsonl'
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        importer = CatalogImporter(batch_size=options['batch_size'], log=self.stdout.write)
+        if path == '-':
+            counts = importer.run(read_rows(sys.stdin, format))
+        else:
+            try:
+                # utf-8-sig drops the byte order mark spreadsheet exports start with
+                with open(path, newline='', encoding='utf-8-sig') as stream:
+                    counts = importer.run(read_rows(stream, format))
+            except OSError as e:
+                raise CommandError(f'Cannot read {path}: {e}')
+
+        rows = counts['created'] + counts['updated']
+        rate = rows / counts['seconds'] if counts['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {rows} products ({counts['created']} created, {counts['updated']} updated, "
+            f"{counts['skipped']} skipped) with {counts['categories']} new categories, "
+            f"{counts['tag_types']} new tag types and {counts['tags']} new tags "
+            f"in {counts['seconds']:.1f}s ({rate:.0f} rows/s)"
+        ))
+        # Bulk writes skip the post_save handler that resizes new images
+        if rows and not options['skip_image_variants']:
+            call_command('generate_image_variants', workers=options['image_workers'], stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from ecomapp.idempotency import purge_expired_keys
+
+class Command(BaseCommand):
+    help = 'Deletes Idempotency-Key records older than IDEMPOTENCY_KEY_TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Keys deleted per query')
+
+    def handle(self, *args, **options):
+        count = purge_expired_keys(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired idempotency keys'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from ecomapp.caching import bump_catalog_generation
+from ecomapp.models import Products
+from ecomapp.stock_shards import reshard
+
+class Command(BaseCommand):
+    help = 'Spreads the remaining stock of sharded products evenly over their shards, or turns sharding on or off'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int, help='Products to rebalance; every sharded product by default')
+        parser.add_argument('--shards', type=int, help='Number of stock counters to split the products over')
+        parser.add_argument('--disable', action='store_true', help='Move the products back to a single stock counter')
+
+    def handle(self, *args, **options):
+        if options['shards'] is not None:
+            if options['disable']:
+                raise CommandError('Pass either --shards or --disable')
+            if not 1 <= options['shards'] <= 255:
+                raise CommandError('--shards must be between 1 and 255; use --disable to turn sharding off')
+        shards = 0 if options['disable'] else options['shards']
+        product_ids = options['product_ids']
+        if not product_ids:
+            if shards:
+                raise CommandError('Name the products to shard')
+            product_ids = list(Products.objects.filter(stockShards__gt=0).values_list('_id', flat=True))
+
+        for product_id in product_ids:
+            try:
+                stock = reshard(product_id, shards)
+            except Products.DoesNotExist:
+                raise CommandError(f'Product {product_id} not found')
+            self.stdout.write(f'Product {product_id}: {stock} in stock')
+        if product_ids:
+            bump_catalog_generation()
+        self.stdout.write(self.style.SUCCESS(f'Rebalanced {len(product_ids)} products'))
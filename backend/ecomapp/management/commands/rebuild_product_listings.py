@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from ecomapp.listings import rebuild_all_listings
+
+class Command(BaseCommand):
+    help = 'Re-renders the ProductListing projection for every product'
+
+    def handle(self, *args, **kwargs):
+        count = rebuild_all_listings()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} product listings'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from ecomapp.search import ensure_search_schema, rebuild_search_index
+
+class Command(BaseCommand):
+    help = 'Recreates the FTS5 product search table and reindexes every product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not ensure_search_schema(using):
+            raise CommandError('Full-text search needs an SQLite database with FTS5 support')
+        rebuild_search_index(using)
+        self.stdout.write(self.style.SUCCESS('Rebuilt the product search index'))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+from ecomapp.caching import bump_catalog_generation
+from ecomapp.recommendations import rebuild_all_similar
+
+class Command(BaseCommand):
+    help = 'Recomputes the similar products of every product'
+
+    def handle(self, *args, **kwargs):
+        started = time.perf_counter()
+        count = rebuild_all_similar()
+        bump_catalog_generation()
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {count} similar product links in {time.perf_counter() - started:.1f}s'
+        ))
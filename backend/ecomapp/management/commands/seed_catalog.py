@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ecomapp.seed import seed_catalog
+
+class Command(BaseCommand):
+    help = 'Seeds synthetic categories, tags, products, users, orders and wishlist entries for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--tag-types', type=int, default=5)
+        parser.add_argument('--tags-per-type', type=int, default=6)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--wishlist', type=int, default=300)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with transaction.atomic():
+            counts = seed_catalog(
+                products=options['products'],
+                categories=options['categories'],
+                tag_types=options['tag_types'],
+                tags_per_type=options['tags_per_type'],
+                users=options['users'],
+                orders=options['orders'],
+                wishlist=options['wishlist'],
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+                log=self.stdout.write,
+            )
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Seeded {summary} in {elapsed:.1f}s'))
@@ -0,0 +1,181 @@
+"""
+Serving uploaded media (product images and their derivatives).
+
+serve_media replaces django.conf.urls.static, which only works with DEBUG on
+and reads every file through Python with no caching headers. Files are sent
+as a FileResponse over the open file, which WSGI servers hand to sendfile(),
+or, with MEDIA_SENDFILE set, left to the web server in front of Django:
+
+    'x-accel-redirect'  nginx; MEDIA_ACCEL_REDIRECT_PREFIX names an internal
+                        location aliased to MEDIA_ROOT
+    'x-sendfile'        Apache mod_xsendfile, lighttpd; sends the file path
+
+Every response carries an ETag and Last-Modified, so revalidations get a 304.
+Derivatives under derived/ have content-hashed names and are cached for a
+year as immutable; other files are cached for MEDIA_CACHE_MAX_AGE seconds.
+A .br or .gz file next to the requested one is sent instead when the client
+accepts that encoding. Single byte ranges are served as 206 responses.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+from .images import DERIVED_DIR
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_MAX_AGE = 3600
+
+# Names written by images.generate_variants: derived/{stem}-{variant}-{digest}.{ext}
+HASHED_NAME = re.compile(rf'^{DERIVED_DIR}/[^/]+-[0-9a-f]{{12}}\.\w+$')
+
+# Preferred first
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def cache_control(name):
+    if HASHED_NAME.match(name):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', DEFAULT_MAX_AGE)}"
+
+
+def accepted_encodings(request):
+    """Content codings the client accepts, ignoring any given q=0"""
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_file(path, request):
+    """Return (path, stat, content encoding) of the best representation of path"""
+    accepted = accepted_encodings(request)
+    for encoding, suffix in PRECOMPRESSED:
+        if encoding in accepted or '*' in accepted:
+            try:
+                return path + suffix, os.stat(path + suffix), encoding
+            except OSError:
+                pass
+    return path, os.stat(path), None
+
+
+def file_etag(stat, encoding):
+    # Each encoding is a separate representation and needs its own tag
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single-range header, None to ignore it
+    (absent, malformed or multi-range) or False if it can't be satisfied.
+    """
+    match = RANGE.match(header.replace(' ', ''))
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, end
+
+
+class RangeFile:
+    """File-like view of bytes start..end of an open file, read by FileResponse"""
+
+    def __init__(self, file, start, end):
+        file.seek(start)
+        self.file = file
+        self.remaining = end - start + 1
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    served_path, stat, encoding = choose_file(full_path, request)
+    name = path.replace(os.sep, '/')
+    etag = file_etag(stat, encoding)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control(name),
+        'Vary': 'Accept-Encoding',
+    }
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified.headers[header] = value
+        return not_modified
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    sendfile = getattr(settings, 'MEDIA_SENDFILE', None)
+    if sendfile:
+        # The web server streams the file and deals with ranges itself
+        response = HttpResponse(content_type=content_type)
+        relative = os.path.relpath(served_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, '/')
+        if sendfile == 'x-accel-redirect':
+            prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative)
+        else:
+            response['X-Sendfile'] = os.path.abspath(served_path)
+    else:
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if 'HTTP_RANGE' in request.META and (if_range is None or etag in parse_etags(if_range)):
+            byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416, content_type=content_type)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        elif byte_range:
+            start, end = byte_range
+            response = FileResponse(RangeFile(open(served_path, 'rb'), start, end), content_type=content_type, status=206)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            response['Content-Length'] = end - start + 1
+        else:
+            response = FileResponse(open(served_path, 'rb'), content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+    return response
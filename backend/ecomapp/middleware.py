@@ -0,0 +1,60 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('ecomapp.performance')
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the SQL queries, database time and wall time of every request,
+    reports them in a Server-Timing header and logs a warning when a request
+    goes over the budget set for its route in QUERY_BUDGETS (keyed by URL name).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = {'queries': 0, 'db_time': 0.0}
+
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats['queries'] += 1
+                stats['db_time'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record))
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - started) * 1000
+        db_ms = stats['db_time'] * 1000
+
+        if getattr(settings, 'SERVER_TIMING', True):
+            response['Server-Timing'] = (
+                f'db;dur={db_ms:.2f};desc="{stats["queries"]} queries", total;dur={wall_ms:.2f}'
+            )
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.url_name if match else None
+        budget = self.budget_for(route)
+        if stats['queries'] > budget['queries'] or wall_ms > budget['ms']:
+            logger.warning(
+                'Request over budget: %s %s (%s) ran %d queries in %.1fms (budget %d queries, %dms)',
+                request.method, request.path, route, stats['queries'], wall_ms, budget['queries'], budget['ms'],
+                extra={'route': route, 'queries': stats['queries'], 'db_ms': db_ms, 'wall_ms': wall_ms},
+            )
+        return response
+
+    @staticmethod
+    def budget_for(route):
+        budget = dict(getattr(settings, 'QUERY_BUDGET_DEFAULT', {'queries': 50, 'ms': 1000}))
+        budget.update(getattr(settings, 'QUERY_BUDGETS', {}).get(route, {}))
+        return budget
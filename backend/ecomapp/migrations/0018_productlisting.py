@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_listings(apps, schema_editor):
+    Products = apps.get_model('ecomapp', 'Products')
+    ProductListing = apps.get_model('ecomapp', 'ProductListing')
+    listings = []
+    for product in Products.objects.select_related('category').prefetch_related('tags__tag_type'):
+        tags = sorted(
+            product.tags.all(),
+            key=lambda tag: (tag.tag_type is not None, tag.tag_type.name if tag.tag_type else '', tag.name),
+        )
+        arrival = next((tag.name.lower() for tag in tags if tag.tag_type and tag.tag_type.name == 'Arrival'), 'classic')
+        listings.append(ProductListing(
+            product=product,
+            tags=[
+                {
+                    'id': tag.id,
+                    'name': tag.name,
+                    'tag_type': tag.tag_type.name if tag.tag_type else 'Uncategorized',
+                    'color': tag.tag_type.color if tag.tag_type else 'secondary',
+                }
+                for tag in tags
+            ],
+            category_name=product.category.name if product.category else None,
+            arrival_status=arrival,
+        ))
+    ProductListing.objects.bulk_create(listings, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomapp', '0017_tagtype_color'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListing',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='ecomapp.products')),
+                ('tags', models.JSONField(default=list)),
+                ('category_name', models.CharField(blank=True, max_length=200, null=True)),
+                ('arrival_status', models.CharField(default='classic', max_length=50)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_listings, migrations.RunPython.noop),
+    ]
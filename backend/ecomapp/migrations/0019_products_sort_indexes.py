@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:48
+
+import ecomapp.sorting
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def count_units_sold(apps, schema_editor):
+    Products = apps.get_model('ecomapp', 'Products')
+    OrderItem = apps.get_model('ecomapp', 'OrderItem')
+    sold = OrderItem.objects.filter(product=OuterRef('pk')).values('product').annotate(total=Sum('quantity')).values('total')
+    Products.objects.update(unitsSold=Coalesce(Subquery(sold), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomapp', '0018_productlisting'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='unitsSold',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_units_sold, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(ecomapp.sorting.IfNull(models.F('productName'), "''"), models.F('_id'), name='products_name_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(ecomapp.sorting.IfNull(models.F('price'), '0', output_field=models.FloatField()), models.F('_id'), name='products_price_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(models.F('category'), ecomapp.sorting.IfNull(models.F('price'), '0', output_field=models.FloatField()), models.F('_id'), name='products_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(ecomapp.sorting.IfNull(models.F('rating'), '0', output_field=models.FloatField()), models.F('_id'), name='products_rating_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(fields=['createdAt', '_id'], name='products_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(fields=['unitsSold', '_id'], name='products_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(models.OrderBy(ecomapp.sorting.InStock(models.F('stockCount')), descending=True), ecomapp.sorting.IfNull(models.F('productName'), "''"), models.F('_id'), name='products_in_stock_idx'),
+        ),
+    ]
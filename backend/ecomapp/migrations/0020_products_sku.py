@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomapp', '0019_products_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Stock keeping unit, used to match rows in catalog imports', max_length=64, null=True, unique=True),
+        ),
+    ]
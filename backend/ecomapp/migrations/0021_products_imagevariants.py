@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomapp', '0020_products_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='imageVariants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Resized copies of the image, see images.py'),
+        ),
+    ]
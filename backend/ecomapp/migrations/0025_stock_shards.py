@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomapp', '0024_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='stockShards',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='Stock counter rows while sharded, see stock_shards.py'),
+        ),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('sold', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shards', to='ecomapp.products')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'shard'), name='stock_shard_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:57
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomapp', '0026_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='productlisting',
+            name='category_name',
+        ),
+    ]
@@ -1,6 +1,10 @@
 from django.db import models
+from django.db.models import F
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
 
+from .sorting import SORT_KEYS
+
 class Category(models.Model):
     name = models.CharField(max_length=200, unique=True)
     description = models.TextField(null=True, blank=True)
@@ -54,22 +58,71 @@ class Tag(models.Model):
 
 class Products(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text="Stock keeping unit, used to match rows in catalog imports")
     productName = models.CharField(max_length=200, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     image = models.ImageField(null=True, blank=True)
+    imageVariants = models.JSONField(default=dict, blank=True, editable=False, help_text="Resized copies of the image, see images.py")
     productBrand = models.CharField(max_length=100, null=True, blank=True)
     productInfo = models.TextField(null=True, blank=True)
     rating = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
     numReviews = models.IntegerField(null=True, blank=True, default=0)
     price = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
     stockCount = models.IntegerField(null=True, blank=True, default=0)
+    unitsSold = models.IntegerField(default=0, editable=False)
+    stockShards = models.PositiveSmallIntegerField(default=0, editable=False, help_text="Stock counter rows while sharded, see stock_shards.py")
     createdAt = models.DateTimeField(auto_now_add=True)
     _id = models.AutoField(primary_key=True, editable=False)
     tags = models.ManyToManyField(Tag, related_name='products', blank=True, help_text="Select tags to associate with this product")
 
+    class Meta:
+        # One index per sort in sorting.SORTS, on the same expressions
+        indexes = [
+            models.Index(SORT_KEYS['sort_name'], F('_id'), name='products_name_sort_idx'),
+            models.Index(SORT_KEYS['sort_price'], F('_id'), name='products_price_sort_idx'),
+            models.Index(F('category'), SORT_KEYS['sort_price'], F('_id'), name='products_category_price_idx'),
+            models.Index(SORT_KEYS['sort_rating'], F('_id'), name='products_rating_sort_idx'),
+            models.Index(fields=['createdAt', '_id'], name='products_newest_idx'),
+            models.Index(fields=['unitsSold', '_id'], name='products_popularity_idx'),
+            models.Index(SORT_KEYS['in_stock'].desc(), SORT_KEYS['sort_name'], F('_id'), name='products_in_stock_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # The row as read, so signals.py can tell what a save changes without reading it again
+        product._loaded_values = dict(zip(field_names, values))
+        return product
+
     def __str__(self):
         return self.productName or "New Product"
 
+class ProductListing(models.Model):
+    """Pre-rendered tag data for product responses, kept current by signals.py"""
+    product = models.OneToOneField(Products, on_delete=models.CASCADE, primary_key=True, related_name='listing')
+    tags = models.JSONField(default=list)
+    arrival_status = models.CharField(max_length=50, default='classic')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Listing for {self.product_id}"
+
+
+class SimilarProduct(models.Model):
+    """A product's nearest neighbours by tags, category and price, kept current by recommendations.py"""
+    product = models.ForeignKey(Products, on_delete=models.CASCADE, related_name='similar')
+    neighbor = models.ForeignKey(Products, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='similar_product_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.neighbor_id} ({self.score:.3f})"
+
 class DeliveryLocation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
@@ -122,4 +175,84 @@ class Wishlist(models.Model):
         unique_together = ('user', 'product')
 
     def __str__(self):
-        return f"{self.user.username}'s wishlist - {self.product.productName}"
\ No newline at end of file
+        return f"{self.user.username}'s wishlist - {self.product.productName}"
+
+class IdempotencyKey(models.Model):
+    """A write request's Idempotency-Key and the response to replay for retries, see idempotency.py"""
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=100, help_text="Endpoint and user the key was sent to")
+    fingerprint = models.CharField(max_length=64, help_text="Hash of the request the key was first used with")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+
+class StockReservation(models.Model):
+    """Units of a product held for a user's cart until expires_at, see reservations.py"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Products, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='stock_reservation_unique'),
+        ]
+        indexes = [
+            # Covers the live reserved quantity of a product
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='reservation_live_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product_id} for {self.user_id} until {self.expires_at}"
+
+class StockShard(models.Model):
+    """One of a sharded product's stock counters, see stock_shards.py"""
+    product = models.ForeignKey(Products, on_delete=models.CASCADE, related_name='stock_shards')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+    sold = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='stock_shard_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}#{self.shard}: {self.quantity}"
+
+class InventoryLedger(models.Model):
+    """One stock adjustment made through inventory.adjust_stock; entries are only ever appended"""
+    batch = models.UUIDField(db_index=True, help_text="Adjustments applied together share a batch")
+    product = models.ForeignKey(Products, null=True, on_delete=models.SET_NULL, related_name='ledger')
+    delta = models.IntegerField()
+    stock_after = models.IntegerField(help_text="The product's stock once this adjustment was applied")
+    reason = models.CharField(max_length=200, blank=True)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='ledger_product_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Inventory ledger entries cannot be changed')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Inventory ledger entries cannot be deleted')
+
+    def __str__(self):
+        return f"{self.delta:+} of {self.product_id} ({self.reason or 'adjustment'})"
@@ -0,0 +1,158 @@
+"""
+Checkout.
+
+place_order() turns a create_order request into an order in one transaction
+with a fixed number of queries however many lines the order has: the products
+are read (and locked, where the database has row locks) in one query together
+with what other users' reservations leave available, every line is validated
+before anything is written, the stock of every product is taken in a single
+conditional UPDATE, the items are bulk-created and the user's reservations
+for the products are released. The UPDATE only changes rows that still have
+enough stock, so when a concurrent checkout got there first fewer rows
+change and the whole order is rolled back rather than overselling.
+
+Products with sharded stock (see stock_shards.py) are read without the row
+lock, which would queue their checkouts on the product row again; their
+stock is taken from the shard counters with the same conditional UPDATEs.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from rest_framework import status
+
+from .models import DeliveryLocation, Order, OrderItem, Products, StockReservation
+from .reservations import reserved_by_others, with_available
+from .stock_shards import shard_units_sold, take_sharded
+
+
+class CheckoutError(Exception):
+    """A create_order request that can't be placed, with the response status"""
+
+    def __init__(self, detail, status=status.HTTP_400_BAD_REQUEST):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def parse_lines(order_items):
+    """Return [(product id, quantity, price)], raising CheckoutError for malformed lines"""
+    lines = []
+    for item in order_items:
+        try:
+            quantity = int(item['quantity'])
+        except (TypeError, ValueError):
+            raise CheckoutError('Invalid quantity')
+        if quantity < 1:
+            raise CheckoutError('Invalid quantity')
+        try:
+            product_id = int(item['product_id'])
+        except (TypeError, ValueError):
+            raise CheckoutError('One or more products not found', status.HTTP_404_NOT_FOUND)
+        lines.append((product_id, quantity, item['price']))
+    if not lines:
+        raise CheckoutError('No order items')
+    return lines
+
+
+def lock_products(product_ids, user):
+    """
+    The ordered products by id with what user can buy of each (see
+    reservations.with_available), locked until the transaction ends where the
+    database supports it. Sharded products aren't locked and have their
+    counters summed from their shards.
+    """
+    products = with_available(Products.objects.select_for_update(), user).filter(stockShards=0).in_bulk(
+        product_ids, field_name='_id',
+    )
+    if len(products) < len(product_ids):
+        sharded = with_available(Products.objects.filter(stockShards__gt=0), user).annotate(
+            shard_sold=shard_units_sold(),
+        ).in_bulk([product_id for product_id in product_ids if product_id not in products], field_name='_id')
+        for product in sharded.values():
+            product.stockCount, product.unitsSold = product.stock, product.unitsSold + product.shard_sold
+        products.update(sharded)
+    return products
+
+
+def take_stock(demand, user, shards=None):
+    """
+    Decrement stock and count the units sold for {product id: quantity} in
+    one UPDATE, and from the shard counters for the sharded products in
+    shards ({product id: number of shards}). Returns False, changing nothing
+    the caller keeps, when any product no longer has the stock left over by
+    other users' reservations.
+    """
+    shards = shards or {}
+    plain = {product_id: quantity for product_id, quantity in demand.items() if product_id not in shards}
+    if plain:
+        held = reserved_by_others(user)
+        enough = reduce(or_, (
+            Q(_id=product_id, stockCount__gte=held + quantity) for product_id, quantity in plain.items()
+        ))
+        updated = Products.objects.filter(enough).update(
+            stockCount=Case(*[When(_id=product_id, then=F('stockCount') - quantity) for product_id, quantity in plain.items()]),
+            unitsSold=Case(*[When(_id=product_id, then=F('unitsSold') + quantity) for product_id, quantity in plain.items()]),
+        )
+        if updated != len(plain):
+            return False
+    return all(
+        take_sharded(product_id, shards[product_id], demand[product_id], held=reserved_by_others(user, product_id))
+        for product_id in shards
+    )
+
+
+def place_order(user, data):
+    """
+    Create the order, its items and the stock decrements for a create_order
+    request. Returns (order, products) with the products' counters as of the
+    order; raises CheckoutError or KeyError with nothing written.
+    """
+    lines = parse_lines(data['order_items'])
+    demand = {}
+    for product_id, quantity, _ in lines:
+        demand[product_id] = demand.get(product_id, 0) + quantity
+
+    with transaction.atomic():
+        products = lock_products(list(demand), user)
+        if len(products) != len(demand):
+            raise CheckoutError('One or more products not found', status.HTTP_404_NOT_FOUND)
+        for product_id, quantity in demand.items():
+            product = products[product_id]
+            if product.available < quantity:
+                raise CheckoutError(f'Not enough stock for {product.productName}. Available: {max(product.available, 0)}')
+        shards = {product_id: product.stockShards for product_id, product in products.items() if product.stockShards}
+        if not take_stock(demand, user, shards):
+            # Stock was taken since the read, by a checkout on a database without row locks
+            # or of a sharded product
+            raise CheckoutError('Stock changed while placing the order, please try again', status.HTTP_409_CONFLICT)
+
+        delivery_location = None
+        if data.get('delivery_location'):
+            loc_data = data['delivery_location']
+            delivery_location = DeliveryLocation.objects.create(
+                user=user,
+                latitude=loc_data['latitude'],
+                longitude=loc_data['longitude'],
+                address_details=loc_data['address_details']
+            )
+        order = Order.objects.create(
+            user=user,
+            delivery_location=delivery_location,
+            payment_method=data['payment_method'],
+            shipping_price=data['shipping_price'],
+            total_price=data['total_price'],
+            status='Pending'
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=products[product_id], quantity=quantity, price=price)
+            for product_id, quantity, price in lines
+        ])
+        # The user's holds on these products have become the order
+        StockReservation.objects.filter(user=user, product_id__in=list(demand)).delete()
+
+    for product_id, quantity in demand.items():
+        products[product_id].stockCount -= quantity
+        products[product_id].unitsSold += quantity
+    return order, list(products.values())
@@ -0,0 +1,97 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.db.models import F, Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def get_page_size(value):
+    """Parse the requested page size, falling back to the default and capping it"""
+    default = getattr(settings, 'PRODUCTS_PAGE_SIZE', 24)
+    maximum = getattr(settings, 'PRODUCTS_MAX_PAGE_SIZE', 100)
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(page_size, maximum))
+
+
+def encode_cursor(ordering_name, values, direction):
+    payload = json.dumps({'o': ordering_name, 'k': values, 'd': direction}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering_name):
+    """Return the (values, direction) stored in a cursor made for the given ordering"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values, direction = data['k'], data['d']
+        name = data['o']
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise InvalidCursor('Invalid cursor')
+    if name != ordering_name or direction not in ('next', 'prev') or not isinstance(values, list):
+        raise InvalidCursor('Invalid cursor')
+    return values, direction
+
+
+def _seek(ordering, values, backwards):
+    """Build the WHERE clause selecting rows after (or before) the cursor position"""
+    condition = Q()
+    equal = Q()
+    for (field, descending), value in zip(ordering, values):
+        lookup = 'lt' if descending != backwards else 'gt'
+        condition |= equal & Q(**{f'{field}__{lookup}': value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+def paginate_keyset(queryset, ordering, cursor=None, page_size=24, ordering_name='default'):
+    """
+    Keyset pagination over `ordering`, a list of (field, descending) pairs whose
+    last field is unique. Each page is a seek on the ordering columns instead of
+    an OFFSET scan, so every page costs the same to fetch.
+    """
+    if len(ordering) == 0:
+        raise ValueError('ordering must not be empty')
+
+    backwards = False
+    if cursor:
+        values, direction = decode_cursor(cursor, ordering_name)
+        if len(values) != len(ordering):
+            raise InvalidCursor('Invalid cursor')
+        backwards = direction == 'prev'
+        queryset = queryset.filter(_seek(ordering, values, backwards))
+
+    order_by = []
+    for field, descending in ordering:
+        expression = F(field)
+        order_by.append(expression.asc() if descending == backwards else expression.desc())
+
+    rows = list(queryset.order_by(*order_by)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    def key(row):
+        return [getattr(row, field) for field, _ in ordering]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            next_cursor = encode_cursor(ordering_name, key(rows[-1]), 'next')
+            if has_more:
+                prev_cursor = encode_cursor(ordering_name, key(rows[0]), 'prev')
+        else:
+            if has_more:
+                next_cursor = encode_cursor(ordering_name, key(rows[-1]), 'next')
+            if cursor:
+                prev_cursor = encode_cursor(ordering_name, key(rows[0]), 'prev')
+
+    return {'results': rows, 'next': next_cursor, 'prev': prev_cursor}
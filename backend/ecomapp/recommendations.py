@@ -0,0 +1,301 @@
+"""
+Precomputed "similar products".
+
+Each product's SIMILAR_PRODUCTS_COUNT nearest neighbours are stored in
+SimilarProduct, so the product page reads them with one indexed query. Two
+products score
+
+    tags * weighted Jaccard of their tags
+    + category * (1 if they share a category)
+    + price * (cheaper price / dearer price)
+
+with the weights from SIMILAR_PRODUCTS_WEIGHTS. Tags are weighted by inverse
+document frequency, so sharing a rare tag counts for more than sharing one
+most of the catalog has. Candidates are the SIMILAR_PRODUCTS_MAX_CANDIDATES
+products sharing the most tag weight, leaving out tags on more than
+SIMILAR_PRODUCTS_TAG_LIMIT products, plus the same-category products nearest
+in price, so scoring never compares every pair of products.
+
+rebuild_all_similar() recomputes the whole table (the rebuild_similar_products
+command, and post_migrate while the table is empty); refresh_similar()
+recomputes the products a change can affect and is called from the signal
+handlers and catalog_bulk_changed(). A refresh loads one model, with the tag
+frequencies counted once, for both the affected products and their
+neighbours, and reads each product's price neighbours as a bounded window on
+products_category_price_idx rather than its whole category. Inside a request it handles at most
+SIMILAR_PRODUCTS_REFRESH_LIMIT changed products; bigger changes are left to
+the rebuild_similar_products command, which should run after them.
+"""
+import heapq
+import logging
+import math
+from bisect import bisect_left
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Products, SimilarProduct
+from .sorting import SORT_KEYS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNT = 8
+DEFAULT_WEIGHTS = {'tags': 0.6, 'category': 0.25, 'price': 0.15}
+DEFAULT_TAG_LIMIT = 500
+DEFAULT_MAX_CANDIDATES = 100
+DEFAULT_REFRESH_LIMIT = 100
+
+# Keeps id lists within SQLite's bound variable limit
+QUERY_BATCH_SIZE = 500
+WRITE_BATCH_SIZE = 1000
+
+
+def _batches(ids, size=QUERY_BATCH_SIZE):
+    ids = iter(ids)
+    while batch := list(islice(ids, size)):
+        yield batch
+
+
+class SimilarityModel:
+    """Tags, category and price of the products needed to score a set of products"""
+
+    def __init__(self):
+        self.count = getattr(settings, 'SIMILAR_PRODUCTS_COUNT', DEFAULT_COUNT)
+        self.weights = {**DEFAULT_WEIGHTS, **getattr(settings, 'SIMILAR_PRODUCTS_WEIGHTS', {})}
+        self.tag_limit = getattr(settings, 'SIMILAR_PRODUCTS_TAG_LIMIT', DEFAULT_TAG_LIMIT)
+        self.max_candidates = getattr(settings, 'SIMILAR_PRODUCTS_MAX_CANDIDATES', DEFAULT_MAX_CANDIDATES)
+        self.tags = {}
+        self.postings = {}
+        self.category = {}
+        self.price = {}
+        self.by_category = {}
+        # What load() has read already
+        self.loaded_tags = set()
+        self.loaded_postings = set()
+        self.loaded_windows = set()
+
+        total = Products.objects.count()
+        frequencies = Products.tags.through.objects.values('tag_id').annotate(products=Count('id'))
+        self.frequency = dict(frequencies.values_list('tag_id', 'products'))
+        self.idf = {tag_id: math.log(1 + total / products) for tag_id, products in self.frequency.items()}
+
+    @classmethod
+    def for_all(cls):
+        model = cls()
+        for product_id, tag_id in Products.tags.through.objects.values_list('products_id', 'tag_id').iterator():
+            model.tags.setdefault(product_id, set()).add(tag_id)
+            if model._candidate_tag(tag_id):
+                model.postings.setdefault(tag_id, []).append(product_id)
+        model._load_products(Products.objects.all())
+        return model
+
+    @classmethod
+    def for_products(cls, product_ids):
+        """Load just what scoring these products against their candidates needs"""
+        model = cls()
+        model.load(product_ids)
+        return model
+
+    def load(self, product_ids):
+        """Add what scoring these products against their candidates needs, reading only what isn't loaded"""
+        Through = Products.tags.through
+        product_ids = set(product_ids)
+
+        for batch in _batches(product_ids - self.category.keys()):
+            self._load_products(Products.objects.filter(_id__in=batch))
+        for product_id in product_ids - self.loaded_windows:
+            self._load_price_window(product_id)
+
+        self._load_tags(product_ids)
+        own_tags = set().union(*(self.tags.get(product_id, ()) for product_id in product_ids))
+        candidates = set(product_ids)
+        for batch in _batches(tag_id for tag_id in own_tags - self.loaded_postings if self._candidate_tag(tag_id)):
+            for product_id, tag_id in Through.objects.filter(tag_id__in=batch).values_list('products_id', 'tag_id'):
+                self.postings.setdefault(tag_id, []).append(product_id)
+                candidates.add(product_id)
+            self.loaded_postings.update(batch)
+        for product_id in product_ids:
+            candidates.update(self._nearest_in_category(product_id))
+
+        self._load_tags(candidates)
+        for batch in _batches(candidates - self.category.keys()):
+            self._load_products(Products.objects.filter(_id__in=batch))
+
+    def _load_price_window(self, product_id):
+        """
+        Read the products either side of this one in its category's price
+        order: count below and above it, and count on each side among
+        products of the same price. Each is a bounded range on
+        products_category_price_idx, however big the category.
+        """
+        self.loaded_windows.add(product_id)
+        category_id, price = self.category.get(product_id), self.price.get(product_id)
+        if category_id is None or price is None:
+            return
+        products = Products.objects.filter(category_id=category_id, price__isnull=False).annotate(
+            sort_price=SORT_KEYS['sort_price'],
+        )
+        for queryset in (
+            products.filter(sort_price__lt=price).order_by('-sort_price', '-_id'),
+            products.filter(sort_price=price, _id__lt=product_id).order_by('-_id'),
+            products.filter(sort_price=price, _id__gt=product_id).order_by('_id'),
+            products.filter(sort_price__gt=price).order_by('sort_price', '_id'),
+        ):
+            self._load_products(queryset[:self.count])
+
+    def _load_tags(self, product_ids):
+        missing = set(product_ids) - self.loaded_tags
+        for batch in _batches(missing):
+            for product_id, tag_id in Products.tags.through.objects.filter(products_id__in=batch).values_list('products_id', 'tag_id'):
+                self.tags.setdefault(product_id, set()).add(tag_id)
+        self.loaded_tags |= missing
+
+    def _candidate_tag(self, tag_id):
+        # Tags most products share make poor candidates and huge candidate lists
+        return 0 < self.frequency.get(tag_id, 0) <= self.tag_limit
+
+    def _load_products(self, queryset):
+        changed = set()
+        for product_id, category_id, price in queryset.values_list('_id', 'category_id', 'price').iterator():
+            if product_id in self.category:
+                continue
+            self.category[product_id] = category_id
+            self.price[product_id] = float(price) if price is not None else None
+            if category_id is not None and price is not None:
+                self.by_category.setdefault(category_id, []).append((float(price), product_id))
+                changed.add(category_id)
+        for category_id in changed:
+            self.by_category[category_id].sort()
+
+    def score(self, a, b):
+        score = 0.0
+        tags_a, tags_b = self.tags.get(a, set()), self.tags.get(b, set())
+        shared = tags_a & tags_b
+        if shared:
+            shared_weight = sum(self.idf.get(tag_id, 0) for tag_id in shared)
+            union_weight = sum(self.idf.get(tag_id, 0) for tag_id in tags_a | tags_b)
+            if union_weight:
+                score += self.weights['tags'] * shared_weight / union_weight
+        if self.category.get(a) is not None and self.category.get(a) == self.category.get(b):
+            score += self.weights['category']
+        price_a, price_b = self.price.get(a), self.price.get(b)
+        if price_a is not None and price_b is not None:
+            if price_a == price_b:
+                score += self.weights['price']
+            elif price_a > 0 and price_b > 0:
+                score += self.weights['price'] * min(price_a, price_b) / max(price_a, price_b)
+        return score
+
+    def candidates(self, product_id):
+        # Score only the products with the most shared tag weight
+        overlap = {}
+        for tag_id in self.tags.get(product_id, ()):
+            weight = self.idf.get(tag_id, 0)
+            for other in self.postings.get(tag_id, ()):
+                overlap[other] = overlap.get(other, 0) + weight
+        overlap.pop(product_id, None)
+        if len(overlap) > self.max_candidates:
+            candidates = set(heapq.nlargest(self.max_candidates, overlap, key=overlap.get))
+        else:
+            candidates = set(overlap)
+        candidates.update(self._nearest_in_category(product_id))
+        candidates.discard(product_id)
+        return candidates
+
+    def _nearest_in_category(self, product_id):
+        """The products either side of this one in its category's price order"""
+        entries = self.by_category.get(self.category.get(product_id))
+        price = self.price.get(product_id)
+        if not entries or price is None:
+            return []
+        position = bisect_left(entries, (price, product_id))
+        window = entries[max(position - self.count, 0):position + self.count + 1]
+        return [other for _, other in window]
+
+    def neighbors(self, product_id):
+        """The top (neighbor id, score) pairs for a product, best first"""
+        scored = ((self.score(product_id, other), -other) for other in self.candidates(product_id))
+        return [(-negated_id, score) for score, negated_id in heapq.nlargest(self.count, scored) if score > 0]
+
+
+def _write(model, product_ids, replace=True):
+    written = 0
+    with transaction.atomic():
+        for batch in _batches(product_ids):
+            if replace:
+                SimilarProduct.objects.filter(product_id__in=batch).delete()
+            rows = [
+                SimilarProduct(product_id=product_id, neighbor_id=neighbor_id, rank=rank, score=round(score, 4))
+                for product_id in batch
+                for rank, (neighbor_id, score) in enumerate(model.neighbors(product_id))
+            ]
+            SimilarProduct.objects.bulk_create(rows, batch_size=WRITE_BATCH_SIZE)
+            written += len(rows)
+    return written
+
+
+def rebuild_all_similar():
+    """Recompute every product's neighbours; returns the number of rows written"""
+    model = SimilarityModel.for_all()
+    with transaction.atomic():
+        SimilarProduct.objects.all().delete()
+        return _write(model, sorted(model.category), replace=False)
+
+
+def affected_products(product_ids, model=None):
+    """
+    The products whose neighbours may change when these products change: the
+    products themselves, those listing them now, and those that would have
+    them as a candidate. model is loaded with these products when not given.
+    """
+    product_ids = set(product_ids)
+    affected = set(product_ids)
+    for batch in _batches(product_ids):
+        affected.update(SimilarProduct.objects.filter(neighbor_id__in=batch).values_list('product_id', flat=True))
+    if model is None:
+        model = SimilarityModel.for_products(product_ids)
+    for product_id in product_ids:
+        affected.update(model.candidates(product_id))
+    return affected
+
+
+def refresh_similar(product_ids, bulk=False):
+    """
+    Recompute the neighbours of everything a change to these products can
+    affect. Pass bulk=True from imports and other commands: they aren't held
+    to SIMILAR_PRODUCTS_REFRESH_LIMIT, and rebuild the whole table when most
+    of the catalog changed.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+    if bulk:
+        total = Products.objects.count()
+        if len(product_ids) * 2 > total:
+            # Most of the catalog changed; one pass over everything is cheaper
+            rebuild_all_similar()
+            return total
+    elif len(product_ids) > getattr(settings, 'SIMILAR_PRODUCTS_REFRESH_LIMIT', DEFAULT_REFRESH_LIMIT):
+        logger.warning(
+            'Similar products not refreshed for %d changed products; run rebuild_similar_products', len(product_ids),
+        )
+        return 0
+    # One model, and one count of the tag frequencies, for the changed products and everything they affect
+    model = SimilarityModel.for_products(product_ids)
+    affected = affected_products(product_ids, model)
+    model.load(affected)
+    return _recompute(model, affected)
+
+
+def recompute_similar(product_ids):
+    """Recompute the neighbours of just these products"""
+    return _recompute(SimilarityModel.for_products(product_ids), product_ids)
+
+
+def _recompute(model, product_ids):
+    # Deleted products have lost their rows already
+    existing = sorted(product_id for product_id in product_ids if product_id in model.category)
+    _write(model, existing)
+    return len(existing)
@@ -0,0 +1,104 @@
+"""
+Time-limited stock reservations for carts.
+
+A reservation holds units of a product for one user until expires_at,
+RESERVATION_TTL seconds after it was made or last extended. Holds don't
+change the stock: what is available to sell is the stock (stockCount, or the
+sum of the shards of a sharded product) minus the live holds, summed per
+product over the covering (product, expires_at, quantity) index. A user's own holds count as available to them, and create_order turns
+them into the order by taking the stock and deleting the holds in one
+transaction. Expired holds stop counting straight away and are deleted by
+the expire_reservations command.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework import status
+
+from .models import Products, StockReservation
+from .stock_shards import current_stock
+
+DEFAULT_TTL = 15 * 60
+
+
+class ReservationError(Exception):
+    """A reservation request that can't be met, with the response status"""
+
+    def __init__(self, detail, status=status.HTTP_400_BAD_REQUEST):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def live_reservations():
+    return StockReservation.objects.filter(expires_at__gt=timezone.now())
+
+
+def reserved_by_others(user=None, product=None):
+    """The live units of product, by default the outer query's, held by anyone but user"""
+    holds = live_reservations().filter(product=OuterRef('_id') if product is None else product)
+    if user is not None and user.is_authenticated:
+        holds = holds.exclude(user=user)
+    total = holds.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), 0)
+
+
+def with_available(queryset, user=None):
+    """
+    Annotate products with their stock (see stock_shards.current_stock), the
+    units others hold (reserved) and what user can buy (available)
+    """
+    return queryset.annotate(stock=current_stock(), reserved=reserved_by_others(user)).annotate(
+        available=F('stock') - F('reserved'),
+    )
+
+
+def reserve(user, product_id, quantity):
+    """
+    Hold quantity units of a product for user, replacing any hold they have on
+    it and starting a new expiry period. A quantity of 0 releases the hold.
+    """
+    if quantity < 0:
+        raise ReservationError('Invalid quantity')
+    with transaction.atomic():
+        product = with_available(Products.objects.select_for_update(), user).filter(_id=product_id).first()
+        if product is None:
+            raise ReservationError('Product not found', status.HTTP_404_NOT_FOUND)
+        if quantity == 0:
+            release(user, product_id)
+            return None
+        if quantity > product.available:
+            raise ReservationError(f'Only {max(product.available, 0)} of {product.productName} available')
+        expires_at = timezone.now() + timedelta(seconds=getattr(settings, 'RESERVATION_TTL', DEFAULT_TTL))
+        reservation = StockReservation(user=user, product=product, quantity=quantity, expires_at=expires_at)
+        # The product row lock keeps another request from inserting the same hold meanwhile
+        if not StockReservation.objects.filter(user=user, product=product).update(quantity=quantity, expires_at=expires_at):
+            reservation.save()
+        return reservation
+
+
+def extend(user, product_id):
+    """Start a new expiry period for user's hold, checking the stock again if it had lapsed"""
+    reservation = StockReservation.objects.filter(user=user, product_id=product_id).first()
+    if reservation is None:
+        raise ReservationError('Reservation not found', status.HTTP_404_NOT_FOUND)
+    return reserve(user, product_id, reservation.quantity)
+
+
+def release(user, product_id):
+    return StockReservation.objects.filter(user=user, product_id=product_id).delete()[0] > 0
+
+
+def expire_reservations(batch_size=1000):
+    """Delete expired holds a batch at a time; returns how many were deleted"""
+    deleted = 0
+    now = timezone.now()
+    while True:
+        batch = list(StockReservation.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += StockReservation.objects.filter(id__in=batch).delete()[0]
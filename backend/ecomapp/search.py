@@ -0,0 +1,115 @@
+"""
+Full-text product search backed by an SQLite FTS5 table.
+
+ecomapp_products_fts is an external-content FTS5 table over the name, brand and
+info columns of ecomapp_products, kept in sync by triggers. The schema is
+created by ensure_search_schema(), which runs after every migrate: SQLite drops
+a table's triggers whenever a migration rebuilds that table, so they are
+recreated there rather than in a one-off migration. On other databases, or
+without FTS5, keyword search falls back to icontains lookups.
+"""
+import re
+
+from django.db import connections, OperationalError
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'ecomapp_products_fts'
+PRODUCTS_TABLE = 'ecomapp_products'
+
+# bm25 weights for productName, productBrand and productInfo
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+_COLUMNS = '"productName", "productBrand", "productInfo"'
+
+_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        productName, productBrand, productInfo,
+        content='{PRODUCTS_TABLE}', content_rowid='_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {PRODUCTS_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS})
+        VALUES (new."_id", new."productName", new."productBrand", new."productInfo");
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {PRODUCTS_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS})
+        VALUES ('delete', old."_id", old."productName", old."productBrand", old."productInfo");
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF "productName", "productBrand", "productInfo" ON {PRODUCTS_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS})
+        VALUES ('delete', old."_id", old."productName", old."productBrand", old."productInfo");
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS})
+        VALUES (new."_id", new."productName", new."productBrand", new."productInfo");
+    END""",
+]
+
+_available = {}
+
+
+def fts_enabled(using='default'):
+    """Return True when the FTS5 table exists on this database"""
+    if using not in _available:
+        connection = connections[using]
+        if connection.vendor != 'sqlite':
+            _available[using] = False
+        else:
+            _available[using] = FTS_TABLE in connection.introspection.table_names()
+    return _available[using]
+
+
+def ensure_search_schema(using='default'):
+    """Create the FTS5 table and its triggers if they are missing"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    _available.pop(using, None)
+    created = FTS_TABLE not in connection.introspection.table_names()
+    try:
+        with connection.cursor() as cursor:
+            for statement in _SCHEMA:
+                cursor.execute(statement)
+    except OperationalError:
+        # SQLite was built without FTS5
+        return False
+    if created:
+        rebuild_search_index(using)
+    return True
+
+
+def rebuild_search_index(using='default'):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def build_match_query(keyword):
+    """
+    Turn free text into an FTS5 query: every word must match, and each word
+    is matched as a prefix so partially typed words still find results.
+    """
+    words = re.findall(r'\w+', keyword.lower())
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+def search_products(queryset, keyword):
+    """
+    Filter a Products queryset to the keyword matches. With FTS5 the queryset
+    is annotated with search_rank (bm25, lower is more relevant).
+    """
+    match = build_match_query(keyword)
+    if match is None or not fts_enabled(queryset.db):
+        return queryset.filter(
+            Q(productName__icontains=keyword)
+            | Q(productBrand__icontains=keyword)
+            | Q(productInfo__icontains=keyword)
+        )
+
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+    rank = RawSQL(
+        f'SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = {PRODUCTS_TABLE}."_id"',
+        [match],
+    )
+    return queryset.filter(_id__in=matches).annotate(search_rank=rank)
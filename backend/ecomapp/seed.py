@@ -0,0 +1,141 @@
+"""
+Synthetic catalog data for load testing and benchmarks.
+
+Everything is written with bulk_create, which skips model signals, so the
+derived catalog state (listing projection, facet index, cache generation) is
+refreshed once at the end through catalog_bulk_changed().
+"""
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from .models import Category, TagType, Tag, Products, Order, OrderItem, Wishlist
+
+ADJECTIVES = [
+    'Super', 'Mega', 'Tiny', 'Happy', 'Magic', 'Rainbow', 'Turbo', 'Cosmic', 'Fluffy', 'Wooden',
+    'Classic', 'Mini', 'Giant', 'Glow', 'Racing', 'Musical', 'Jumbo', 'Smart', 'Wild', 'Golden',
+]
+NOUNS = [
+    'Robot', 'Dinosaur', 'Puzzle', 'Car', 'Doll', 'Train', 'Kite', 'Blocks', 'Teddy Bear', 'Rocket',
+    'Castle', 'Piano', 'Drone', 'Unicorn', 'Truck', 'Board Game', 'Slime', 'Yo-yo', 'Telescope', 'Crayons',
+]
+BRANDS = ['Hasbro', 'Mattel', 'Lego', 'Hot Wheels', 'Fisher-Price', 'Melissa & Doug', 'Playmobil', 'VTech', 'Bandai', 'Spin Master']
+ARRIVALS = [('New', 0.2), ('Recent', 0.3), ('Classic', 0.5)]
+TAG_TYPE_NAMES = ['Age', 'Material', 'Theme', 'Skill', 'Players', 'Occasion', 'Battery', 'Size']
+COLORS = [color for color, _ in TagType.COLOR_CHOICES]
+
+
+def _zipf_weights(count, exponent=1.1):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def _bulk(model, rows, batch_size):
+    return model.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def seed_catalog(products=1000, categories=12, tag_types=5, tags_per_type=6, users=50, orders=200,
+                 wishlist=300, seed=0, batch_size=1000, log=None):
+    """Create a synthetic catalog and return the number of rows created per model"""
+    from .signals import catalog_bulk_changed
+
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    run = rng.randrange(16 ** 6)
+    counts = {}
+
+    category_rows = _bulk(Category, [
+        Category(name=f'Category {run:06x}-{i}', description='Synthetic category') for i in range(categories)
+    ], batch_size)
+    counts['categories'] = len(category_rows)
+
+    arrival_type, _ = TagType.objects.get_or_create(name='Arrival', defaults={'description': 'Product arrival status'})
+    arrival_tags = [Tag.objects.get_or_create(name=name, tag_type=arrival_type)[0] for name, _ in ARRIVALS]
+    arrival_weights = [weight for _, weight in ARRIVALS]
+
+    type_rows = _bulk(TagType, [
+        TagType(name=f'{TAG_TYPE_NAMES[i % len(TAG_TYPE_NAMES)]} {run:06x}-{i}', color=COLORS[i % len(COLORS)])
+        for i in range(tag_types)
+    ], batch_size)
+    tag_rows = _bulk(Tag, [
+        Tag(name=f'Value {j}', tag_type=tag_type) for tag_type in type_rows for j in range(tags_per_type)
+    ], batch_size)
+    tags_by_type = {}
+    for tag in tag_rows:
+        tags_by_type.setdefault(tag.tag_type_id, []).append(tag)
+    counts['tag_types'] = len(type_rows)
+    counts['tags'] = len(tag_rows)
+    log(f'Created {len(category_rows)} categories, {len(type_rows)} tag types and {len(tag_rows)} tags')
+
+    # Popular categories and tag values are much more common than rare ones
+    category_weights = _zipf_weights(len(category_rows))
+    tag_weights = _zipf_weights(tags_per_type)
+
+    password = make_password('benchmark-password')
+    user_rows = _bulk(User, [
+        User(username=f'shopper-{run:06x}-{i}', email=f'shopper-{run:06x}-{i}@example.com', password=password)
+        for i in range(users)
+    ], batch_size)
+    counts['users'] = len(user_rows)
+
+    product_rows = []
+    for i in range(products):
+        product_rows.append(Products(
+            user=rng.choice(user_rows) if user_rows else None,
+            productName=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}',
+            category=rng.choices(category_rows, category_weights)[0] if category_rows else None,
+            productBrand=rng.choice(BRANDS),
+            productInfo=f'A {rng.choice(ADJECTIVES).lower()} {rng.choice(NOUNS).lower()} for kids of all ages.',
+            rating=Decimal(rng.randint(10, 50)) / 10,
+            numReviews=rng.randint(0, 500),
+            price=Decimal(rng.randint(99, 999900)) / 100,
+            stockCount=rng.choice([0, rng.randint(1, 500)]) if rng.random() < 0.2 else rng.randint(100, 10000),
+        ))
+    product_rows = _bulk(Products, product_rows, batch_size)
+    counts['products'] = len(product_rows)
+    log(f'Created {len(product_rows)} products')
+
+    Through = Products.tags.through
+    links = []
+    for product in product_rows:
+        links.append(Through(products_id=product._id, tag_id=rng.choices(arrival_tags, arrival_weights)[0].id))
+        for type_id, type_tags in tags_by_type.items():
+            if rng.random() < 0.7:
+                links.append(Through(products_id=product._id, tag_id=rng.choices(type_tags, tag_weights)[0].id))
+    Through.objects.bulk_create(links, batch_size=batch_size, ignore_conflicts=True)
+    counts['product_tags'] = len(links)
+
+    order_rows = _bulk(Order, [
+        Order(user=rng.choice(user_rows), payment_method=rng.choice(['Cash', 'Card', 'GCash']),
+              shipping_price=Decimal('50.00'), total_price=Decimal('0.00'),
+              status=rng.choice(Order.STATUS_CHOICES)[0])
+        for _ in range(orders if user_rows else 0)
+    ], batch_size)
+    items = []
+    sold = set()
+    for order in order_rows:
+        total = order.shipping_price
+        for product in rng.sample(product_rows, min(len(product_rows), rng.randint(1, 4))):
+            quantity = rng.randint(1, 3)
+            items.append(OrderItem(order=order, product=product, quantity=quantity, price=product.price))
+            total += product.price * quantity
+            product.unitsSold += quantity
+            sold.add(product)
+        order.total_price = total
+    _bulk(OrderItem, items, batch_size)
+    Order.objects.bulk_update(order_rows, ['total_price'], batch_size=batch_size)
+    Products.objects.bulk_update(list(sold), ['unitsSold'], batch_size=batch_size)
+    counts['orders'] = len(order_rows)
+    counts['order_items'] = len(items)
+
+    wishes = [
+        Wishlist(user=rng.choice(user_rows), product=rng.choice(product_rows))
+        for _ in range(wishlist if user_rows and product_rows else 0)
+    ]
+    Wishlist.objects.bulk_create(wishes, batch_size=batch_size, ignore_conflicts=True)
+    counts['wishlist'] = len(wishes)
+    log(f'Created {len(order_rows)} orders with {len(items)} items and {len(wishes)} wishlist entries')
+
+    catalog_bulk_changed([product._id for product in product_rows])
+    return counts
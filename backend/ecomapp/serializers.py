@@ -1,44 +1,47 @@
 from rest_framework import serializers
-from .models import Products, Category, DeliveryLocation, Order, OrderItem, Wishlist
+from .models import Products, Category, DeliveryLocation, Order, OrderItem, Wishlist, StockReservation
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
+from .listings import get_listing, render_tags
+from .images import variant_urls
 
 
+class SparseFieldsMixin:
+    """
+    Keeps only the fields listed in context['product_fields'] when it is set
+    (see fieldsets.parse_fieldset). Nested product serializers read it from
+    their parent's context, so it also trims wishlist and order items.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        wanted = self.context.get('product_fields')
+        if wanted is not None:
+            fields = {name: field for name, field in fields.items() if name in wanted}
+        return fields
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
-class ProductsSerializer(serializers.ModelSerializer):
+class ProductsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     tags = serializers.SerializerMethodField()
     arrival_status = serializers.SerializerMethodField()
+    imageVariants = serializers.SerializerMethodField()
     
     class Meta:
         model = Products
-        fields = ['_id', 'user', 'productName', 'category', 'image', 'productBrand',
+        fields = ['_id', 'user', 'productName', 'category', 'image', 'imageVariants', 'productBrand',
                 'productInfo', 'rating', 'numReviews', 'price', 'stockCount', 'createdAt', 'tags', 'arrival_status']
 
+    def get_imageVariants(self, obj):
+        # {'grid': {'webp': url, 'jpeg': url}, 'detail': {...}, 'zoom': {...}}
+        return variant_urls(obj.imageVariants)
+
     def get_tags(self, obj):
-        # Debug print
-        print(f"\nDebug - get_tags for {obj.productName}:")
-        all_tags = obj.tags.select_related('tag_type').all()
-        print(f"Raw query: {all_tags.query}")
-        print(f"Number of tags: {all_tags.count()}")
-        
         # Get all tags with their types and colors
-        tags_data = []
-        for tag in all_tags:
-            tag_data = {
-                'id': tag.id,
-                'name': tag.name,
-                'tag_type': tag.tag_type.name if tag.tag_type else 'Uncategorized',
-                'color': tag.tag_type.color if tag.tag_type else 'secondary'
-            }
-            tags_data.append(tag_data)
-            print(f"Added tag: {tag_data}")
-        
-        return tags_data
+        return render_tags(obj.tags.select_related('tag_type').all())
 
     def get_arrival_status(self, obj):
         # Get arrival tag if it exists
@@ -47,6 +50,18 @@ class ProductsSerializer(serializers.ModelSerializer):
             return arrival_tag.name.lower()  # Convert 'New' to 'new', etc.
         return 'classic'  # Default value if no arrival tag is found
 
+class ProductListingSerializer(ProductsSerializer):
+    """
+    Same output as ProductsSerializer, but tags and arrival status come from the
+    ProductListing projection. Use with select_related('category', 'listing')
+    so a list of products costs a single query.
+    """
+    def get_tags(self, obj):
+        return get_listing(obj).tags
+
+    def get_arrival_status(self, obj):
+        return get_listing(obj).arrival_status
+
 class UserSerializer(serializers.ModelSerializer):
     name = serializers.SerializerMethodField(read_only=True)
     _id = serializers.SerializerMethodField(read_only=True)
@@ -85,7 +100,7 @@ class DeliveryLocationSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductsSerializer()
+    product = ProductListingSerializer()
 
     class Meta:
         model = OrderItem
@@ -102,8 +117,13 @@ class OrderSerializer(serializers.ModelSerializer):
                  'total_price', 'status', 'is_paid', 'paid_at', 'is_delivered',
                  'delivered_at', 'created_at', 'items']
 
+class StockReservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockReservation
+        fields = ['product', 'quantity', 'expires_at']
+
 class WishlistSerializer(serializers.ModelSerializer):
-    product = ProductsSerializer(read_only=True)
+    product = ProductListingSerializer(read_only=True)
     user = UserSerializer(read_only=True)
 
     class Meta:
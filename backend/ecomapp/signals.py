@@ -0,0 +1,325 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .caching import bump_catalog_generation, bump_resource_version
+from .facets import facet_index
+from .autocomplete import suggestion_index
+from .fuzzy import fuzzy_index
+from .search import ensure_search_schema
+from .listings import refresh_listings
+from .images import refresh_product_variants, variants_current
+from .recommendations import rebuild_all_similar, recompute_similar, refresh_similar
+from .models import Products, SimilarProduct, Tag, TagType, Category
+
+
+# Facet index
+
+@receiver(post_save, sender=Products)
+def product_saved(sender, instance, **kwargs):
+    facet_index.update_product(instance._id, instance.category_id, instance.price)
+
+
+@receiver(post_delete, sender=Products)
+def product_deleted(sender, instance, **kwargs):
+    facet_index.remove_product(instance._id)
+
+
+@receiver(m2m_changed, sender=Products.tags.through)
+def product_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        # product.tags.add(...) / remove(...) / clear()
+        if action == 'post_add':
+            facet_index.add_tags(instance._id, pk_set)
+        elif action == 'post_remove':
+            facet_index.remove_tags(instance._id, pk_set)
+        else:
+            facet_index.clear_tags(instance._id)
+    else:
+        # tag.products.add(...) / remove(...) / clear()
+        if action == 'post_add':
+            for product_id in pk_set:
+                facet_index.add_tags(product_id, {instance.id})
+        elif action == 'post_remove':
+            for product_id in pk_set:
+                facet_index.remove_tags(product_id, {instance.id})
+        else:
+            facet_index.drop_tag(instance.id)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=TagType)
+@receiver(post_save, sender=Category)
+def facet_names_changed(sender, instance, **kwargs):
+    facet_index.refresh_names()
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    facet_index.drop_tag(instance.id)
+    facet_index.refresh_names()
+
+
+@receiver(post_delete, sender=TagType)
+def tag_type_deleted(sender, instance, **kwargs):
+    facet_index.refresh_names()
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    facet_index.drop_category(instance.id)
+    facet_index.refresh_names()
+
+
+# Autocomplete index
+
+@receiver(post_save, sender=Products)
+def suggestion_product_saved(sender, instance, **kwargs):
+    suggestion_index.update_product(
+        instance._id, instance.productName, instance.productBrand, instance.category_id, instance.unitsSold,
+    )
+
+
+@receiver(post_delete, sender=Products)
+def suggestion_product_deleted(sender, instance, **kwargs):
+    suggestion_index.remove_product(instance._id)
+
+
+@receiver(m2m_changed, sender=Products.tags.through)
+def suggestion_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse and action == 'post_clear':
+        suggestion_index.invalidate()
+        return
+
+    if not reverse:
+        changes = [(instance._id, pk_set or set())]
+    else:
+        changes = [(product_id, {instance.id}) for product_id in pk_set]
+    for product_id, tag_ids in changes:
+        if action == 'post_add':
+            tag_ids = suggestion_index.product_tags(product_id) | tag_ids
+        elif action == 'post_remove':
+            tag_ids = suggestion_index.product_tags(product_id) - tag_ids
+        else:
+            tag_ids = set()
+        suggestion_index.set_tags(product_id, tag_ids)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=TagType)
+@receiver(post_delete, sender=TagType)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def suggestion_names_changed(sender, **kwargs):
+    # Renames are rare; rebuild on the next lookup
+    suggestion_index.invalidate()
+
+
+# Fuzzy search index
+
+@receiver(post_save, sender=Products)
+def fuzzy_product_saved(sender, instance, **kwargs):
+    fuzzy_index.update_product(instance._id, instance.productName, instance.productBrand)
+
+
+@receiver(post_delete, sender=Products)
+def fuzzy_product_deleted(sender, instance, **kwargs):
+    fuzzy_index.remove_product(instance._id)
+
+
+# Image derivatives
+
+@receiver(post_save, sender=Products)
+def product_image_saved(sender, instance, raw=False, **kwargs):
+    image_name = instance.image.name if instance.image else ''
+    if raw or variants_current(image_name, instance.imageVariants):
+        return
+
+    def resize():
+        if refresh_product_variants(instance):
+            bump_catalog_generation()
+    # Resizing takes a while; don't hold the transaction open for it
+    transaction.on_commit(resize)
+
+
+# ProductListing projection
+
+@receiver(post_save, sender=Products)
+def refresh_product_listing(sender, instance, **kwargs):
+    refresh_listings([instance._id])
+
+
+@receiver(m2m_changed, sender=Products.tags.through)
+def refresh_tagged_listings(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_listings([instance._id])
+    elif action == 'pre_clear':
+        instance._cleared_product_ids = list(instance.products.values_list('_id', flat=True))
+    elif action == 'post_clear':
+        refresh_listings(getattr(instance, '_cleared_product_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        refresh_listings(pk_set)
+
+
+@receiver(post_save, sender=Tag)
+def refresh_tag_listings(sender, instance, created, **kwargs):
+    if not created:
+        refresh_listings(instance.products.values_list('_id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_products(sender, instance, **kwargs):
+    instance._product_ids = list(instance.products.values_list('_id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def refresh_untagged_listings(sender, instance, **kwargs):
+    refresh_listings(getattr(instance, '_product_ids', []))
+
+
+@receiver(post_save, sender=TagType)
+def refresh_tag_type_listings(sender, instance, created, **kwargs):
+    if not created:
+        refresh_listings(Products.objects.filter(tags__tag_type=instance).values_list('_id', flat=True).distinct())
+
+
+# Similar products
+
+def similarity_key(category_id, price):
+    return category_id, Decimal(str(price)) if price is not None else None
+
+
+@receiver(pre_save, sender=Products)
+def remember_similarity_key(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._id is None:
+        return
+    if update_fields is not None and not {'category', 'category_id', 'price'} & set(update_fields):
+        # Stock and rating updates don't move a product's neighbours
+        instance._similarity_key = similarity_key(instance.category_id, instance.price)
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if 'category_id' in loaded and 'price' in loaded:
+        instance._similarity_key = similarity_key(loaded['category_id'], loaded['price'])
+    else:
+        # Built by hand or read with those fields deferred
+        old = Products.objects.filter(_id=instance._id).values_list('category_id', 'price').first()
+        instance._similarity_key = similarity_key(*old) if old else None
+
+
+@receiver(post_save, sender=Products)
+def refresh_product_similar(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    key = similarity_key(instance.category_id, instance.price)
+    if created or getattr(instance, '_similarity_key', None) != key:
+        refresh_similar([instance._id])
+    if hasattr(instance, '_loaded_values'):
+        instance._loaded_values.update(category_id=instance.category_id, price=instance.price)
+
+
+@receiver(m2m_changed, sender=Products.tags.through)
+def refresh_tagged_similar(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_similar([instance._id])
+    elif action == 'post_clear':
+        # Remembered by refresh_tagged_listings on pre_clear
+        refresh_similar(getattr(instance, '_cleared_product_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        refresh_similar(pk_set)
+
+
+@receiver(post_delete, sender=Tag)
+def refresh_untagged_similar(sender, instance, **kwargs):
+    refresh_similar(getattr(instance, '_product_ids', []))
+
+
+@receiver(pre_delete, sender=Products)
+def remember_similar_to(sender, instance, **kwargs):
+    instance._similar_to = list(SimilarProduct.objects.filter(neighbor=instance).values_list('product_id', flat=True))
+
+
+@receiver(post_delete, sender=Products)
+def refill_similar(sender, instance, **kwargs):
+    # Products that listed the deleted one are a neighbour short
+    recompute_similar(getattr(instance, '_similar_to', []))
+
+
+# Resource versions behind the listing cache and the ETags
+
+@receiver(post_save, sender=Products)
+@receiver(post_delete, sender=Products)
+@receiver(m2m_changed, sender=Products.tags.through)
+def catalog_changed(sender, **kwargs):
+    # Cached product listings from before this change are no longer served
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_catalog_generation()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=TagType)
+@receiver(post_delete, sender=TagType)
+def tag_types_changed(sender, **kwargs):
+    bump_resource_version('catalog', 'tag_types')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def categories_changed(sender, **kwargs):
+    bump_resource_version('catalog', 'categories')
+
+
+def catalog_bulk_changed(product_ids=(), similar=True):
+    """
+    Bring derived catalog state up to date after bulk writes, which don't send
+    model signals. The FTS index is maintained by triggers and needs nothing.
+    Pass similar=False when a later call will refresh the similar products of
+    all the changed products in one go.
+    """
+    product_ids = list(product_ids)
+    refresh_listings(product_ids)
+    if similar:
+        refresh_similar(product_ids, bulk=True)
+    facet_index.invalidate()
+    suggestion_index.invalidate()
+    fuzzy_index.invalidate()
+    bump_resource_version('catalog', 'categories', 'tag_types')
+
+
+def stock_changed(products):
+    """
+    Bring derived state up to date after stock counters were changed with
+    update(), which sends no signals. Only cached responses and the
+    autocomplete popularity (units sold) depend on them; pass the products
+    with their counters as written. Runs once the transaction commits, so a
+    rolled back write leaves the caches and the index alone.
+    """
+    products = list(products)
+
+    def apply():
+        for product in products:
+            suggestion_index.update_product(
+                product._id, product.productName, product.productBrand, product.category_id, product.unitsSold,
+            )
+        bump_catalog_generation()
+    transaction.on_commit(apply)
+
+
+def create_search_schema(sender, using, **kwargs):
+    ensure_search_schema(using)
+
+
+def populate_similar_products(sender, using, **kwargs):
+    # A catalog from before SimilarProduct, or restored without it
+    if not SimilarProduct.objects.using(using).exists() and Products.objects.using(using).exists():
+        rebuild_all_similar()
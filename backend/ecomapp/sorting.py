@@ -0,0 +1,70 @@
+"""
+Sort orders for the product listing.
+
+Each sort is a list of (field, descending) pairs for paginate_keyset, ending
+in _id so every key is unique. Nullable columns are sorted through the
+COALESCE expressions in SORT_KEYS, so keyset comparisons never meet a NULL;
+Products.Meta declares indexes on the same expressions, which lets SQLite
+walk an index for the ORDER BY ... LIMIT instead of sorting every match.
+"""
+from django.db.models import F, FloatField, Func, IntegerField
+
+DEFAULT_SORT = 'name'
+
+
+class IfNull(Func):
+    """
+    COALESCE(expression, literal). The fallback is written into the SQL rather
+    than bound as a parameter: SQLite only uses an expression index when the
+    query repeats the indexed expression exactly, literals included.
+    """
+    function = 'COALESCE'
+    template = '%(function)s(%(expressions)s, %(fallback)s)'
+
+    def __init__(self, expression, fallback, **extra):
+        super().__init__(expression, fallback=fallback, **extra)
+
+
+class InStock(Func):
+    template = 'CASE WHEN %(expressions)s > 0 THEN 1 ELSE 0 END'
+    output_field = IntegerField()
+
+
+# Prices and ratings sort as floats; a DecimalField output would wrap the
+# expression in CASTs that differ between the index and the query
+SORT_KEYS = {
+    'sort_name': IfNull(F('productName'), "''"),
+    'sort_price': IfNull(F('price'), '0', output_field=FloatField()),
+    'sort_rating': IfNull(F('rating'), '0', output_field=FloatField()),
+    'in_stock': InStock(F('stockCount')),
+}
+
+# Sorts that are descending on their first key are descending on _id too, so
+# one ascending index serves both directions
+SORTS = {
+    'name': [('sort_name', False), ('_id', False)],
+    'price_asc': [('sort_price', False), ('_id', False)],
+    'price_desc': [('sort_price', True), ('_id', True)],
+    'rating': [('sort_rating', True), ('_id', True)],
+    'newest': [('createdAt', True), ('_id', True)],
+    'popularity': [('unitsSold', True), ('_id', True)],
+    'in_stock': [('in_stock', True), ('sort_name', False), ('_id', False)],
+}
+
+
+class InvalidSort(ValueError):
+    pass
+
+
+def get_sort(value):
+    """Return the (name, ordering) for a sort parameter, defaulting to name order"""
+    name = (value or DEFAULT_SORT).lower()
+    if name not in SORTS:
+        raise InvalidSort(f"Unknown sort '{value}'. Choose from: {', '.join(SORTS)}")
+    return name, SORTS[name]
+
+
+def annotate_sort(queryset, ordering):
+    """Add the SORT_KEYS annotations an ordering refers to"""
+    keys = {field: SORT_KEYS[field] for field, _ in ordering if field in SORT_KEYS}
+    return queryset.annotate(**keys) if keys else queryset
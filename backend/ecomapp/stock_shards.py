@@ -0,0 +1,182 @@
+"""
+Sharded stock counters for products that sell faster than one row allows.
+
+A product with stockShards = N keeps its stock in N StockShard rows instead
+of Products.stockCount, so concurrent purchases update different rows rather
+than queueing on one. take_sharded() decrements a random shard with a
+conditional UPDATE (quantity >= n) and, when that shard is short, a random
+sibling that has enough in a second one; a purchase bigger than any one
+shard takes from several of them under their row locks. Units sold are counted on the shards too.
+
+Queries that decide what can be sold or reserved sum the shards in SQL
+(current_stock()); other readers use shard_totals(), cached for
+STOCK_SHARD_CACHE_TIMEOUT seconds. At most once every
+STOCK_SHARD_SYNC_INTERVAL seconds a purchase copies the total back to
+Products.stockCount, so listings, sorting and facets stay close without every
+purchase writing the product row. reshard() (the rebalance_stock_shards
+command) turns sharding on or off and spreads the remaining stock evenly
+again once purchases have drained some shards, folding the units sold into
+Products.unitsSold.
+"""
+import random
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
+
+from .models import Products, StockShard
+
+DEFAULT_CACHE_TIMEOUT = 5
+DEFAULT_SYNC_INTERVAL = 30
+
+
+class ShardsDrained(Exception):
+    """A shard was drained by a concurrent purchase while stock was taken from several"""
+
+
+def _totals_key(product_id):
+    return f'ecomapp:stock-shards:{product_id}'
+
+
+def _shard_sum(product, column='quantity'):
+    total = StockShard.objects.filter(product=product).order_by().values('product').annotate(total=Sum(column)).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), 0)
+
+
+def current_stock():
+    """The outer query's product's stock: the sum of its shards while sharded, else stockCount"""
+    return Case(
+        When(stockShards__gt=0, then=_shard_sum(OuterRef('_id'))),
+        default=Coalesce(F('stockCount'), 0),
+    )
+
+
+def shard_units_sold():
+    """Units of the outer query's product sold from its shards since they were last rebalanced"""
+    return _shard_sum(OuterRef('_id'), 'sold')
+
+
+def shard_totals(product_ids):
+    """{product id: (stock, units sold)} summed over the shards of sharded products"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    keys = {_totals_key(product_id): product_id for product_id in product_ids}
+    totals = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [product_id for product_id in product_ids if product_id not in totals]
+    if missing:
+        rows = StockShard.objects.filter(product_id__in=missing).values('product_id').annotate(
+            stock=Sum('quantity'), sold=Sum('sold'),
+        )
+        fresh = {row['product_id']: (row['stock'], row['sold']) for row in rows}
+        cache.set_many(
+            {_totals_key(product_id): total for product_id, total in fresh.items()},
+            timeout=getattr(settings, 'STOCK_SHARD_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT),
+        )
+        totals.update(fresh)
+    return totals
+
+
+def _changed(product_id):
+    """Drop the cached total and, now and then, copy the new total to the product row"""
+    def after_commit():
+        cache.delete(_totals_key(product_id))
+        if cache.add(f'{_totals_key(product_id)}:synced', True, getattr(settings, 'STOCK_SHARD_SYNC_INTERVAL', DEFAULT_SYNC_INTERVAL)):
+            sync_stock_count(product_id)
+    transaction.on_commit(after_commit)
+
+
+def sync_stock_count(product_id):
+    Products.objects.filter(_id=product_id, stockShards__gt=0).update(stockCount=_shard_sum(product_id))
+
+
+def take_sharded(product_id, shards, quantity, count_sold=True, held=None):
+    """
+    Take quantity units from a sharded product, counting them as sold unless
+    count_sold is False. held is an expression for units that have to stay
+    in stock, such as other users' reservations. Returns False, having taken
+    nothing, when its shards don't hold that many.
+    """
+    sold = quantity if count_sold else 0
+    enough = Q(quantity__gte=quantity)
+    if held is not None:
+        enough &= GreaterThanOrEqual(_shard_sum(product_id) - held, quantity)
+    taken = StockShard.objects.filter(enough, product_id=product_id, shard=random.randrange(shards)).update(
+        quantity=F('quantity') - quantity, sold=F('sold') + sold,
+    )
+    if not taken:
+        # Any sibling with enough, picked at random in the same statement
+        sibling = StockShard.objects.filter(enough, product_id=product_id).order_by('?').values('pk')[:1]
+        taken = StockShard.objects.filter(enough, pk=Subquery(sibling)).update(
+            quantity=F('quantity') - quantity, sold=F('sold') + sold,
+        )
+    if taken:
+        _changed(product_id)
+        return True
+
+    # No single shard has enough; take what each has, fullest first
+    try:
+        with transaction.atomic():
+            rows = StockShard.objects.select_for_update().filter(product_id=product_id, quantity__gt=0).order_by('-quantity')
+            rows = list(rows.annotate(held=held) if held is not None else rows)
+            if sum(row.quantity for row in rows) - (rows[0].held if rows and held is not None else 0) < quantity:
+                return False
+            takes, remaining = {}, quantity
+            for row in rows:
+                takes[row.pk] = min(row.quantity, remaining)
+                remaining -= takes[row.pk]
+                if not remaining:
+                    break
+            # Still conditional, for databases without row locks
+            updated = StockShard.objects.filter(reduce(or_, (
+                Q(pk=pk, quantity__gte=take) for pk, take in takes.items()
+            ))).update(
+                quantity=Case(*[When(pk=pk, then=F('quantity') - take) for pk, take in takes.items()]),
+                sold=Case(*[When(pk=pk, then=F('sold') + (take if count_sold else 0)) for pk, take in takes.items()]),
+            )
+            if updated != len(takes):
+                raise ShardsDrained
+    except ShardsDrained:
+        return False
+    _changed(product_id)
+    return True
+
+
+def add_sharded(product_id, shards, quantity):
+    """Add restocked units to one of a sharded product's shards"""
+    StockShard.objects.filter(product_id=product_id, shard=random.randrange(shards)).update(quantity=F('quantity') + quantity)
+    _changed(product_id)
+
+
+def reshard(product_id, shards=None):
+    """
+    Spread a product's stock evenly over shards counters, or its current
+    number when None; 0 moves it back to Products.stockCount. Units sold on
+    the shards are added to Products.unitsSold. Returns the product's stock.
+    """
+    with transaction.atomic():
+        product = Products.objects.select_for_update().get(_id=product_id)
+        rows = list(StockShard.objects.select_for_update().filter(product_id=product_id))
+        if product.stockShards:
+            stock, sold = sum(row.quantity for row in rows), sum(row.sold for row in rows)
+        else:
+            stock, sold = product.stockCount or 0, 0
+        shards = product.stockShards if shards is None else shards
+
+        StockShard.objects.filter(product_id=product_id).delete()
+        if shards:
+            base, extra = divmod(stock, shards)
+            StockShard.objects.bulk_create([
+                StockShard(product_id=product_id, shard=shard, quantity=base + (1 if shard < extra else 0))
+                for shard in range(shards)
+            ])
+        Products.objects.filter(_id=product_id).update(
+            stockShards=shards, stockCount=stock, unitsSold=F('unitsSold') + sold,
+        )
+    cache.delete(_totals_key(product_id))
+    return stock
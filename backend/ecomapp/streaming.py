@@ -0,0 +1,44 @@
+"""
+Newline-delimited JSON output for large product listings.
+
+Asking for ?format=ndjson (or sending Accept: application/x-ndjson) makes
+getProducts stream one JSON object per line. The queryset is read with
+.iterator() and serialized a chunk at a time, so memory stays flat however
+many products match.
+"""
+import json
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only error responses get here; listings go through stream_ndjson()
+        if data is None:
+            return b''
+        return (json.dumps(data, cls=JSONEncoder) + '\n').encode()
+
+
+def ndjson_lines(queryset, serializer_class, chunk_size, context=None):
+    """Yield the serialized rows of a queryset, one chunk of lines at a time"""
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        data = serializer_class(chunk, many=True, context=context or {}).data
+        yield ''.join(json.dumps(row, cls=JSONEncoder) + '\n' for row in data).encode()
+
+
+def stream_ndjson(queryset, serializer_class, chunk_size=500, context=None):
+    return StreamingHttpResponse(
+        ndjson_lines(queryset, serializer_class, chunk_size, context),
+        content_type=NDJSONRenderer.media_type,
+    )
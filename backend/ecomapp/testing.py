@@ -0,0 +1,31 @@
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetTestMixin:
+    """Assertions for keeping endpoints within a fixed number of queries"""
+
+    def count_queries(self, func, using='default'):
+        with CaptureQueriesContext(connections[using]) as context:
+            func()
+        return len(context.captured_queries)
+
+    def assertMaxQueries(self, num, func, using='default'):
+        """Assert that calling func runs at most num queries and return the count"""
+        with CaptureQueriesContext(connections[using]) as context:
+            func()
+        executed = len(context.captured_queries)
+        if executed > num:
+            queries = '\n'.join(query['sql'] for query in context.captured_queries)
+            self.fail(f'{executed} queries executed, at most {num} allowed:\n{queries}')
+        return executed
+
+    def assertConstantQueries(self, func, grow, num, using='default'):
+        """
+        Assert that func stays within num queries and runs the same number of
+        queries before and after grow() adds more data.
+        """
+        before = self.assertMaxQueries(num, func, using)
+        grow()
+        after = self.assertMaxQueries(num, func, using)
+        self.assertEqual(before, after, 'query count grows with the amount of data')
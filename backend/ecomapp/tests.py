@@ -1,9 +1,57 @@
-from django.test import TestCase
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import BytesIO, StringIO
+from PIL import Image
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.models import User
+from rest_framework.response import Response
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Products, Category, Wishlist
+from .models import Products, Category, Wishlist, TagType, Tag, ProductListing, Order, OrderItem, SimilarProduct, IdempotencyKey, StockReservation, StockShard, InventoryLedger
+from .recommendations import rebuild_all_similar
+from .signals import populate_similar_products
+from .serializers import ProductsSerializer, ProductListingSerializer
+from .facets import facet_index
+from .autocomplete import suggestion_index
+from .fuzzy import bounded_distance, fuzzy_index
+from .images import variants_current
+from .stock_shards import reshard, shard_totals, take_sharded
+from .inventory import take_plain
+from .reservations import reserved_by_others
+from .caching import canonical_query
+from .testing import QueryBudgetTestMixin
+from . import orders
+from unittest import mock
+from .seed import seed_catalog
+from .benchmarks import percentile
+from django.core.cache import cache, caches
+from django.http import QueryDict
 from django.urls import reverse
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from datetime import timedelta
+from django.test.utils import CaptureQueriesContext
+
+
+class CatalogTestCase(TestCase):
+    """Resets the per-process catalog state that outlives each test's transaction"""
+
+    def setUp(self):
+        facet_index.invalidate()
+        caches['catalog'].clear()
 
 class WishlistTests(TestCase):
     def setUp(self):
@@ -45,3 +93,1586 @@ class WishlistTests(TestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertFalse(Wishlist.objects.filter(user=self.user, product=self.product).exists())
+
+
+class ProductPaginationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.toys = Category.objects.create(name='Toys')
+        self.books = Category.objects.create(name='Books')
+        for name in ['Doll', 'Ball', 'Ball', 'Car', 'Kite', 'Yo-yo']:
+            Products.objects.create(productName=name, category=self.toys, price=10)
+        Products.objects.create(productName='Atlas', category=self.books, price=20)
+        self.url = reverse('getProducts')
+
+    def walk(self, params):
+        ids, cursor = [], None
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            response = self.client.get(self.url, query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [p['_id'] for p in response.data['results']]
+            cursor = response.data['next']
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_catalog_in_name_order(self):
+        """Test that following next cursors returns every product exactly once"""
+        ids = self.walk({'page_size': 2})
+        expected = list(Products.objects.order_by('productName', '_id').values_list('_id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_prev_cursor_returns_previous_page(self):
+        """Test that the prev cursor of page two gives back page one"""
+        first = self.client.get(self.url, {'page_size': 3}).data
+        self.assertIsNone(first['prev'])
+        second = self.client.get(self.url, {'page_size': 3, 'cursor': first['next']}).data
+        back = self.client.get(self.url, {'page_size': 3, 'cursor': second['prev']}).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertEqual(back['next'], first['next'])
+
+    def test_pagination_respects_filters(self):
+        """Test that cursors keep applying the category filter"""
+        ids = self.walk({'page_size': 2, 'category': 'toys'})
+        self.assertEqual(len(ids), 6)
+        self.assertNotIn(Products.objects.get(productName='Atlas')._id, ids)
+
+    def test_page_size_is_capped(self):
+        """Test that page_size cannot exceed the configured maximum"""
+        with self.settings(PRODUCTS_MAX_PAGE_SIZE=4):
+            response = self.client.get(self.url, {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(response.data['page_size'], 4)
+
+    def test_invalid_cursor(self):
+        """Test that a tampered cursor is rejected"""
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductSortTests(CatalogTestCase):
+    walk = ProductPaginationTests.walk
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.url = reverse('getProducts')
+        category = Category.objects.create(name='Toys')
+        for name in ['Doll', 'Ball', 'Ball', 'Car', 'Kite', 'Yo-yo', 'Atlas']:
+            Products.objects.create(productName=name, category=category)
+        for price, product in zip([5, 30, None, 10, 25, 15, 20], Products.objects.order_by('_id')):
+            product.price = price
+            product.rating = price and price / 10
+            product.stockCount = 0 if price in (30, 25) else 3
+            product.save()
+
+    def sorted_ids(self, key, reverse=False):
+        products = sorted(Products.objects.all(), key=lambda p: (key(p), p._id), reverse=reverse)
+        return [p._id for p in products]
+
+    def test_sorts_page_through_in_order(self):
+        """Test that every sort returns the catalog in order across cursor pages"""
+        expected = {
+            'price_asc': self.sorted_ids(lambda p: p.price or 0),
+            'price_desc': self.sorted_ids(lambda p: p.price or 0, reverse=True),
+            'rating': self.sorted_ids(lambda p: p.rating or 0, reverse=True),
+            'newest': self.sorted_ids(lambda p: p.createdAt, reverse=True),
+            'in_stock': [p._id for p in sorted(
+                Products.objects.all(), key=lambda p: (p.stockCount == 0, p.productName, p._id))],
+        }
+        for sort, ids in expected.items():
+            self.assertEqual(self.walk({'page_size': 2, 'sort': sort}), ids, sort)
+            response = self.client.get(self.url, {'sort': sort})
+            self.assertEqual([p['_id'] for p in response.data], ids, sort)
+
+    def test_popularity_counts_units_sold(self):
+        """Test that orders move products up the popularity sort"""
+        user = User.objects.create_user('shopper', 'shopper@example.com', 'shopperpass123')
+        self.client.force_authenticate(user=user)
+        car = Products.objects.get(productName='Car')
+        response = self.client.post(reverse('create-order'), {
+            'payment_method': 'Cash', 'shipping_price': '0', 'total_price': '20',
+            'order_items': [{'product_id': car._id, 'quantity': 2, 'price': '10'}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(self.url, {'sort': 'popularity'})
+        self.assertEqual(response.data[0]['_id'], car._id)
+
+    def test_unknown_sort(self):
+        """Test that an unknown sort is rejected rather than ignored"""
+        response = self.client.get(self.url, {'sort': 'cheapest'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FacetIndexTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.toys = Category.objects.create(name='Toys')
+        self.games = Category.objects.create(name='Games')
+        age = TagType.objects.create(name='Age')
+        brand = TagType.objects.create(name='Brand')
+        arrival = TagType.objects.create(name='Arrival')
+        self.tags = {
+            'age3': Tag.objects.create(name='3+', tag_type=age),
+            'age8': Tag.objects.create(name='8+', tag_type=age),
+            'lego': Tag.objects.create(name='Lego', tag_type=brand),
+            'hasbro': Tag.objects.create(name='Hasbro', tag_type=brand),
+            'new': Tag.objects.create(name='New', tag_type=arrival),
+            'classic': Tag.objects.create(name='Classic', tag_type=arrival),
+        }
+        self.blocks = self.product('Blocks', self.toys, 'age3', 'lego', 'new')
+        self.castle = self.product('Castle', self.toys, 'age8', 'lego', 'classic')
+        self.monopoly = self.product('Monopoly', self.games, 'age8', 'hasbro', 'classic')
+        self.uno = self.product('Uno', self.games, 'age3', 'new')
+        self.url = reverse('getProducts')
+
+    def product(self, name, category, *tags):
+        product = Products.objects.create(productName=name, category=category, price=10)
+        product.tags.add(*[self.tags[tag] for tag in tags])
+        return product
+
+    def names(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [p['productName'] for p in response.data]
+
+    def test_index_matches_database_filters(self):
+        """Test that index-backed filtering returns what the join-based filters return"""
+        cases = [
+            {'Age': '3+'},
+            {'Age': '3+,8+', 'Brand': 'lego'},
+            {'brand': 'LEGO', 'arrival': 'classic'},
+            {'arrival': 'new,classic', 'category': 'games'},
+            {'Age': '8+', 'category': 'toys', 'keyword': 'cas'},
+            {'Brand': 'Mattel'},
+        ]
+        for params in cases:
+            with self.settings(FACET_INDEX_ENABLED=False):
+                expected = self.names(params)
+            self.assertEqual(self.names(params), expected, params)
+
+    def test_category_sort_uses_the_category_price_index(self):
+        """Test that a category-filtered price sort reads products_category_price_idx rather than sorting"""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.names({'category': 'toys', 'sort': 'price_asc'}), ['Blocks', 'Castle'])
+        sql = next(q['sql'] for q in queries if 'FROM "ecomapp_products"' in q['sql'] and 'ORDER BY' in q['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('products_category_price_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_index_follows_tag_changes(self):
+        """Test that adding and removing tags after the index is built is picked up"""
+        self.assertEqual(self.names({'Brand': 'Hasbro'}), ['Monopoly'])
+        self.uno.tags.add(self.tags['hasbro'])
+        self.assertEqual(self.names({'Brand': 'Hasbro'}), ['Monopoly', 'Uno'])
+        self.monopoly.tags.remove(self.tags['hasbro'])
+        self.tags['hasbro'].products.remove(self.uno)
+        self.assertEqual(self.names({'Brand': 'Hasbro'}), [])
+
+    def test_index_follows_product_changes(self):
+        """Test that category moves, renames and deletions are picked up"""
+        self.assertEqual(self.names({'category': 'toys'}), ['Blocks', 'Castle'])
+        self.uno.category = self.toys
+        self.uno.save()
+        self.castle.delete()
+        self.assertEqual(self.names({'category': 'toys'}), ['Blocks', 'Uno'])
+        self.toys.name = 'Playthings'
+        self.toys.save()
+        self.assertEqual(self.names({'category': 'playthings'}), ['Blocks', 'Uno'])
+
+    def test_facet_counts_exclude_own_facet(self):
+        """Test that each facet is counted under every filter except its own"""
+        url = reverse('product-facets')
+        data = self.client.get(url, {'Brand': 'Lego', 'arrival': 'classic'}).data
+        self.assertEqual(data['total'], 1)
+        # Brand counts ignore the brand filter but keep the arrival filter
+        self.assertEqual(data['tags']['Brand'], {'Lego': 1, 'Hasbro': 1})
+        self.assertEqual(data['tags']['Age'], {'3+': 0, '8+': 1})
+        self.assertEqual(data['arrival'], {'new': 1, 'classic': 1})
+        self.assertEqual(data['categories'], {'Toys': 1, 'Games': 0})
+
+        data = self.client.get(url, {'category': 'games', 'keyword': 'uno'}).data
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['categories'], {'Toys': 0, 'Games': 1})
+
+    def test_facet_price_buckets(self):
+        """Test that price buckets follow price changes and ignore the price filter"""
+        facet_index.rebuild()
+        self.castle.price = 750
+        self.castle.save()
+        with self.assertNumQueries(0):
+            data = self.client.get(reverse('product-facets'), {'price_min': 500}).data
+        self.assertEqual(data['total'], 1)
+        buckets = {bucket['min']: bucket['count'] for bucket in data['price']}
+        self.assertEqual(buckets['0'], 3)
+        self.assertEqual(buckets['500'], 1)
+        self.assertEqual(data['price'][-1]['max'], None)
+
+
+class ProductSearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        Products.objects.create(productName='Racing Car', productBrand='Hot Wheels', productInfo='Die-cast car')
+        Products.objects.create(productName='Car Wash Playset', productBrand='Hot Wheels', productInfo='Includes one car')
+        Products.objects.create(productName='Teddy Bear', productBrand='Build-A-Bear', productInfo='Soft plush, not a car')
+        Products.objects.create(productName='Chess Board', productBrand='Wheelhouse', productInfo='Wooden set')
+        self.url = reverse('getProducts')
+
+    def names(self, keyword):
+        response = self.client.get(self.url, {'keyword': keyword})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [p['productName'] for p in response.data]
+
+    def test_search_covers_brand_and_info(self):
+        """Test that keywords match the brand and description, not just the name"""
+        self.assertEqual(self.names('plush'), ['Teddy Bear'])
+        self.assertEqual(set(self.names('hot wheels')), {'Racing Car', 'Car Wash Playset'})
+
+    def test_name_matches_rank_first(self):
+        """Test that a name match outranks a brand match, which outranks an info match"""
+        Products.objects.create(productName='Puzzle', productBrand='Bear Co', productInfo='Jigsaw')
+        Products.objects.create(productName='Blocks', productBrand='Acme', productInfo='Bear shaped blocks')
+        self.assertEqual(self.names('bear'), ['Teddy Bear', 'Puzzle', 'Blocks'])
+        self.assertEqual(self.names('car')[-1], 'Teddy Bear')
+
+    def test_prefix_matching(self):
+        """Test that partially typed words still match"""
+        self.assertEqual(self.names('ted'), ['Teddy Bear'])
+        self.assertEqual(self.names('chess bo'), ['Chess Board'])
+
+    def test_index_follows_updates(self):
+        """Test that renames and deletions are reflected in search results"""
+        bear = Products.objects.get(productName='Teddy Bear')
+        bear.productName = 'Stuffed Tiger'
+        bear.save()
+        self.assertEqual(self.names('teddy'), [])
+        self.assertEqual(self.names('tiger'), ['Stuffed Tiger'])
+        bear.delete()
+        self.assertEqual(self.names('tiger'), [])
+
+    def test_search_results_paginate(self):
+        """Test that relevance-ordered results can be paged with cursors"""
+        first = self.client.get(self.url, {'keyword': 'car', 'page_size': 2}).data
+        second = self.client.get(self.url, {'keyword': 'car', 'page_size': 2, 'cursor': first['next']}).data
+        names = [p['productName'] for p in first['results'] + second['results']]
+        self.assertEqual(names, self.names('car'))
+        self.assertIsNone(second['next'])
+
+    def test_admin_search_uses_index(self):
+        """Test that the product admin search finds brand matches"""
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'adminpass123')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:ecomapp_products_changelist'), {'q': 'wheels'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(p.productName for p in response.context['cl'].result_list),
+            ['Car Wash Playset', 'Racing Car'],
+        )
+
+
+class ProductListingCacheTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Toys')
+        self.product = Products.objects.create(productName='Kite', category=self.category, price=10, stockCount=5)
+        self.url = reverse('getProducts')
+
+    def test_equivalent_queries_share_a_key(self):
+        """Test that parameter order, tag value case and price formatting are normalized"""
+        first = QueryDict('Brand=Lego,Mattel&price_min=10.00&category=Toys')
+        second = QueryDict('category=toys&price_min=10&brand=mattel,LEGO')
+        self.assertEqual(canonical_query(first), canonical_query(second))
+        self.assertNotEqual(canonical_query(first), canonical_query(QueryDict('Brand=Lego')))
+
+    def test_repeated_request_is_served_from_cache(self):
+        """Test that a repeated listing runs no queries"""
+        self.client.get(self.url, {'category': 'Toys'})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'category': 'toys'})
+        self.assertEqual([p['productName'] for p in response.data], ['Kite'])
+
+    def test_catalog_changes_invalidate_cache(self):
+        """Test that stock, product and tag changes are visible immediately"""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('update-stock'), {'productId': self.product._id, 'quantity': 2}, format='json')
+        self.assertEqual(self.client.get(self.url).data[0]['stockCount'], 3)
+
+        Products.objects.create(productName='Yo-yo', category=self.category)
+        self.assertEqual(len(self.client.get(self.url).data), 2)
+
+        tag = Tag.objects.create(name='New', tag_type=TagType.objects.create(name='Arrival'))
+        self.product.tags.add(tag)
+        self.assertEqual(self.client.get(self.url).data[0]['arrival_status'], 'new')
+
+    def test_cache_stats(self):
+        """Test that hits and misses are counted and exposed to admins"""
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'adminpass123')
+        self.client.force_authenticate(user=admin)
+        before = self.client.get(reverse('cache-stats')).data
+        self.client.get(self.url)
+        self.client.get(self.url)
+        after = self.client.get(reverse('cache-stats')).data
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+
+class ProductListingProjectionTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(name='Toys')
+        self.arrival = TagType.objects.create(name='Arrival', color='danger')
+        self.brand = TagType.objects.create(name='Brand')
+        self.new = Tag.objects.create(name='New', tag_type=self.arrival)
+        self.lego = Tag.objects.create(name='Lego', tag_type=self.brand)
+        self.products = []
+        for i in range(3):
+            product = Products.objects.create(productName=f'Set {i}', category=self.category, price=10)
+            product.tags.add(self.new, self.lego)
+            self.products.append(product)
+
+    def assertProjectionCurrent(self):
+        for product in Products.objects.all():
+            self.assertEqual(ProductListingSerializer(product).data, ProductsSerializer(product).data)
+
+    def test_projection_matches_live_serializer(self):
+        """Test that the projection renders the same response as the live tag queries"""
+        self.assertProjectionCurrent()
+        self.assertEqual(self.products[0].listing.arrival_status, 'new')
+
+    def test_projection_follows_changes(self):
+        """Test that tag, tag type, category and M2M changes re-render the projection"""
+        self.lego.name = 'LEGO'
+        self.lego.save()
+        self.arrival.color = 'warning'
+        self.arrival.save()
+        self.category.name = 'Building'
+        self.category.save()
+        self.products[0].tags.remove(self.new)
+        self.new.products.add(Products.objects.create(productName='Kite'))
+        self.assertProjectionCurrent()
+
+        self.lego.delete()
+        self.brand.delete()
+        self.assertProjectionCurrent()
+
+    def test_missing_projection_is_rendered_on_read(self):
+        """Test that a product without a projection row still serializes"""
+        ProductListing.objects.all().delete()
+        product = Products.objects.get(_id=self.products[0]._id)
+        self.assertEqual(ProductListingSerializer(product).data['arrival_status'], 'new')
+
+    def test_wishlist_and_orders_use_projection(self):
+        """Test that wishlist and order listings don't query per product"""
+        order = Order.objects.create(user=self.user, payment_method='Cash', shipping_price=0, total_price=30)
+        for product in self.products:
+            product.stockCount = 0
+            product.save()
+            Wishlist.objects.create(user=self.user, product=product)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=10)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('wishlist'))
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['product']['tags'][0]['color'], 'danger')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('my-orders'))
+        self.assertEqual(len(response.data[0]['items']), 3)
+
+
+class TracingTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        category = Category.objects.create(name='Toys')
+        for name in ['Ball', 'Kite', 'Yo-yo']:
+            Products.objects.create(productName=name, category=category, price=5)
+        self.url = reverse('getProducts')
+
+    def test_tracing_off_by_default(self):
+        """Test that nothing is logged when tracing is disabled"""
+        with self.assertNoLogs('ecomapp.tracing', level='INFO'):
+            self.client.get(self.url)
+
+    def test_sampled_request_logs_spans(self):
+        """Test that a sampled request logs its spans with durations and query counts"""
+        with self.settings(TRACING_ENABLED=True, TRACING_SAMPLE_RATE=1.0):
+            with self.assertLogs('ecomapp.tracing', level='INFO') as logs:
+                self.client.get(self.url, {'category': 'toys'})
+        trace = logs.records[0].trace
+        self.assertEqual(trace['view'], 'getProducts')
+        self.assertEqual(
+            [span['name'] for span in trace['spans']],
+            ['cache_lookup', 'parse_filters', 'query', 'serialize', 'render'],
+        )
+        self.assertEqual(sum(span['queries'] for span in trace['spans']), trace['queries'])
+        self.assertGreater(trace['queries'], 0)
+
+    def test_listing_query_count_is_constant(self):
+        """Test that the product listing no longer queries per product"""
+        with self.settings(CATALOG_CACHE_ENABLED=False):
+            with self.assertNumQueries(1):
+                self.client.get(self.url)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='shopper', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(name='Toys')
+        self.arrival = TagType.objects.create(name='Arrival')
+        self.new = Tag.objects.create(name='New', tag_type=self.arrival)
+        self.add_catalog(3)
+
+    def add_catalog(self, count):
+        order = Order.objects.create(user=self.user, payment_method='Cash', shipping_price=0, total_price=0)
+        for i in range(count):
+            product = Products.objects.create(productName=f'Toy {i}', category=self.category, price=5, stockCount=0)
+            product.tags.add(self.new)
+            Wishlist.objects.create(user=self.user, product=product)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=5)
+        caches['catalog'].clear()
+
+    def get(self, name, params=None):
+        return lambda: self.assertEqual(self.client.get(reverse(name), params).status_code, status.HTTP_200_OK)
+
+    def test_product_listing_query_count(self):
+        """Test that /api/products/ stays under a fixed query count as the catalog grows"""
+        facet_index.rebuild()
+        self.assertConstantQueries(self.get('getProducts', {'arrival': 'new'}), lambda: self.add_catalog(20), 1)
+
+    def test_my_orders_query_count(self):
+        """Test that /api/orders/myorders/ stays under a fixed query count as orders grow"""
+        self.assertConstantQueries(self.get('my-orders'), lambda: self.add_catalog(20), 2)
+
+    def test_wishlist_query_count(self):
+        """Test that /api/wishlist/ stays under a fixed query count as the wishlist grows"""
+        self.assertConstantQueries(self.get('wishlist'), lambda: self.add_catalog(20), 1)
+
+    def test_server_timing_header(self):
+        """Test that responses report query count and timings"""
+        response = self.client.get(reverse('getProducts'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$')
+
+    def test_over_budget_requests_are_logged(self):
+        """Test that a route exceeding its budget logs a warning"""
+        with self.settings(QUERY_BUDGETS={'wishlist': {'queries': 0, 'ms': 1000}}):
+            with self.assertLogs('ecomapp.performance', level='WARNING') as logs:
+                self.client.get(reverse('wishlist'))
+        self.assertIn('(wishlist) ran 1 queries', logs.output[0])
+
+
+class CheckoutTests(QueryBudgetTestMixin, CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='shopper', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.products = [Products.objects.create(productName=f'Toy {i}', price=5, stockCount=3) for i in range(4)]
+
+    def order(self, *lines):
+        return self.client.post(reverse('create-order'), {
+            'payment_method': 'Cash', 'shipping_price': '0', 'total_price': '10',
+            'order_items': [{'product_id': product._id, 'quantity': quantity, 'price': '5'} for product, quantity in lines],
+        }, format='json')
+
+    def stock(self):
+        return [(p.stockCount, p.unitsSold) for p in Products.objects.order_by('_id')]
+
+    def test_order_takes_stock_with_constant_queries(self):
+        """Test that checkout runs the same queries for one line as for several"""
+        one = self.count_queries(lambda: self.assertEqual(self.order((self.products[0], 1)).status_code, 201))
+        many = self.count_queries(lambda: self.assertEqual(
+            self.order((self.products[1], 2), (self.products[2], 1), (self.products[3], 3), (self.products[1], 1)).status_code, 201))
+        self.assertEqual(one, many)
+        self.assertEqual(self.stock(), [(2, 1), (0, 3), (2, 1), (0, 3)])
+        self.assertEqual(OrderItem.objects.count(), 5)
+
+    def test_failed_line_writes_nothing(self):
+        """Test that a line without enough stock leaves no order and no stock taken"""
+        response = self.order((self.products[0], 1), (self.products[1], 2), (self.products[1], 2))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'Not enough stock for Toy 1. Available: 3')
+        response = self.client.post(reverse('create-order'), {
+            'payment_method': 'Cash', 'shipping_price': '0', 'total_price': '10',
+            'order_items': [{'product_id': self.products[0]._id, 'quantity': 1, 'price': '5'},
+                            {'product_id': 999999, 'quantity': 1, 'price': '5'}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.order((self.products[0], 0)).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stock(), [(3, 0)] * 4)
+        self.assertFalse(Order.objects.exists())
+
+    def test_stock_taken_concurrently_rolls_back(self):
+        """Test that losing a race for the last units rolls the whole order back"""
+        def lock_then_lose_race(product_ids, user):
+            products = lock_products(product_ids, user)
+            # Another checkout takes the stock after this one read it
+            Products.objects.filter(_id=self.products[1]._id).update(stockCount=1)
+            return products
+
+        lock_products = orders.lock_products
+        with mock.patch('ecomapp.orders.lock_products', lock_then_lose_race):
+            response = self.order((self.products[0], 1), (self.products[1], 2))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        # The stand-in for the other checkout ran inside this transaction, so it's undone too
+        self.assertEqual(self.stock(), [(3, 0)] * 4)
+        self.assertFalse(Order.objects.exists())
+
+
+class IdempotencyTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='shopper', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.product = Products.objects.create(productName='Kite', price=5, stockCount=5)
+
+    def order(self, key, quantity=1):
+        return self.client.post(reverse('create-order'), {
+            'payment_method': 'Cash', 'shipping_price': '0', 'total_price': '5',
+            'order_items': [{'product_id': self.product._id, 'quantity': quantity, 'price': '5'}],
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self):
+        """Test that a retried order is answered from the stored response without a second order"""
+        first = self.order('checkout-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(1):
+            retry = self.order('checkout-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, json.loads(json.dumps(first.data)))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Products.objects.get(pk=self.product.pk).stockCount, 4)
+        # Another key is another order
+        self.assertEqual(self.order('checkout-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_losing_the_key_race_leaves_caches_alone(self):
+        """Test that an attempt rolled back because another request stored the key first changes no caches or indexes"""
+        # The other request's stored response is what gets replayed
+        with mock.patch('ecomapp.idempotency.IdempotencyKey.objects.create', side_effect=IntegrityError), \
+                mock.patch('ecomapp.idempotency.IdempotencyKey.objects.get'), \
+                mock.patch('ecomapp.idempotency.replay', return_value=Response(status=status.HTTP_201_CREATED)), \
+                mock.patch('ecomapp.signals.bump_catalog_generation') as bump, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.order('checkout-1').status_code, status.HTTP_201_CREATED)
+        bump.assert_not_called()
+        self.assertEqual(Products.objects.get(pk=self.product.pk).stockCount, 5)
+
+    def test_stock_update_retry_decrements_once(self):
+        """Test that retried stock updates take the stock once"""
+        for _ in range(3):
+            response = self.client.post(reverse('update-stock'), {'productId': self.product._id, 'quantity': 2},
+                                        format='json', HTTP_IDEMPOTENCY_KEY='stock-1')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Products.objects.get(pk=self.product.pk).stockCount, 3)
+
+    def test_key_reused_for_another_request(self):
+        """Test that a key can't be replayed for a different body or by another user"""
+        self.order('checkout-1')
+        self.assertEqual(self.order('checkout-1', quantity=2).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.client.force_authenticate(user=User.objects.create_user(username='other', password='testpass123'))
+        self.assertEqual(self.order('checkout-1').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_failed_outcomes(self):
+        """Test that validation failures are replayed but conflicts can be retried"""
+        self.assertEqual(self.order('big', quantity=9).status_code, status.HTTP_400_BAD_REQUEST)
+        Products.objects.filter(pk=self.product.pk).update(stockCount=9)
+        self.assertEqual(self.order('big', quantity=9).status_code, status.HTTP_400_BAD_REQUEST)
+
+        def lose_race(product_ids, user):
+            products = lock_products(product_ids, user)
+            Products.objects.filter(pk=self.product.pk).update(stockCount=0)
+            return products
+
+        lock_products = orders.lock_products
+        with mock.patch('ecomapp.orders.lock_products', lose_race):
+            self.assertEqual(self.order('race').status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.order('race').status_code, status.HTTP_201_CREATED)
+
+    def test_expired_keys(self):
+        """Test that expired keys run the request again and are purged by the command"""
+        self.order('checkout-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.order('checkout-1').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+        IdempotencyKey.objects.create(key='old', scope='create-order:1', fingerprint='x', status_code=201,
+                                      expires_at=timezone.now() - timedelta(days=1))
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1 expired idempotency keys', out.getvalue())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+class ReservationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', password='testpass123')
+        self.kite = Products.objects.create(productName='Kite', price=5, stockCount=5)
+
+    def reserve(self, user, quantity, product=None):
+        self.client.force_authenticate(user=user)
+        url = reverse('reservation-item', args=[(product or self.kite)._id])
+        return self.client.post(url, {'quantity': quantity}, format='json')
+
+    def order(self, user, quantity):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('create-order'), {
+            'payment_method': 'Cash', 'shipping_price': '0', 'total_price': '5',
+            'order_items': [{'product_id': self.kite._id, 'quantity': quantity, 'price': '5'}],
+        }, format='json')
+
+    def available(self, user=None):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse('getProductsBatch'), {'ids': self.kite._id})
+        return response.data['available'][self.kite._id]
+
+    def test_holds_limit_what_others_can_buy(self):
+        """Test that live holds are taken out of what other users can reserve and order"""
+        self.assertEqual(self.reserve(self.alice, 3).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.available(), 2)
+        self.assertEqual(self.available(self.alice), 5)
+        response = self.reserve(self.bob, 3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'Only 2 of Kite available')
+        response = self.order(self.bob, 3)
+        self.assertEqual(response.data['detail'], 'Not enough stock for Kite. Available: 2')
+        self.assertEqual(self.order(self.bob, 2).status_code, status.HTTP_201_CREATED)
+        # Alice's hold is still whole
+        self.assertEqual(self.available(self.alice), 3)
+
+    def test_order_converts_reservation(self):
+        """Test that checking out takes the stock and releases the user's hold"""
+        self.reserve(self.alice, 2)
+        self.assertEqual(self.order(self.alice, 2).status_code, status.HTTP_201_CREATED)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Products.objects.get(pk=self.kite.pk).stockCount, 3)
+        self.assertEqual(self.available(self.bob), 3)
+
+    def test_extend_and_release(self):
+        """Test that holds can be listed, extended and released, and lapse when they expire"""
+        self.reserve(self.alice, 2)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.available(self.bob), 5)
+        self.assertEqual(self.client.get(reverse('reservations')).data, [])
+        url = reverse('reservation-item', args=[self.kite._id])
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.patch(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['quantity'], 2)
+        self.assertEqual(len(self.client.get(reverse('reservations')).data), 1)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.patch(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.reserve(self.alice, 1, Products(_id=999999)).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sweeper_deletes_expired_holds(self):
+        """Test that expire_reservations deletes only lapsed holds"""
+        self.reserve(self.alice, 1)
+        self.reserve(self.bob, 1)
+        StockReservation.objects.filter(user=self.bob).update(expires_at=timezone.now() - timedelta(minutes=1))
+        out = StringIO()
+        call_command('expire_reservations', stdout=out)
+        self.assertIn('Expired 1 reservations', out.getvalue())
+        self.assertEqual(list(StockReservation.objects.values_list('user__username', flat=True)), ['alice'])
+
+
+class StockShardTests(QueryBudgetTestMixin, CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='shopper', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.product = Products.objects.create(productName='Console', price=300, stockCount=10)
+        call_command('rebalance_stock_shards', self.product._id, shards=4, stdout=StringIO())
+
+    def order(self, quantity):
+        # Shard totals are uncached once the purchase commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('create-order'), {
+                'payment_method': 'Cash', 'shipping_price': '0', 'total_price': '300',
+                'order_items': [{'product_id': self.product._id, 'quantity': quantity, 'price': '300'}],
+            }, format='json')
+
+    def update_stock(self, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('update-stock'), {'productId': self.product._id, 'quantity': quantity}, format='json')
+
+    def shards(self):
+        return list(StockShard.objects.filter(product=self.product).order_by('shard').values_list('quantity', 'sold'))
+
+    def test_stock_is_split_and_taken_from_shards(self):
+        """Test that checkout takes from the shards, several at once when no one shard has enough"""
+        self.assertEqual(self.shards(), [(3, 0), (3, 0), (2, 0), (2, 0)])
+        self.assertEqual(self.order(3).status_code, 201)
+        # Even taking from several shards stays within the route's budget
+        budget = settings.QUERY_BUDGETS['create-order']['queries']
+        self.assertMaxQueries(budget, lambda: self.assertEqual(self.order(5).status_code, 201))
+        self.assertEqual(sum(stock for stock, _ in self.shards()), 2)
+        self.assertEqual(sum(sold for _, sold in self.shards()), 8)
+        response = self.order(3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'Not enough stock for Console. Available: 2')
+
+        response = self.client.get(reverse('getProductsBatch'), {'ids': self.product._id})
+        self.assertEqual(response.data['products'][0]['stockCount'], 2)
+        self.assertEqual(response.data['available'], {self.product._id: 2})
+
+    def test_rebalance_and_disable(self):
+        """Test that rebalancing spreads what is left and disabling moves it back to the product"""
+        self.assertEqual(self.order(3).status_code, 201)
+        # Only --disable turns sharding off
+        with self.assertRaisesMessage(CommandError, 'between 1 and 255'):
+            call_command('rebalance_stock_shards', self.product._id, shards=0, stdout=StringIO())
+        call_command('rebalance_stock_shards', stdout=StringIO())
+        self.assertEqual(self.shards(), [(2, 0), (2, 0), (2, 0), (1, 0)])
+        call_command('rebalance_stock_shards', self.product._id, disable=True, stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stockShards, self.product.stockCount, self.product.unitsSold), (0, 7, 3))
+        self.assertEqual(self.shards(), [])
+
+    def test_reservations_hold_sharded_stock(self):
+        """Test that holds on a sharded product are checked against its shards, at checkout too"""
+        bob = User.objects.create_user(username='bob', password='testpass123')
+        # The product row's copy of the stock is stale until the next sync
+        Products.objects.filter(_id=self.product._id).update(stockCount=100)
+        self.client.force_authenticate(user=bob)
+        url = reverse('reservation-item', args=[self.product._id])
+        self.assertEqual(self.client.post(url, {'quantity': 11}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, {'quantity': 7}, format='json').status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('getProductsBatch'), {'ids': self.product._id})
+        self.assertEqual(response.data['available'], {self.product._id: 3})
+        response = self.order(4)
+        self.assertEqual(response.data['detail'], 'Not enough stock for Console. Available: 3')
+        self.assertEqual(self.order(3).status_code, 201)
+        # Taking a unit from the shards still leaves bob's hold in stock
+        self.assertFalse(take_sharded(self.product._id, 4, 1, held=reserved_by_others(self.user, self.product._id)))
+        self.assertEqual(sum(stock for stock, _ in self.shards()), 7)
+
+    def test_update_stock_takes_from_shards(self):
+        """Test that update_stock decrements a sharded product's shards"""
+        self.assertEqual(self.update_stock(4).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.update_stock(7).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(shard_totals([self.product._id]), {self.product._id: (6, 0)})
+
+
+class StockShardConcurrencyTests(TransactionTestCase):
+    def test_concurrent_purchases_never_oversell(self):
+        """Test that threads racing to buy a sharded product sell exactly the stock there is"""
+        product = Products.objects.create(productName='Console', price=300, stockCount=60)
+        reshard(product._id, 4)
+        sold = []
+
+        def buy():
+            try:
+                for _ in range(15):
+                    quantity = random.choice([1, 2, 5])
+                    while True:
+                        try:
+                            with transaction.atomic():
+                                taken = take_sharded(product._id, 4, quantity)
+                            break
+                        except OperationalError:
+                            # SQLite's shared-cache test database locks tables; try again
+                            time.sleep(0.001)
+                    if taken:
+                        sold.append(quantity)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        shards = StockShard.objects.filter(product=product)
+        self.assertEqual(sum(sold), 60 - sum(shard.quantity for shard in shards))
+        self.assertEqual(sum(sold), sum(shard.sold for shard in shards))
+        self.assertTrue(all(shard.quantity >= 0 for shard in shards))
+        self.assertGreater(sum(sold), 50)
+
+
+class StockAdjustmentTests(QueryBudgetTestMixin, CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='stockist', password='testpass123')
+        self.client.force_authenticate(user=self.admin)
+        self.products = [Products.objects.create(productName=f'Box {i}', price=5, stockCount=5) for i in range(3)]
+
+    def adjust(self, *lines, reason='Delivery'):
+        return self.client.post(reverse('adjust-stock'), {
+            'reason': reason,
+            'adjustments': [{'product_id': product_id, 'delta': delta} for product_id, delta in lines],
+        }, format='json')
+
+    def stock(self):
+        return list(Products.objects.order_by('_id').values_list('stockCount', flat=True))
+
+    def test_batch_is_applied_and_recorded(self):
+        """Test that every line is applied, reported with the stock after it and appended to the ledger"""
+        first, second, third = (product._id for product in self.products)
+        response = self.adjust((first, 10), (second, -5), (first, -3), (third, -1))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(line['product_id'], line['stockCount']) for line in response.data['lines']],
+                         [(first, 15), (second, 0), (first, 12), (third, 4)])
+        self.assertEqual(self.stock(), [12, 0, 4])
+        ledger = InventoryLedger.objects.order_by('id')
+        self.assertEqual(list(ledger.values_list('product_id', 'delta', 'stock_after')),
+                         [(first, 10, 15), (second, -5, 0), (first, -3, 12), (third, -1, 4)])
+        self.assertEqual({entry.reason for entry in ledger}, {'Delivery'})
+        self.assertEqual(len({entry.batch for entry in ledger}), 1)
+        with self.assertRaises(ValueError):
+            ledger.first().save()
+
+    def test_batch_is_all_or_nothing(self):
+        """Test that one short or unknown line refuses the whole batch with a status per line"""
+        first, second, _ = (product._id for product in self.products)
+        response = self.adjust((first, -2), (second, -4), (second, -2), (second, 3))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['ok', 'ok', 'insufficient_stock', 'ok'])
+        response = self.adjust((first, -2), (999999, 1))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['ok', 'not_found'])
+        self.assertEqual(self.adjust((first, 0)).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stock(), [5, 5, 5])
+        self.assertFalse(InventoryLedger.objects.exists())
+
+    def test_stock_taken_concurrently_refuses_batch(self):
+        """Test that stock taken between the check and the update rolls the batch back"""
+        def lose_race(changes, user):
+            Products.objects.filter(_id=self.products[0]._id).update(stockCount=1)
+            return take_plain(changes, user)
+
+        with mock.patch('ecomapp.inventory.take_plain', lose_race):
+            response = self.adjust((self.products[0]._id, -2), (self.products[1]._id, 3))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.stock(), [5, 5, 5])
+
+    def test_constant_queries_and_admin_only(self):
+        """Test that a batch runs the same queries for one line as for several, and only for admins"""
+        budget = settings.QUERY_BUDGETS['adjust-stock']['queries']
+        self.assertConstantQueries(
+            lambda: self.assertEqual(self.adjust(*[(product._id, 1) for product in self.products]).status_code, 200),
+            lambda: self.products.extend(Products.objects.create(productName='Crate', price=5) for _ in range(5)),
+            budget,
+        )
+        self.client.force_authenticate(user=User.objects.create_user(username='shopper', password='testpass123'))
+        self.assertEqual(self.adjust((self.products[0]._id, 1)).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_lines_are_checked_in_order(self):
+        """Test that a write-off can't borrow from a restock later in the batch, or from others' holds"""
+        empty = Products.objects.create(productName='Empty', price=5, stockCount=0)
+        response = self.adjust((empty._id, -5), (empty._id, 5))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['insufficient_stock', 'ok'])
+        response = self.adjust((empty._id, 5), (empty._id, -5))
+        self.assertEqual([line['stockCount'] for line in response.data['lines']], [5, 0])
+
+        StockReservation.objects.create(
+            user=User.objects.create_user(username='shopper', password='testpass123'), product=self.products[0],
+            quantity=3, expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        response = self.adjust((self.products[0]._id, -3))
+        self.assertEqual([line['status'] for line in response.data['lines']], ['insufficient_stock'])
+        self.assertEqual(self.adjust((self.products[0]._id, -2)).status_code, status.HTTP_200_OK)
+        self.assertEqual(list(InventoryLedger.objects.order_by('id').values_list('delta', 'stock_after')), [(5, 5), (-5, 0), (-2, 3)])
+
+    def test_sharded_products_are_adjusted_on_their_shards(self):
+        """Test that restocks and write-offs of a sharded product go to its shards"""
+        product = self.products[0]
+        reshard(product._id, 3)
+        self.assertEqual(self.adjust((product._id, 4)).data['lines'][0]['stockCount'], 9)
+        self.assertEqual(self.adjust((product._id, -8)).data['lines'][0]['stockCount'], 1)
+        self.assertEqual(self.adjust((product._id, -2)).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(StockShard.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'], 1)
+
+    def test_update_stock_is_recorded(self):
+        """Test that update_stock goes through the ledger"""
+        response = self.client.post(reverse('update-stock'), {'productId': self.products[1]._id, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.stock(), [5, 3, 5])
+        self.assertEqual(list(InventoryLedger.objects.values_list('delta', 'stock_after', 'reason')), [(-2, 3, 'update_stock')])
+        response = self.client.post(reverse('update-stock'), {'productId': self.products[1]._id, 'quantity': 4}, format='json')
+        self.assertEqual(response.data['detail'], 'Not enough stock available')
+
+
+class SeedCatalogTests(CatalogTestCase):
+    def test_seed_catalog(self):
+        """Test that the generator creates consistent, searchable data"""
+        counts = seed_catalog(products=40, categories=3, tag_types=2, tags_per_type=3, users=5, orders=10, wishlist=10)
+        self.assertEqual(Products.objects.count(), 40)
+        self.assertEqual(ProductListing.objects.count(), 40)
+        self.assertEqual(Order.objects.count(), counts['orders'])
+        # Every product has an arrival tag, which the projection picked up
+        self.assertFalse(Products.objects.exclude(tags__tag_type__name='Arrival').exists())
+        response = APIClient().get(reverse('getProducts'), {'arrival': 'new,recent,classic', 'page_size': 100})
+        self.assertEqual(len(response.data['results']), 40)
+
+    def test_percentile(self):
+        """Test the nearest-rank percentile used by the benchmark report"""
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+
+class ProductBatchTests(QueryBudgetTestMixin, CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        category = Category.objects.create(name='Toys')
+        tag = Tag.objects.create(name='New', tag_type=TagType.objects.create(name='Arrival'))
+        self.products = []
+        for name in ['Ball', 'Kite', 'Yo-yo', 'Drum']:
+            product = Products.objects.create(productName=name, category=category, price=5, stockCount=3)
+            product.tags.add(tag)
+            self.products.append(product)
+        self.url = reverse('getProductsBatch')
+
+    def test_batch_preserves_order_and_reports_missing(self):
+        """Test that products come back in request order with unknown ids listed"""
+        ids = [self.products[2]._id, 9999, self.products[0]._id, 'abc', self.products[2]._id]
+        response = self.client.post(self.url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['productName'] for p in response.data['products']], ['Yo-yo', 'Ball'])
+        self.assertEqual(response.data['missing'], [9999, 'abc'])
+        self.assertEqual(response.data['products'][0]['stockCount'], 3)
+        self.assertEqual(response.data['products'][0]['category']['name'], 'Toys')
+        self.assertEqual(response.data['products'][0]['arrival_status'], 'new')
+
+    def test_batch_by_query_string(self):
+        """Test that ids can also be passed as ?ids="""
+        ids = ','.join(str(p._id) for p in self.products[:2])
+        response = self.client.get(self.url, {'ids': ids})
+        self.assertEqual([p['productName'] for p in response.data['products']], ['Ball', 'Kite'])
+
+    def test_batch_is_a_single_query(self):
+        """Test that the number of queries doesn't depend on the number of ids"""
+        ids = [p._id for p in self.products]
+        self.assertEqual(self.assertMaxQueries(1, lambda: self.client.post(self.url, {'ids': ids}, format='json')), 1)
+
+    def test_batch_size_limit(self):
+        """Test that oversized batches are rejected"""
+        with self.settings(PRODUCTS_BATCH_MAX=2):
+            response = self.client.post(self.url, {'ids': [1, 2, 3]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalGetTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Toys')
+        self.product = Products.objects.create(productName='Kite', category=self.category, price=10, stockCount=5)
+
+    def test_etag_revalidation_runs_no_queries(self):
+        """Test that a matching If-None-Match gets a 304 without touching the database"""
+        urls = [
+            reverse('getProducts') + '?category=Toys',
+            reverse('getProduct', kwargs={'pk': self.product._id}),
+            reverse('getCategories'),
+            reverse('tag-types'),
+        ]
+        for url in urls:
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, url)
+            self.assertEqual(response.content, b'')
+
+    def test_if_modified_since(self):
+        """Test that Last-Modified is honoured when no ETag is sent"""
+        url = reverse('getCategories')
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_changes_produce_new_validators(self):
+        """Test that edits change the ETag of the affected resources only"""
+        product_url = reverse('getProduct', kwargs={'pk': self.product._id})
+        product_etag = self.client.get(product_url)['ETag']
+        categories_etag = self.client.get(reverse('getCategories'))['ETag']
+        tag_types_etag = self.client.get(reverse('tag-types'))['ETag']
+
+        self.product.stockCount = 4
+        self.product.save()
+        response = self.client.get(product_url, HTTP_IF_NONE_MATCH=product_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['stockCount'], 4)
+        self.assertEqual(self.client.get(reverse('getCategories'))['ETag'], categories_etag)
+
+        TagType.objects.create(name='Age')
+        self.assertNotEqual(self.client.get(reverse('tag-types'))['ETag'], tag_types_etag)
+        self.assertNotEqual(self.client.get(product_url)['ETag'], product_etag)
+
+    def test_etag_depends_on_query(self):
+        """Test that different filters get different ETags and equivalent ones share"""
+        url = reverse('getProducts')
+        self.assertNotEqual(self.client.get(url, {'category': 'Toys'})['ETag'], self.client.get(url)['ETag'])
+        self.assertEqual(self.client.get(url, {'category': 'toys'})['ETag'], self.client.get(url, {'category': 'Toys'})['ETag'])
+
+
+class SparseFieldsetTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'shopperpass123')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(name='Toys')
+        self.product = Products.objects.create(
+            productName='Kite', productInfo='A long description', category=self.category, price=10, stockCount=0)
+        self.product.tags.add(Tag.objects.create(name='New', tag_type=TagType.objects.create(name='Arrival')))
+
+    def test_fields_trim_output_and_query(self):
+        """Test that unrequested fields are neither serialized nor selected"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('getProducts'), {'fields': 'productName,price'})
+        self.assertEqual(response.data, [{'productName': 'Kite', 'price': '10.00'}])
+        sql = context.captured_queries[-1]['sql']
+        self.assertNotIn('productInfo', sql)
+        self.assertNotIn('JOIN', sql)
+
+        response = self.client.get(reverse('getProduct', kwargs={'pk': self.product._id}), {'exclude': 'productInfo,category'})
+        self.assertNotIn('productInfo', response.data)
+        self.assertNotIn('category', response.data)
+        self.assertEqual(response.data['arrival_status'], 'new')
+
+    def test_fields_apply_to_nested_products(self):
+        """Test that wishlist and order items carry only the requested product fields"""
+        Wishlist.objects.create(user=self.user, product=self.product)
+        response = self.client.get(reverse('wishlist'), {'fields': '_id,tags'})
+        self.assertEqual(set(response.data[0]['product']), {'_id', 'tags'})
+        self.assertEqual(response.data[0]['product']['tags'][0]['name'], 'New')
+
+        order = Order.objects.create(user=self.user, payment_method='Cash', shipping_price=50, total_price=60)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=10)
+        response = self.client.get(reverse('order-details', kwargs={'pk': order.id}), {'fields': 'productName'})
+        self.assertEqual(response.data['items'][0]['product'], {'productName': 'Kite'})
+        self.assertEqual(response.data['total_price'], '60.00')
+
+    def test_unknown_fields_are_rejected(self):
+        """Test that a misspelled field name is a 400 rather than an empty object"""
+        response = self.client.get(reverse('getProducts'), {'fields': 'productName,colour'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('colour', response.data['detail'])
+
+
+class ProductStreamingTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        category = Category.objects.create(name='Toys')
+        for name in ['Kite', 'Ball', 'Car', 'Doll', 'Yo-yo']:
+            Products.objects.create(productName=name, category=category, price=10)
+        self.url = reverse('getProducts')
+
+    def lines(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_ndjson_streams_one_product_per_line(self):
+        """Test that format=ndjson streams the same products as the JSON listing"""
+        expected = self.client.get(self.url, {'sort': 'price_asc'}).data
+        with self.settings(PRODUCTS_STREAM_CHUNK_SIZE=2):
+            response = self.client.get(self.url, {'format': 'ndjson', 'sort': 'price_asc'})
+            self.assertTrue(response.streaming)
+            self.assertEqual(self.lines(response), json.loads(json.dumps(expected)))
+
+    def test_accept_header_and_filters(self):
+        """Test that the Accept header selects streaming and filters still apply"""
+        response = self.client.get(
+            self.url, {'keyword': 'kite', 'fields': 'productName'}, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(self.lines(response), [{'productName': 'Kite'}])
+
+    def test_errors_are_single_lines(self):
+        """Test that errors are still reported in NDJSON form"""
+        response = self.client.get(self.url, {'format': 'ndjson', 'sort': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('detail', json.loads(response.content))
+
+
+class ImportCatalogTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.toys = Category.objects.create(name='Toys')
+        self.brand = TagType.objects.create(name='Brand')
+        self.lego = Tag.objects.create(name='Lego', tag_type=self.brand)
+
+    def import_file(self, content, suffix, *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        call_command('import_catalog', f.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_import_creates_products_and_tags(self):
+        """Test that a CSV creates products and reuses or creates categories and tags"""
+        output = self.import_file(
+            'sku,productName,price,stockCount,category,tags\n'
+            'K-1,Kite,12.50,4,toys,Brand:LEGO|Age:8+\n'
+            'B-1,Ball,3,,Outdoor,\n'
+            ',Nameless,1,1,Toys,\n'
+            'C-1,Car,abc,1,Toys,\n',
+            '.csv', '--batch-size', '2',
+        )
+        self.assertIn('2 created', output)
+        self.assertIn('2 skipped', output)
+        kite = Products.objects.get(sku='K-1')
+        self.assertEqual((kite.productName, kite.price, kite.stockCount, kite.category), ('Kite', Decimal('12.50'), 4, self.toys))
+        self.assertEqual(Products.objects.get(sku='B-1').category.name, 'Outdoor')
+        self.assertIn(self.lego, kite.tags.all())
+        self.assertTrue(Tag.objects.filter(name='8+', tag_type__name='Age').exists())
+        self.assertEqual(Tag.objects.filter(name__iexact='lego').count(), 1)
+
+        # Signals were skipped, so the derived state must have been refreshed
+        self.assertIn('Lego', [tag['name'] for tag in ProductListing.objects.get(product=kite).tags])
+        response = APIClient().get(reverse('getProducts'), {'Age': '8+'})
+        self.assertEqual([p['productName'] for p in response.data], ['Kite'])
+
+    def test_jsonl_reimport_updates_by_sku(self):
+        """Test that rows update matching products, keep unlisted columns and replace tags"""
+        self.import_file('{"sku": "K-1", "productName": "Kite", "price": 10, "tags": ["Brand:Lego"]}\n', '.jsonl')
+        self.import_file(
+            '{"sku": "K-1", "price": "8.00", "tags": {"Theme": ["Outdoor", "Summer"]}}\n'
+            '\n'
+            'not json\n',
+            '.jsonl',
+        )
+        kite = Products.objects.get(sku='K-1')
+        self.assertEqual((kite.productName, kite.price), ('Kite', Decimal('8.00')))
+        self.assertEqual(sorted(tag.name for tag in kite.tags.all()), ['Outdoor', 'Summer'])
+        self.assertEqual(Products.objects.count(), 1)
+
+
+class ImageVariantTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root,
+            PRODUCT_IMAGE_VARIANTS={'grid': 40, 'detail': 80},
+            PRODUCT_IMAGE_FORMATS=['webp', 'jpeg'],
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+
+    def make_image(self, name, size=(200, 100), color='red', mode='RGB'):
+        buffer = BytesIO()
+        Image.new(mode, size, color).save(buffer, format='PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_saving_an_image_generates_hashed_variants(self):
+        """Test that a new image gets resized webp and jpeg copies with content-hashed names once it commits"""
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Products.objects.create(productName='Kite', price=5, image=self.make_image('kite.png', mode='RGBA'))
+            self.assertEqual(Products.objects.get(_id=product._id).imageVariants, {})
+        product.refresh_from_db()
+        self.assertEqual(product.imageVariants['source'], product.image.name)
+        grid = product.imageVariants['grid']
+        self.assertRegex(grid['webp'], r'^derived/kite-grid-[0-9a-f]{12}\.webp$')
+        self.assertRegex(grid['jpeg'], r'^derived/kite-grid-[0-9a-f]{12}\.jpg$')
+        with Image.open(os.path.join(self.media_root, product.imageVariants['detail']['jpeg'])) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (80, 40)))
+
+        data = ProductsSerializer(product).data
+        self.assertEqual(data['imageVariants']['grid']['webp'], '/images/' + grid['webp'])
+
+        # Saving again without a new image leaves the variants alone
+        product.productName = 'Red kite'
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.imageVariants['grid'], grid)
+
+        product.image = self.make_image('kite.png', color='blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertNotEqual(product.imageVariants['grid']['webp'], grid['webp'])
+
+    def test_unreadable_image_does_not_block_saving(self):
+        """Test that a product whose image can't be read still saves, without variants"""
+        with self.assertLogs('ecomapp.images', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            product = Products.objects.create(productName='Kite', price=5, image='missing.png')
+        product.refresh_from_db()
+        self.assertEqual(product.imageVariants, {})
+        self.assertEqual(ProductsSerializer(product).data['imageVariants'], {})
+
+    def test_command_backfills_missing_variants(self):
+        """Test that generate_image_variants fills in products saved without variants"""
+        path = default_storage.save('ball.png', self.make_image('ball.png'))
+        Products.objects.bulk_create([
+            Products(productName='Ball', price=1, image=path),
+            Products(productName='Ball 2', price=1, image=path),
+            Products(productName='Plain', price=1),
+        ])
+        out = StringIO()
+        call_command('generate_image_variants', '--workers', '1', stdout=out)
+        self.assertIn('Updated 2 products from 1 images', out.getvalue())
+        manifests = [p.imageVariants for p in Products.objects.filter(image=path)]
+        self.assertEqual(manifests[0], manifests[1])
+        self.assertTrue(default_storage.exists(manifests[0]['grid']['webp']))
+
+        out = StringIO()
+        call_command('generate_image_variants', '--workers', '1', stdout=out)
+        self.assertIn('up to date', out.getvalue())
+
+    def test_import_generates_variants(self):
+        """Test that import_catalog resizes the images of the rows it imports"""
+        path = default_storage.save('ball.png', self.make_image('ball.png'))
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(f'sku,productName,price,image\nB-1,Ball,3,{path}\n')
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        call_command('import_catalog', f.name, '--image-workers', '1', stdout=out)
+        self.assertIn('Updated 1 products from 1 images', out.getvalue())
+        self.assertTrue(variants_current(path, Products.objects.get(sku='B-1').imageVariants))
+
+
+@override_settings(MEDIA_SENDFILE=None, MEDIA_CACHE_MAX_AGE=60)
+class MediaServingTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.mkdir(os.path.join(media_root, 'derived'))
+        self.files = {
+            'derived/kite-grid-0123456789ab.webp': b'0123456789',
+            'logo.svg': b'<svg></svg>',
+            'logo.svg.gz': b'gzipped svg',
+        }
+        for name, content in self.files.items():
+            with open(os.path.join(media_root, name), 'wb') as f:
+                f.write(content)
+
+    def get(self, name, **headers):
+        response = self.client.get(reverse('media', args=[name]), **headers)
+        if response.streaming:
+            response.body = b''.join(response.streaming_content)
+        return response
+
+    def test_hashed_files_are_immutable_and_revalidate(self):
+        """Test that derivatives are cached for good and an unchanged ETag gets a 304"""
+        response = self.get('derived/kite-grid-0123456789ab.webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, b'0123456789')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.get('logo.svg')['Cache-Control'], 'public, max-age=60')
+
+        response = self.get('derived/kite-grid-0123456789ab.webp', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_byte_ranges(self):
+        """Test that single ranges get a 206, and ranges past the end a 416"""
+        name = 'derived/kite-grid-0123456789ab.webp'
+        response = self.get(name, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual((response.body, response['Content-Range'], response['Content-Length']), (b'2345', 'bytes 2-5/10', '4'))
+        self.assertEqual(self.get(name, HTTP_RANGE='bytes=-3').body, b'789')
+        self.assertEqual(self.get(name, HTTP_RANGE='bytes=20-').status_code, 416)
+        # A stale If-Range gets the whole file
+        response = self.get(name, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, response.body), (200, b'0123456789'))
+
+    def test_precompressed_variant(self):
+        """Test that a .gz file is sent to clients accepting gzip"""
+        response = self.get('logo.svg', HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual((response.body, response['Content-Encoding']), (b'gzipped svg', 'gzip'))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.get('logo.svg', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertEqual(response.body, b'<svg></svg>')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_accel_redirect(self):
+        """Test that the file is left to the web server when MEDIA_SENDFILE is set"""
+        response = self.get('logo.svg', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/logo.svg.gz')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+    def test_missing_and_outside_files(self):
+        """Test that missing files, directories and paths outside MEDIA_ROOT are 404s"""
+        self.assertEqual(self.get('nope.png').status_code, 404)
+        self.assertEqual(self.get('derived').status_code, 404)
+        self.assertEqual(self.get('../settings.py').status_code, 404)
+
+
+class SimilarProductTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        toys = Category.objects.create(name='Toys')
+        books = Category.objects.create(name='Books')
+        brand = TagType.objects.create(name='Brand')
+        theme = TagType.objects.create(name='Theme')
+        self.acme = Tag.objects.create(name='Acme', tag_type=brand)
+        self.outdoor = Tag.objects.create(name='Outdoor', tag_type=theme)
+        self.products = {}
+        for name, category, price, tags in [
+            ('Kite', toys, 10, [self.acme, self.outdoor]),
+            ('Glider', toys, 12, [self.acme, self.outdoor]),
+            ('Ball', toys, 50, [self.outdoor]),
+            ('Novel', books, 11, []),
+            ('Puzzle', toys, 200, []),
+        ]:
+            product = Products.objects.create(productName=name, category=category, price=price)
+            product.tags.set(tags)
+            self.products[name] = product
+
+    def similar(self, name):
+        response = self.client.get(reverse('similar-products', args=[self.products[name]._id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [p['productName'] for p in response.data]
+
+    def stored(self):
+        return sorted(SimilarProduct.objects.values_list('product_id', 'rank', 'neighbor_id', 'score'))
+
+    def assert_matches_rebuild(self):
+        incremental = self.stored()
+        rebuild_all_similar()
+        self.assertEqual(incremental, self.stored())
+
+    def test_neighbors_ranked_by_tags_category_and_price(self):
+        """Test that shared tags rank first, then category and price, and a product isn't its own neighbour"""
+        self.assertEqual(self.similar('Kite'), ['Glider', 'Ball', 'Puzzle'])
+        # Nothing shares a tag or category with it
+        self.assertEqual(self.similar('Novel'), [])
+        with self.assertNumQueries(1):
+            self.client.get(reverse('similar-products', args=[self.products['Kite']._id]), {'fields': 'productName,tags'})
+
+    def test_changes_refresh_affected_products(self):
+        """Test that tag, price and category changes and deletes keep the table equal to a full rebuild"""
+        novel, ball = self.products['Novel'], self.products['Ball']
+        novel.tags.add(self.acme, self.outdoor)
+        self.assertEqual(self.similar('Kite')[:2], ['Glider', 'Novel'])
+        self.assert_matches_rebuild()
+
+        ball.price = 11
+        ball.save()
+        self.assert_matches_rebuild()
+
+        self.products['Glider'].delete()
+        self.assertNotIn('Glider', self.similar('Kite'))
+        self.assert_matches_rebuild()
+
+        self.outdoor.delete()
+        self.assert_matches_rebuild()
+
+    def test_import_refreshes_similar_products(self):
+        """Test that imported products get neighbours once the import finishes"""
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write('{"sku": "K-2", "productName": "Box kite", "price": 9, "category": "Toys", "tags": ["Brand:Acme", "Theme:Outdoor"]}\n')
+        self.addCleanup(os.remove, f.name)
+        call_command('import_catalog', f.name, stdout=StringIO())
+        self.assertEqual(self.similar('Kite')[:2], ['Box kite', 'Glider'])
+        self.assert_matches_rebuild()
+
+    def test_saves_skip_work_that_similarity_does_not_need(self):
+        """Test that a save reads nothing back to compare, and a refresh counts tag frequencies once"""
+        kite = Products.objects.get(_id=self.products['Kite']._id)
+        with CaptureQueriesContext(connection) as queries:
+            kite.productName = 'Red kite'
+            kite.save()
+            Products.objects.get(_id=kite._id).save(update_fields=['stockCount'])
+        self.assertFalse([q for q in queries if 'similarproduct' in q['sql']])
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT "ecomapp_products"."category_id"')])
+
+        with CaptureQueriesContext(connection) as queries:
+            kite.price = 13
+            kite.save()
+        self.assertEqual(len([q for q in queries if 'COUNT("ecomapp_products_tags"."id")' in q['sql']]), 1)
+        self.assert_matches_rebuild()
+
+    def test_refresh_reads_price_windows_not_categories(self):
+        """Test that a refresh reads a bounded price window around each product rather than whole categories"""
+        toys = self.products['Kite'].category
+        Products.objects.bulk_create([Products(productName=f'Car {i}', category=toys, price=20 + i % 10) for i in range(40)])
+        rebuild_all_similar()
+        ball = self.products['Ball']
+        with CaptureQueriesContext(connection) as queries:
+            ball.price = 25
+            ball.save()
+        by_category = [
+            q['sql'] for q in queries
+            if q['sql'].startswith('SELECT') and re.search(r'"ecomapp_products"\."category_id" (=|IN)', q['sql'])
+        ]
+        self.assertTrue(by_category)
+        self.assertTrue(all(' LIMIT ' in sql for sql in by_category))
+        self.assert_matches_rebuild()
+
+    @override_settings(SIMILAR_PRODUCTS_REFRESH_LIMIT=2)
+    def test_big_changes_are_left_to_the_command(self):
+        """Test that a change to more products than a request refreshes is logged for rebuild_similar_products"""
+        before = self.stored()
+        with self.assertLogs('ecomapp.recommendations', 'WARNING'):
+            self.outdoor.delete()
+        self.assertEqual(self.stored(), before)
+        call_command('rebuild_similar_products', stdout=StringIO())
+        self.assertNotEqual(self.stored(), before)
+
+    def test_migrate_fills_an_empty_table(self):
+        """Test that post_migrate computes the similar products of a catalog that has none"""
+        expected = self.stored()
+        SimilarProduct.objects.all().delete()
+        populate_similar_products(sender=None, using='default')
+        self.assertEqual(self.stored(), expected)
+
+
+class AutocompleteTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.toys = Category.objects.create(name='Toys')
+        brand = TagType.objects.create(name='Brand')
+        self.lego = Tag.objects.create(name='Lego', tag_type=brand)
+        self.bus = Products.objects.create(productName='City Bus', productBrand='Lego', category=self.toys, price=30)
+        self.bus.tags.add(self.lego)
+        self.cars = Products.objects.create(productName='Toy Cars', productBrand='Hot Wheels', category=self.toys, price=5)
+        Products.objects.filter(_id=self.cars._id).update(unitsSold=50)
+        Products.objects.filter(_id=self.bus._id).update(unitsSold=10)
+        suggestion_index.rebuild()
+
+    def suggest(self, q, **params):
+        response = self.client.get(reverse('product-autocomplete'), {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(s['type'], s['label']) for s in response.data]
+
+    def test_prefix_matches_any_word_ranked_by_popularity(self):
+        """Test that names, brands, categories and tags match on any word, most popular first"""
+        self.assertEqual(self.suggest('l'), [('brand', 'Lego'), ('tag', 'Lego')])
+        self.assertEqual(self.suggest('bu'), [('product', 'City Bus')])
+        # Toys sold 60 units across both products, Toy Cars 50
+        self.assertEqual(self.suggest('TOY'), [('category', 'Toys'), ('product', 'Toy Cars')])
+        self.assertEqual(self.suggest('to', limit=1), [('category', 'Toys')])
+        self.assertEqual(self.suggest(''), [])
+        with self.assertNumQueries(0):
+            self.suggest('c')
+
+    def test_updates_apply_without_rebuilding(self):
+        """Test that product and tag changes show up straight away"""
+        self.bus.productName = 'Double Decker'
+        self.bus.save()
+        self.bus.tags.remove(self.lego)
+        Products.objects.create(productName='Ćity Scooter', price=8)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('do'), [('product', 'Double Decker')])
+            self.assertEqual(self.suggest('le'), [('brand', 'Lego')])
+            self.assertEqual(self.suggest('city'), [('product', 'Ćity Scooter')])
+        self.cars.delete()
+        self.assertEqual(self.suggest('hot'), [])
+
+    def test_memoized_rankings_follow_popularity(self):
+        """Test that a remembered ranking is revised when another term overtakes it"""
+        self.assertEqual(self.suggest('t', limit=2), [('category', 'Toys'), ('product', 'Toy Cars')])
+
+        Products.objects.create(productName='Train', price=1, unitsSold=80)
+        self.assertEqual(self.suggest('t', limit=2), [('product', 'Train'), ('category', 'Toys')])
+        self.cars.unitsSold = 500
+        self.cars.save()
+        self.assertEqual(self.suggest('t', limit=2), [('category', 'Toys'), ('product', 'Toy Cars')])
+
+    def test_memoized_ranking_loses_a_term_while_another_changes(self):
+        """Test that one update removing a brand and changing a product with the same prefix revises the memo"""
+        self.cars.productBrand = 'Carrera'
+        self.cars.save()
+        self.assertEqual(self.suggest('car'), [('brand', 'Carrera'), ('product', 'Toy Cars')])
+
+        # Toy Cars is revised before Carrera, which has just lost its last product
+        self.cars.productBrand = 'Mattel'
+        self.cars.save()
+        self.assertEqual(self.suggest('car'), [('product', 'Toy Cars')])
+
+
+class FuzzySearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.speaker = Products.objects.create(productName='Bluetooth Speaker', productBrand='Sony', price=80)
+        self.headphones = Products.objects.create(productName='Wireless Headphones', productBrand='Sony', price=120)
+        Products.objects.create(productName='Speaker Stand', productBrand='Generic', price=20)
+        fuzzy_index.rebuild()
+
+    def search(self, keyword, **params):
+        response = self.client.get(reverse('getProducts'), {'keyword': keyword, 'fuzzy': 1, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_bounded_distance(self):
+        """Test that the edit distance gives up past its bound"""
+        self.assertEqual(bounded_distance('speaker', 'speaker', 2), 0)
+        self.assertEqual(bounded_distance('spekaer', 'speaker', 2), 2)
+        self.assertIsNone(bounded_distance('spkr', 'speaker', 2))
+
+    def test_misspelled_keyword_matches_and_suggests(self):
+        """Test that typos still find products, closest first, with a corrected keyword"""
+        response = self.search('blutooth speker')
+        self.assertEqual([p['productName'] for p in response.data], ['Bluetooth Speaker'])
+        self.assertEqual(response['X-Did-You-Mean'], 'bluetooth speaker')
+        response = self.search('speaker')
+        self.assertEqual(len(response.data), 2)
+        self.assertNotIn('X-Did-You-Mean', response)
+        # Without fuzzy=1 the keyword goes through full-text search
+        response = self.client.get(reverse('getProducts'), {'keyword': 'speker'})
+        self.assertEqual(response.data, [])
+
+    def test_paginated_and_cached_responses_keep_suggestion(self):
+        """Test that the suggestion header survives pagination and the listing cache"""
+        first = self.search('sonny', page_size=1)
+        second = self.search('sonny', page_size=1)
+        self.assertEqual(first['X-Did-You-Mean'], 'sony')
+        self.assertEqual(second['X-Did-You-Mean'], 'sony')
+        self.assertEqual(first.data['results'][0]['productName'], 'Bluetooth Speaker')
+
+    def test_matches_are_bound_as_one_json_parameter(self):
+        """Test that the matched ids and their ranks go through json_each rather than a variable per id"""
+        with CaptureQueriesContext(connection) as queries:
+            names = [p['productName'] for p in self.search('speker').data]
+        self.assertEqual(names, ['Bluetooth Speaker', 'Speaker Stand'])
+        listing = [q['sql'] for q in queries if 'FROM "ecomapp_products"' in q['sql'] and 'ORDER BY' in q['sql']]
+        self.assertIn('json_each', listing[0])
+        self.assertNotIn('CASE', listing[0])
+
+    @override_settings(FUZZY_SEARCH_MAX_RESULTS=1)
+    def test_limit_applies_after_filters(self):
+        """Test that the result limit keeps the best matches among the filtered products, and facets count them all"""
+        self.assertEqual([p['productName'] for p in self.search('speker').data], ['Bluetooth Speaker'])
+        self.assertEqual([p['productName'] for p in self.search('speker', price_max=50).data], ['Speaker Stand'])
+        response = self.client.get(reverse('product-facets'), {'keyword': 'speker', 'fuzzy': 1})
+        self.assertEqual(response.data['total'], 2)
+
+    def test_index_follows_product_changes(self):
+        """Test that renamed, new and deleted products are matched without a rebuild"""
+        self.headphones.productName = 'Wireless Earbuds'
+        self.headphones.save()
+        Products.objects.create(productName='Portable Projector', price=300)
+        self.speaker.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(fuzzy_index.search('earbds'), ([self.headphones._id], 'earbuds'))
+        self.assertEqual(self.search('projectr blutooth').data, [])
+        self.assertEqual([p['productName'] for p in self.search('projectr').data], ['Portable Projector'])
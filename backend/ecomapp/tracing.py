@@ -0,0 +1,108 @@
+"""
+Sampled request tracing for the ecomapp views.
+
+Views decorated with @traced get a trace on request.trace. Wrap the parts of
+the view worth timing in `with request.trace.span('name'):` and each span
+records its duration and the number of SQL queries it ran. When the DRF
+response is rendered the trace is logged to the 'ecomapp.tracing' logger.
+
+Tracing is off unless TRACING_ENABLED is set, and even then only
+TRACING_SAMPLE_RATE of requests are traced. Unsampled requests get NULL_TRACE,
+whose spans do nothing.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('ecomapp.tracing')
+
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.queries = 0
+        self.started = time.perf_counter()
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def span(self, name):
+        started, queries = time.perf_counter(), self.queries
+        try:
+            yield
+        finally:
+            self.spans.append({
+                'name': name,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'queries': self.queries - queries,
+            })
+
+    def run(self, view, request, *args, **kwargs):
+        with connection.execute_wrapper(self._count_query):
+            response = view(request, *args, **kwargs)
+
+        if hasattr(response, 'add_post_render_callback') and not response.is_rendered:
+            # DRF renders the response after the view returns
+            render_span = self.span('render')
+            render_span.__enter__()
+
+            def rendered(response):
+                render_span.__exit__(None, None, None)
+                self.finish(response)
+
+            response.add_post_render_callback(rendered)
+        else:
+            self.finish(response)
+        return response
+
+    def finish(self, response):
+        record = {
+            'view': self.name,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'queries': self.queries,
+            'spans': self.spans,
+        }
+        spans = ' '.join(f"{s['name']}={s['duration_ms']}ms/{s['queries']}q" for s in self.spans)
+        logger.info(
+            '%s %s %.1fms %dq %s', self.name, record['status'], record['duration_ms'], self.queries, spans,
+            extra={'trace': record},
+        )
+
+
+class NullTrace:
+    _span = nullcontext()
+
+    def span(self, name):
+        return self._span
+
+
+NULL_TRACE = NullTrace()
+
+
+def start_trace(name):
+    if not getattr(settings, 'TRACING_ENABLED', False):
+        return NULL_TRACE
+    if random.random() >= getattr(settings, 'TRACING_SAMPLE_RATE', 0.0):
+        return NULL_TRACE
+    return Trace(name)
+
+
+def traced(view):
+    """Decorator giving a view a sampled trace on request.trace"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        trace = start_trace(view.__name__)
+        request.trace = trace
+        if trace is NULL_TRACE:
+            return view(request, *args, **kwargs)
+        return trace.run(view, request, *args, **kwargs)
+    return wrapper
@@ -2,12 +2,13 @@ from django.shortcuts import render
 from django.http import JsonResponse
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count, Q, F, Prefetch, prefetch_related_objects
 from django.utils import timezone
 from datetime import timedelta
 
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.settings import api_settings
 
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
@@ -15,8 +16,29 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
 
 # from .products import products
-from .models import Products, Category, Order, OrderItem, DeliveryLocation, Wishlist, TagType, Tag
-from .serializers import ProductsSerializer, UserSerializer, UserSerializerWithToken, CategorySerializer, OrderSerializer, DeliveryLocationSerializer, WishlistSerializer
+from .models import Products, Category, Order, OrderItem, DeliveryLocation, Wishlist, TagType, Tag, SimilarProduct
+from .serializers import ProductsSerializer, ProductListingSerializer, UserSerializer, UserSerializerWithToken, CategorySerializer, OrderSerializer, DeliveryLocationSerializer, WishlistSerializer, StockReservationSerializer
+from .filters import parse_product_filters, apply_product_filters
+from .search import search_products
+from .pagination import InvalidCursor, get_page_size, paginate_keyset
+from .facets import facet_index, restrict_to, ids_to_bits
+from .autocomplete import suggestion_index
+from .orders import CheckoutError, place_order
+from .idempotency import idempotent
+from .reservations import ReservationError, extend, live_reservations, release, reserve, with_available
+from .signals import stock_changed
+from .stock_shards import shard_totals
+from .inventory import AdjustmentError, adjust_stock, parse_adjustments
+from .fuzzy import fuzzy_index
+from .fieldsets import InvalidFieldset, parse_fieldset, project_products
+from .sorting import InvalidSort, get_sort, annotate_sort
+from .streaming import NDJSONRenderer, stream_ndjson
+from .tracing import traced
+from .caching import (
+    listing_cache_key, get_cached_listing, set_cached_listing, cache_stats,
+    products_etag, facets_etag, product_etag, categories_etag, tag_types_etag, last_modified,
+)
+from django.views.decorators.http import condition
 
 # for sending mails and generate token
 from django.template.loader import render_to_string
@@ -31,6 +53,30 @@ import threading
 from django.db import transaction
 from decimal import Decimal
 
+# Keyword searches are ordered by relevance unless a sort is asked for;
+# the other keyset orderings are in sorting.SORTS
+RELEVANCE_ORDERING = [('search_rank', False), ('_id', False)]
+
+
+def did_you_mean_headers(filters):
+    """X-Did-You-Mean for fuzzy searches with a misspelled keyword"""
+    if filters['keyword'] and filters['fuzzy']:
+        suggestion = fuzzy_index.did_you_mean(filters['keyword'])
+        if suggestion:
+            return {'X-Did-You-Mean': suggestion}
+    return None
+
+
+def product_fields(request):
+    """The product fields picked with ?fields= or ?exclude=, or None for all of them"""
+    return parse_fieldset(request.GET, ProductsSerializer.Meta.fields)
+
+
+def order_items(fields=None):
+    # Order items with everything OrderItemSerializer reads
+    return project_products(OrderItem.objects.select_related('product'), fields, prefix='product__')
+
+
 class EmailThread(threading.Thread):
     def __init__(self, email_message):
         self.email_message = email_message
@@ -44,113 +90,215 @@ def getRoutes(request):
     return Response('Hello Anees')
 
 
+@condition(etag_func=products_etag, last_modified_func=last_modified('catalog'))
 @api_view(['GET'])
+@renderer_classes(api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer])
+@traced
 def getProducts(request):
-    print("\n=== Starting getProducts request ===")
-    print("URL:", request.build_absolute_uri())
-    print("Query params:", dict(request.GET))
-    
-    # Start with all products and prefetch related tags
-    products = Products.objects.prefetch_related('tags', 'tags__tag_type').all()
-    
-    print("\n=== Initial Products and Their Tags ===")
-    for product in products:
-        print(f"\nProduct: {product.productName} (ID: {product._id})")
-        tags = list(product.tags.select_related('tag_type').all())
-        print(f"Number of tags: {len(tags)}")
-        for tag in tags:
-            print(f"- {tag.tag_type.name if tag.tag_type else 'No type'}: {tag.name}")
-    
-    # Apply filters
-    arrival_status = request.GET.get('arrival', '')
-    category = request.GET.get('category', '')
-    query = request.GET.get('keyword', '')
-    
-    # Get price range filters
-    price_min = request.GET.get('price_min')
-    price_max = request.GET.get('price_max')
-    
-    # Get all tag filters from query params
-    tag_filters = {}
-    for param, value in request.GET.items():
-        # Skip non-tag parameters
-        if param in ['arrival', 'category', 'keyword', 'price_min', 'price_max']:
-            continue
-        # Handle tag type filters
-        if value:
-            tag_filters[param] = value.split(',')
-    
-    filtered_products = products
-    
-    # Apply price range filter
-    if price_min is not None:
-        try:
-            min_price = float(price_min)
-            filtered_products = filtered_products.filter(price__gte=min_price)
-            print(f"\nFiltering by minimum price: {min_price}")
-        except (ValueError, TypeError):
-            print(f"Invalid minimum price value: {price_min}")
-            
-    if price_max is not None:
+    trace = request.trace
+    # ?format=ndjson or Accept: application/x-ndjson streams the whole listing
+    streaming = request.accepted_renderer.format == NDJSONRenderer.format
+
+    # Identical (normalized) queries are answered from the listing cache
+    if not streaming:
+        with trace.span('cache_lookup'):
+            cache_key = listing_cache_key(request.GET)
+            cached = get_cached_listing(cache_key)
+        if cached is not None:
+            return Response(cached, headers=did_you_mean_headers(parse_product_filters(request.GET)))
+
+    with trace.span('parse_filters'):
+        filters = parse_product_filters(request.GET)
+        paginated = 'cursor' in request.GET or 'page_size' in request.GET
+        page_size = get_page_size(request.GET.get('page_size'))
         try:
-            max_price = float(price_max)
-            filtered_products = filtered_products.filter(price__lte=max_price)
-            print(f"\nFiltering by maximum price: {max_price}")
-        except (ValueError, TypeError):
-            print(f"Invalid maximum price value: {price_max}")
-    
-    # Apply tag filters
-    for tag_type, tag_values in tag_filters.items():
-        print(f"\nFiltering by tag - {tag_type}: {tag_values}")
-        # Create a Q object for each tag value in this type
-        tag_q = Q()
-        for tag_value in tag_values:
-            tag_q |= Q(tags__tag_type__name__iexact=tag_type, tags__name__iexact=tag_value)
-        filtered_products = filtered_products.filter(tag_q).distinct()
-    
-    # Handle arrival status separately since it's a special case
-    if arrival_status:
-        print(f"\nFiltering by arrival status: {arrival_status}")
-        arrival_values = arrival_status.split(',')
-        arrival_q = Q()
-        for value in arrival_values:
-            arrival_q |= Q(tags__name__iexact=value.title(), tags__tag_type__name='Arrival')
-        filtered_products = filtered_products.filter(arrival_q).distinct()
-    
-    if category:
-        print(f"\nFiltering by category: {category}")
-        filtered_products = filtered_products.filter(
-            category__name__iexact=category
-        ).distinct()
-    
-    if query:
-        print(f"\nFiltering by search query: {query}")
-        filtered_products = filtered_products.filter(
-            productName__icontains=query
-        ).distinct()
-    
-    # Final result
-    filtered_products = filtered_products.order_by('productName')
-    
-    print("\n=== Final Products and Their Tags ===")
-    for product in filtered_products:
-        print(f"\nProduct: {product.productName}")
-        tags = list(product.tags.select_related('tag_type').all())
-        print(f"Number of tags: {len(tags)}")
-        for tag in tags:
-            print(f"- {tag.tag_type.name if tag.tag_type else 'No type'}: {tag.name}")
-    
-    serializer = ProductsSerializer(filtered_products, many=True)
-    return Response(serializer.data)
+            fields = product_fields(request)
+            sort_name, sort_ordering = get_sort(request.GET.get('sort'))
+        except (InvalidFieldset, InvalidSort) as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    with trace.span('query'):
+        # Start with all products, loading only the columns and joins the
+        # requested fields need; tags are read from the listing projection
+        products = project_products(Products.objects.all(), fields)
+
+        # Tag, arrival and category filters are resolved in memory by the
+        # facet index so the query only needs the matching ids. A category on
+        # its own stays a column filter, so its sorts can use the indexes.
+        category_ids = facet_index.category_only(filters)
+        if category_ids is not None:
+            products = products.filter(category_id__in=category_ids)
+            filtered_products = apply_product_filters(products, filters, facets=False)
+        else:
+            matched = facet_index.match(filters)
+            if matched is not None:
+                products = restrict_to(products, matched)
+            filtered_products = apply_product_filters(products, filters, facets=matched is None)
+
+        if 'search_rank' in filtered_products.query.annotations and 'sort' not in request.GET:
+            ordering_name, ordering = 'relevance', RELEVANCE_ORDERING
+        else:
+            ordering_name, ordering = sort_name, sort_ordering
+            filtered_products = annotate_sort(filtered_products, ordering)
+
+        order_by = [F(field).desc() if descending else F(field).asc() for field, descending in ordering]
+        if streaming:
+            # Pagination doesn't apply; rows are read and sent a chunk at a time
+            return stream_ndjson(
+                filtered_products.order_by(*order_by),
+                ProductListingSerializer,
+                chunk_size=getattr(settings, 'PRODUCTS_STREAM_CHUNK_SIZE', 500),
+                context={'product_fields': fields},
+            )
+
+        # Cursor pagination is opt-in so the plain list response keeps working
+        if paginated:
+            try:
+                page = paginate_keyset(
+                    filtered_products,
+                    ordering,
+                    cursor=request.GET.get('cursor'),
+                    page_size=page_size,
+                    ordering_name=ordering_name,
+                )
+            except InvalidCursor:
+                return Response({'detail': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            filtered_products = page['results']
+        else:
+            filtered_products = list(filtered_products.order_by(*order_by))
+
+    with trace.span('serialize'):
+        data = ProductListingSerializer(filtered_products, many=True, context={'product_fields': fields}).data
+        if paginated:
+            data = {
+                'results': data,
+                'next': page['next'],
+                'prev': page['prev'],
+                'page_size': page_size,
+            }
+        set_cached_listing(cache_key, data)
+    # The suggestion is a header so plain list responses can carry it too
+    return Response(data, headers=did_you_mean_headers(filters))
+
+
+@condition(etag_func=facets_etag, last_modified_func=last_modified('catalog'))
+@api_view(['GET'])
+@traced
+def get_product_facets(request):
+    """
+    Product counts per tag, arrival status, category and price bucket for the
+    filters getProducts accepts. Each facet ignores its own filter, so the
+    counts show what choosing a different value would return.
+    """
+    filters = parse_product_filters(request.GET)
+    matches = None
+    if filters['keyword']:
+        with request.trace.span('search'):
+            if filters['fuzzy']:
+                # Every match, not just the FUZZY_SEARCH_MAX_RESULTS a listing keeps
+                matches = ids_to_bits(fuzzy_index.search(filters['keyword'])[0])
+            else:
+                matches = ids_to_bits(search_products(Products.objects.all(), filters['keyword']).values_list('_id', flat=True))
+    with request.trace.span('count'):
+        data = facet_index.counts(filters, matches)
+    return Response(data)
 
 
 @api_view(['GET'])
+@traced
+def get_product_suggestions(request):
+    """
+    Typeahead suggestions for ?q= from the in-memory autocomplete index:
+    products, brands, categories and tags with a word starting with q, most
+    popular first. Doesn't touch the database once the index is built.
+    """
+    default = getattr(settings, 'AUTOCOMPLETE_LIMIT', 8)
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        limit = default
+    limit = max(1, min(limit, getattr(settings, 'AUTOCOMPLETE_MAX_LIMIT', 20)))
+    return Response(suggestion_index.suggest(request.GET.get('q', ''), limit))
+
+
+@condition(etag_func=product_etag, last_modified_func=last_modified('catalog'))
+@api_view(['GET'])
+@traced
 def getProduct(request,pk):
-    product=Products.objects.get(_id=pk)
-    serializer=ProductsSerializer(product,many=False)
+    try:
+        fields = product_fields(request)
+    except InvalidFieldset as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    product=project_products(Products.objects.all(), fields).annotate(shards=F('stockShards')).get(_id=pk)
+    if product.shards:
+        product.stockCount, _ = shard_totals([product._id]).get(product._id, (0, 0))
+    serializer=ProductListingSerializer(product,many=False,context={'product_fields': fields})
     return Response(serializer.data)
 
 
+@condition(etag_func=product_etag, last_modified_func=last_modified('catalog'))
+@api_view(['GET'])
+@traced
+def get_similar_products(request, pk):
+    """The product's precomputed neighbours (see recommendations.py), most similar first"""
+    try:
+        fields = product_fields(request)
+    except InvalidFieldset as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    rows = SimilarProduct.objects.filter(product_id=pk).select_related('neighbor').order_by('rank')
+    rows = project_products(rows, fields, prefix='neighbor__')
+    serializer = ProductListingSerializer([row.neighbor for row in rows], many=True, context={'product_fields': fields})
+    return Response(serializer.data)
+
+
+
+@api_view(['GET', 'POST'])
+@traced
+def getProductsBatch(request):
+    """
+    Fetch several products in one request, e.g. to restore a cart. Accepts
+    ?ids=1,2,3 or a JSON body {"ids": [1, 2, 3]} and returns the products in
+    request order along with the ids that don't exist, and how many units of
+    each the caller can buy after other users' reservations.
+    """
+    if request.method == 'POST':
+        raw_ids = request.data.get('ids', [])
+    else:
+        raw_ids = [value for value in request.GET.get('ids', '').split(',') if value]
+    if not isinstance(raw_ids, list):
+        return Response({'detail': 'ids must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        fields = product_fields(request)
+    except InvalidFieldset as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    max_ids = getattr(settings, 'PRODUCTS_BATCH_MAX', 100)
+    if len(raw_ids) > max_ids:
+        return Response({'detail': f'At most {max_ids} ids can be requested at once'}, status=status.HTTP_400_BAD_REQUEST)
+
+    requested = []
+    for raw_id in raw_ids:
+        try:
+            product_id = int(raw_id)
+        except (TypeError, ValueError):
+            product_id = str(raw_id)
+        if product_id not in requested:
+            requested.append(product_id)
+
+    ids = [product_id for product_id in requested if isinstance(product_id, int)]
+    products = with_available(project_products(Products.objects.all(), fields), request.user).annotate(
+        shards=F('stockShards'),
+    ).in_bulk(ids, field_name='_id')
+    for product in products.values():
+        if product.shards:
+            product.stockCount = product.stock
+    found = [products[product_id] for product_id in requested if product_id in products]
+    missing = [product_id for product_id in requested if product_id not in products]
+    serializer = ProductListingSerializer(found, many=True, context={'product_fields': fields})
+    available = {product._id: max(product.available, 0) for product in found}
+    return Response({'products': serializer.data, 'missing': missing, 'available': available})
+
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
@@ -233,30 +381,49 @@ class ActivateAccountView(View):
             return render(request,"activatefail.html")   
 
 @api_view(['POST'])
+@idempotent
 def update_stock(request):
+    """Take quantity units of one product; adjust_stock_batch adjusts several at once"""
+    product_id = request.data.get('productId')
+    quantity = request.data.get('quantity')
+    if not product_id or not quantity:
+        return Response({'detail': 'Product ID and quantity are required'}, status=status.HTTP_400_BAD_REQUEST)
+
     try:
-        with transaction.atomic():
-            product_id = request.data.get('productId')
-            quantity = request.data.get('quantity')
-            
-            if not product_id or not quantity:
-                return Response({'detail': 'Product ID and quantity are required'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            product = Products.objects.get(_id=product_id)
-            if product.stockCount < quantity:
-                return Response({'detail': 'Not enough stock available'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            product.stockCount -= quantity
-            product.save()
-            
-            return Response({'detail': 'Stock updated successfully'}, status=status.HTTP_200_OK)
-            
-    except Products.DoesNotExist:
-        return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
-        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)   
+        # quantity is taken, so it's a negative delta
+        lines = [(line_product, -delta) for line_product, delta in parse_adjustments([{'product_id': product_id, 'delta': quantity}])]
+        _, products = adjust_stock(lines, request.user, 'update_stock')
+    except AdjustmentError as e:
+        return Response({'detail': e.detail}, status=e.status)
 
+    stock_changed(products)
+    return Response({'detail': 'Stock updated successfully'}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+@idempotent
+def adjust_stock_batch(request):
+    """
+    Apply several stock adjustments all or nothing, e.g. a delivery or a
+    stocktake: {"adjustments": [{"product_id": 1, "delta": -2}, ...], "reason": "..."}.
+    Returns the stock after each line, or when the batch is refused the status
+    of each line. Every line is recorded in the inventory ledger.
+    """
+    try:
+        lines = parse_adjustments(request.data.get('adjustments'))
+        results, products = adjust_stock(lines, request.user, str(request.data.get('reason') or '')[:200])
+    except AdjustmentError as e:
+        data = {'detail': e.detail}
+        if e.lines is not None:
+            data['lines'] = e.lines
+        return Response(data, status=e.status)
+
+    stock_changed(products)
+    return Response({'lines': results}, status=status.HTTP_200_OK)
+
+@condition(etag_func=categories_etag, last_modified_func=last_modified('categories'))
 @api_view(['GET'])
+@traced
 def getCategories(request):
     categories = Category.objects.all().order_by('name')
     serializer = CategorySerializer(categories, many=True)
@@ -264,77 +431,39 @@ def getCategories(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@traced
 def get_my_orders(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    serializer = OrderSerializer(orders, many=True)
+    try:
+        fields = product_fields(request)
+    except InvalidFieldset as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    orders = Order.objects.filter(user=request.user).select_related('user', 'delivery_location').prefetch_related(
+        Prefetch('items', queryset=order_items(fields))
+    ).order_by('-created_at')
+    serializer = OrderSerializer(orders, many=True, context={'product_fields': fields})
     return Response(serializer.data)   
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_order(request):
     try:
-        data = request.data
-        user = request.user
-
-        # Get or create delivery location
-        delivery_location = None
-        if data.get('delivery_location'):
-            loc_data = data['delivery_location']
-            delivery_location = DeliveryLocation.objects.create(
-                user=user,
-                latitude=loc_data['latitude'],
-                longitude=loc_data['longitude'],
-                address_details=loc_data['address_details']
-            )
-
-        # Create order
-        order = Order.objects.create(
-            user=user,
-            delivery_location=delivery_location,
-            payment_method=data['payment_method'],
-            shipping_price=data['shipping_price'],
-            total_price=data['total_price'],
-            status='Pending'
-        )
-
-        # Create order items
-        for item in data['order_items']:
-            product = Products.objects.get(_id=item['product_id'])
-            
-            # Check stock
-            if product.stockCount < item['quantity']:
-                order.delete()  # Rollback the order
-                return Response({
-                    'detail': f'Not enough stock for {product.productName}. Available: {product.stockCount}'
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Create order item
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=item['quantity'],
-                price=item['price']
-            )
-            
-            # Update stock
-            product.stockCount -= item['quantity']
-            product.save()
-
-        serializer = OrderSerializer(order)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
+        order, products = place_order(request.user, request.data)
+    except CheckoutError as e:
+        return Response({'detail': e.detail}, status=e.status)
     except KeyError as e:
         return Response({
             'detail': f'Missing required field: {str(e)}'
         }, status=status.HTTP_400_BAD_REQUEST)
-    except Products.DoesNotExist:
-        return Response({
-            'detail': 'One or more products not found'
-        }, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({
             'detail': str(e)
-        }, status=status.HTTP_400_BAD_REQUEST)   
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    stock_changed(products)
+    prefetch_related_objects([order], Prefetch('items', queryset=order_items()))
+    serializer = OrderSerializer(order)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
@@ -405,13 +534,24 @@ def get_sales_stats(request):
             'error': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)   
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_cache_stats(request):
+    """Hit/miss counters of the product listing cache"""
+    return Response(cache_stats())
+
 @api_view(['GET', 'POST', 'DELETE'])
 @permission_classes([IsAuthenticated])
+@traced
 def wishlist_operations(request, pk=None):
     try:
         if request.method == 'GET':
-            wishlist_items = Wishlist.objects.filter(user=request.user)
-            serializer = WishlistSerializer(wishlist_items, many=True)
+            fields = product_fields(request)
+            wishlist_items = project_products(
+                Wishlist.objects.filter(user=request.user).select_related('user', 'product'),
+                fields, prefix='product__',
+            )
+            serializer = WishlistSerializer(wishlist_items, many=True, context={'product_fields': fields})
             return Response(serializer.data)
         
         elif request.method == 'POST':
@@ -448,17 +588,58 @@ def wishlist_operations(request, pk=None):
     except Exception as e:
         return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)   
 
+@api_view(['GET', 'POST', 'PATCH', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def reservation_operations(request, pk=None):
+    """
+    The user's cart reservations (see reservations.py). GET lists the live
+    ones; on a product, POST {"quantity": n} holds n units (0 releases them),
+    PATCH extends the hold and DELETE releases it.
+    """
+    if request.method == 'GET':
+        reservations = live_reservations().filter(user=request.user).order_by('expires_at')
+        return Response(StockReservationSerializer(reservations, many=True).data)
+    if pk is None:
+        return Response({'detail': 'Product id required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        if request.method == 'POST':
+            try:
+                quantity = int(request.data.get('quantity', 1))
+            except (TypeError, ValueError):
+                return Response({'detail': 'Invalid quantity'}, status=status.HTTP_400_BAD_REQUEST)
+            reservation = reserve(request.user, pk, quantity)
+        elif request.method == 'PATCH':
+            reservation = extend(request.user, pk)
+        else:
+            release(request.user, pk)
+            reservation = None
+    except ReservationError as e:
+        return Response({'detail': e.detail}, status=e.status)
+
+    if reservation is None:
+        return Response({'detail': 'Reservation released'})
+    return Response(StockReservationSerializer(reservation).data)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@traced
 def get_order_details(request, pk):
     try:
-        order = Order.objects.get(id=pk, user=request.user)
-        serializer = OrderSerializer(order, many=False)
+        fields = product_fields(request)
+        order = Order.objects.select_related('user', 'delivery_location').prefetch_related(
+            Prefetch('items', queryset=order_items(fields))
+        ).get(id=pk, user=request.user)
+        serializer = OrderSerializer(order, many=False, context={'product_fields': fields})
         return Response(serializer.data)
+    except InvalidFieldset as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Order.DoesNotExist:
         return Response({'detail': 'Order not found'}, status=404)   
 
+@condition(etag_func=tag_types_etag, last_modified_func=last_modified('tag_types'))
 @api_view(['GET'])
+@traced
 def get_tag_types(request):
     """Get all tag types and their associated tags"""
     tag_types = TagType.objects.prefetch_related('tags').all()
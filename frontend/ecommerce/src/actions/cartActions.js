@@ -1,5 +1,5 @@
 import axios from "axios";
-import { CART_ADD_ITEM, CART_REMOVE_ITEM, CART_CLEAR_ITEMS } from "../constants/cartConstants";
+import { CART_ADD_ITEM, CART_REMOVE_ITEM, CART_CLEAR_ITEMS, CART_REFRESH_ITEMS } from "../constants/cartConstants";
 
 export const addToCart = (id, qty)=> async (dispatch, getState) => {
     const {data} = await axios.get(`/api/product/${id}`)
@@ -16,6 +16,47 @@ export const addToCart = (id, qty)=> async (dispatch, getState) => {
         }
     })
     localStorage.setItem('cartItems', JSON.stringify(getState().cart.cartItems))
+    holdStock(getState, 'post', id, { quantity: qty })
+}
+
+// Signed-in carts hold their units for a while so they're still there at
+// checkout; checkout still checks stock, so a failed hold isn't fatal
+const holdStock = (getState, method, id, data) => {
+    const { userInfo } = getState().userLogin || {}
+    if (!userInfo) {
+        return
+    }
+    const config = { headers: { Authorization: `Bearer ${userInfo.token}` } }
+    const url = `/api/reservations/${id}/`
+    const request = method === 'delete' ? axios.delete(url, config) : axios.post(url, data, config)
+    request.catch(error => console.warn('Could not update stock reservation:', error.response?.data?.detail || error.message))
+}
+
+// Re-fetch every cart line in one request so prices and stock are current
+export const refreshCart = () => async (dispatch, getState) => {
+    const { cartItems } = getState().cart
+    if (cartItems.length === 0) {
+        return
+    }
+
+    const { data } = await axios.post('/api/products/batch/', { ids: cartItems.map(item => item.product) })
+    const products = {}
+    data.products.forEach(product => { products[product._id] = product })
+
+    dispatch({
+        type: CART_REFRESH_ITEMS,
+        payload: cartItems
+            .filter(item => products[item.product])
+            .map(item => ({
+                ...item,
+                productName: products[item.product].productName,
+                image: products[item.product].image,
+                price: products[item.product].price,
+                // What's left after other shoppers' reservations
+                stockCount: data.available[item.product] ?? products[item.product].stockCount,
+            }))
+    })
+    localStorage.setItem('cartItems', JSON.stringify(getState().cart.cartItems))
 }
 
 export const removeFromCart = (id) => (dispatch, getState) => {
@@ -24,6 +65,7 @@ export const removeFromCart = (id) => (dispatch, getState) => {
         payload: id,
     })
     localStorage.setItem('cartItems', JSON.stringify(getState().cart.cartItems))
+    holdStock(getState, 'delete', id)
 }
 
 export const clearCart = () => (dispatch, getState) => {
@@ -1,4 +1,3 @@
-import axios from 'axios'
 import {
     CHECKOUT_SAVE_SHIPPING_ADDRESS,
     CHECKOUT_SAVE_PAYMENT_METHOD,
@@ -8,6 +7,7 @@ import {
     CHECKOUT_CLEAR
 } from '../constants/checkoutConstants'
 import { CART_CLEAR_ITEMS } from '../constants/cartConstants'
+import { idempotentPost } from '../idempotentPost'
 
 export const saveShippingAddress = (data) => (dispatch) => {
     dispatch({
@@ -44,7 +44,7 @@ export const createOrder = (order) => async (dispatch, getState) => {
             }
         }
 
-        const { data } = await axios.post(
+        const { data } = await idempotentPost(
             '/api/orders/create/',
             order,
             config
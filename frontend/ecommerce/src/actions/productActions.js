@@ -17,19 +17,20 @@ export const listProducts = (keyword = '') => async (dispatch) => {
     
     const queryString = params.toString();
     const url = `/api/products/${queryString ? `?${queryString}` : ''}`;
-    
-    console.log('\nProduct Action - Making API request:');
-    console.log('URL parameters:', Object.fromEntries(params));
-    console.log('URL being called:', url);
-    
-    const { data } = await axios.get(url);
-    
-    console.log('\nProduct Action - Received API response:');
-    console.log('Total products:', data.length);
-    
+
+    let response = await axios.get(url);
+
+    // Nothing found for the keyword: try again allowing for typos
+    if (params.get('keyword') && !params.has('fuzzy') && response.data.length === 0) {
+      params.set('fuzzy', '1');
+      response = await axios.get(`/api/products/?${params.toString()}`);
+    }
+    const { data } = response;
+
     dispatch({
       type: PRODUCT_LIST_SUCCESS,
       payload: data,
+      didYouMean: response.headers['x-did-you-mean'] || null,
     });
   } catch (error) {
     console.error('Error in listProducts action:', error);
@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from "react";
 import { useNavigate, useLocation } from "react-router-dom";
-import { Navbar, Container, Form, Button, Modal, Badge, NavDropdown } from "react-bootstrap";
+import { Navbar, Container, Form, Button, Modal, Badge, NavDropdown, ListGroup } from "react-bootstrap";
 import { useDispatch, useSelector } from 'react-redux'
 import { logout } from "../actions/userActions";
 import { listWishlist } from "../actions/wishlistActions";
@@ -37,6 +37,8 @@ function Header() {
   const [currentCategory, setCurrentCategory] = useState(searchParams.get('category') || '');
   const [categories, setCategories] = useState([]);
   const [expanded, setExpanded] = useState(false);
+  const [suggestions, setSuggestions] = useState([]);
+  const [showSuggestions, setShowSuggestions] = useState(false);
   
   const userLogin = useSelector(state => state.userLogin);
   const {userInfo} = userLogin;
@@ -105,8 +107,45 @@ function Header() {
     });
   };
 
+  // Typeahead suggestions, fetched once typing pauses
+  useEffect(() => {
+    const query = keyword.trim();
+    if (!query) {
+      setSuggestions([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const { data } = await axios.get('/api/products/autocomplete/', { params: { q: query } });
+        setSuggestions(data);
+      } catch (error) {
+        console.error('Error fetching suggestions:', error);
+      }
+    }, 150);
+    return () => clearTimeout(timer);
+  }, [keyword]);
+
+  const selectSuggestion = (suggestion) => {
+    setShowSuggestions(false);
+    setExpanded(false);
+    if (suggestion.type === 'product') {
+      navigate(`/product/${suggestion.id}`);
+      return;
+    }
+    const params = new URLSearchParams();
+    if (suggestion.type === 'category') {
+      params.set('category', suggestion.label);
+    } else if (suggestion.type === 'tag' && suggestion.tag_type) {
+      params.set(suggestion.tag_type === 'Arrival' ? 'arrival' : suggestion.tag_type.toLowerCase(), suggestion.label);
+    } else {
+      params.set('keyword', suggestion.label);
+    }
+    navigate({ pathname: '/', search: `?${params.toString()}` });
+  };
+
   const submitHandler = (e) => {
     e.preventDefault();
+    setShowSuggestions(false);
     
     // Create a new URLSearchParams object
     const params = new URLSearchParams();
@@ -287,7 +326,13 @@ function Header() {
                     type="text"
                     placeholder="Search products..."
                     value={keyword}
-                    onChange={(e) => setKeyword(e.target.value)}
+                    onChange={(e) => {
+                      setKeyword(e.target.value);
+                      setShowSuggestions(true);
+                    }}
+                    onFocus={() => setShowSuggestions(true)}
+                    onBlur={() => setShowSuggestions(false)}
+                    autoComplete="off"
                     className="search-input"
                     style={{
                       borderRadius: '30px',
@@ -324,6 +369,27 @@ function Header() {
                   >
                     <FontAwesomeIcon icon={faMagnifyingGlass} style={{ color: '#000' }} />
                   </Button>
+                  {showSuggestions && suggestions.length > 0 && (
+                    <ListGroup
+                      className="position-absolute w-100 shadow-sm"
+                      style={{ top: '50px', zIndex: 1050 }}
+                    >
+                      {suggestions.map((suggestion) => (
+                        <ListGroup.Item
+                          key={`${suggestion.type}-${suggestion.id || suggestion.tag_type || ''}-${suggestion.label}`}
+                          action
+                          onMouseDown={(e) => e.preventDefault()}
+                          onClick={() => selectSuggestion(suggestion)}
+                          className="d-flex justify-content-between align-items-center"
+                        >
+                          <span>{suggestion.label}</span>
+                          <small className="text-muted">
+                            {suggestion.type === 'tag' ? suggestion.tag_type : suggestion.type}
+                          </small>
+                        </ListGroup.Item>
+                      ))}
+                    </ListGroup>
+                  )}
                 </div>
               </Form>
             )}
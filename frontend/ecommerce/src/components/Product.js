@@ -4,6 +4,9 @@ import { Link } from 'react-router-dom'
 import Rating from './Rating'
 
 function Product({product}) {
+  // Resized copies made by the backend; older products may not have them yet
+  const grid = (product.imageVariants && product.imageVariants.grid) || {}
+
   const renderTags = (tags) => {
     if (!tags || !Array.isArray(tags) || tags.length === 0) return null;
     
@@ -55,11 +58,15 @@ function Product({product}) {
       </style>
       <Link to={`/product/${product._id}`} className="text-decoration-none">
         <div className="position-relative">
-          <Card.Img 
-            src={product.image} 
-            className="card-img-top"
-            alt={product.productName}
-          />
+          <picture>
+            {grid.webp && <source srcSet={grid.webp} type="image/webp" />}
+            <Card.Img 
+              src={grid.jpeg || product.image} 
+              className="card-img-top"
+              alt={product.productName}
+              loading="lazy"
+            />
+          </picture>
           {product.stockCount === 0 && (
             <Badge 
               bg="danger" 
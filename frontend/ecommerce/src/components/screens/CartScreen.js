@@ -10,7 +10,7 @@ import {
 } from '@fortawesome/free-solid-svg-icons'
 import Loader from "../Loader";
 import Message from "../Message";
-import { addToCart, removeFromCart, clearCart } from '../../actions/cartActions';
+import { addToCart, removeFromCart, clearCart, refreshCart } from '../../actions/cartActions';
 import { useDispatch, useSelector } from "react-redux";
 import { Form } from 'react-bootstrap';
 import './CartScreen.css';
@@ -41,6 +41,8 @@ function CartScreen() {
     
     if(id) {
       dispatch(addToCart(id, qty));
+    } else {
+      dispatch(refreshCart());
     }
   }, [dispatch, id, qty, userInfo, navigate]); 
 
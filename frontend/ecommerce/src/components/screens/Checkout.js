@@ -4,10 +4,10 @@ import { useSelector, useDispatch } from 'react-redux';
 import { useNavigate, Link } from 'react-router-dom';
 import { FontAwesomeIcon } from '@fortawesome/react-fontawesome';
 import { faArrowLeft, faShoppingCart, faHome } from '@fortawesome/free-solid-svg-icons';
-import axios from 'axios';
 import Message from '../Message';
 import DeliveryLocationMap from '../DeliveryLocationMap';
 import logo from '../../logo/Toy_Logo.png';
+import { idempotentPost } from '../../idempotentPost';
 
 const Checkout = () => {
     console.log('Checkout component rendering');
@@ -123,7 +123,7 @@ const Checkout = () => {
             console.log('Setting isCheckoutComplete to true');
             
             // Make API call after state updates
-            const response = await axios.post('/api/orders/create/', orderData, config);
+            const response = await idempotentPost('/api/orders/create/', orderData, config);
             setIsSubmitting(false);
             
             // Save order ID for future reference if needed
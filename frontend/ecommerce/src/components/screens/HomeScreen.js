@@ -5,7 +5,7 @@ import Loader from '../Loader'
 import Message from '../Message'
 import { useDispatch, useSelector } from 'react-redux'
 import { listProducts } from '../../actions/productActions'
-import { useLocation } from 'react-router-dom'
+import { Link, useLocation } from 'react-router-dom'
 import axios from 'axios'
 
 function HomeScreen() {
@@ -18,18 +18,45 @@ function HomeScreen() {
     const [priceRange, setPriceRange] = useState({ min: 0, max: 0 })
     const [maxPrice, setMaxPrice] = useState(0)
     const [initialLoad, setInitialLoad] = useState(true)
+    const [facets, setFacets] = useState(null)
     
     const productsList = useSelector(state => state.productsList)
-    const { error, loading: productsLoading, products } = productsList
+    const { error, loading: productsLoading, products, didYouMean } = productsList
 
     // Get current category from URL
     const searchParams = new URLSearchParams(location.search)
     const currentCategory = searchParams.get('category') || ''
 
+    // The same search with the keyword the typo-tolerant search matched instead
+    const correctedSearch = () => {
+        const params = new URLSearchParams(location.search)
+        params.set('keyword', didYouMean)
+        params.delete('fuzzy')
+        return `?${params.toString()}`
+    }
+
+    // Product counts per tag for the current filters
+    const fetchFacets = async (search) => {
+        try {
+            const query = search ? `?${search.replace(/^\?/, '')}` : ''
+            const { data } = await axios.get(`/api/products/facets/${query}`)
+            setFacets(data)
+        } catch (error) {
+            console.error('Error fetching facet counts:', error)
+        }
+    }
+
+    const tagCount = (tagType, tagName) => {
+        if (!facets) return null
+        if (tagType === 'Arrival') return facets.arrival[tagName.toLowerCase()] ?? 0
+        return facets.tags[tagType]?.[tagName] ?? 0
+    }
+
     // Initial products fetch
     useEffect(() => {
         console.log('Fetching products with search:', location.search)
         dispatch(listProducts(location.search))
+        fetchFacets(location.search)
     }, [dispatch, location.search])
 
     // Update max price and price range
@@ -149,6 +176,7 @@ function HomeScreen() {
             const newSearch = params.toString()
             window.history.pushState({}, '', `${window.location.pathname}${newSearch ? `?${newSearch}` : ''}`)
             dispatch(listProducts(newSearch))
+            fetchFacets(newSearch)
             
             return updatedTags
         })
@@ -190,6 +218,7 @@ function HomeScreen() {
         const newSearch = params.toString()
         window.history.pushState({}, '', `${window.location.pathname}?${newSearch}`)
         dispatch(listProducts(newSearch))
+        fetchFacets(newSearch)
     }
 
     const clearFilters = () => {
@@ -199,6 +228,7 @@ function HomeScreen() {
         }
         window.history.pushState({}, '', `${window.location.pathname}${params.toString() ? `?${params}` : ''}`)
         dispatch(listProducts(params.toString()))
+        fetchFacets(params.toString())
         setSelectedTags({})
         setPriceRange({ min: 0, max: maxPrice })
     }
@@ -256,15 +286,20 @@ function HomeScreen() {
                             <div key={tagType.id} className="filter-group mb-4">
                                 <h5>{tagType.name}</h5>
                                 <div className="tag-buttons">
-                                    {tagType.tags.map(tag => (
-                                        <button
-                                            key={tag.id}
-                                            className={`tag-button ${selectedTags[tagType.name]?.includes(tag.name) ? 'active' : ''}`}
-                                            onClick={() => handleTagSelect(tagType.name, tag.name)}
-                                        >
-                                            {tag.name}
-                                        </button>
-                                    ))}
+                                    {tagType.tags.map(tag => {
+                                        const selected = selectedTags[tagType.name]?.includes(tag.name)
+                                        const count = tagCount(tagType.name, tag.name)
+                                        return (
+                                            <button
+                                                key={tag.id}
+                                                className={`tag-button ${selected ? 'active' : ''}`}
+                                                onClick={() => handleTagSelect(tagType.name, tag.name)}
+                                                disabled={count === 0 && !selected}
+                                            >
+                                                {tag.name}{count !== null && ` (${count})`}
+                                            </button>
+                                        )
+                                    })}
                                 </div>
                             </div>
                         ))}
@@ -273,6 +308,14 @@ function HomeScreen() {
 
                 {/* Products Section */}
                 <Col md={9}>
+                    {didYouMean && !productsLoading && (
+                        <Message variant='info'>
+                            Showing results for{' '}
+                            <Link to={{ pathname: location.pathname, search: correctedSearch() }}>
+                                "{didYouMean}"
+                            </Link>
+                        </Message>
+                    )}
                     {productsLoading ? (
                         <Loader />
                     ) : error ? (
@@ -413,6 +456,11 @@ function HomeScreen() {
                         color: #0275d8;
                     }
 
+                    .tag-button:disabled {
+                        opacity: 0.5;
+                        cursor: default;
+                    }
+
                     .tag-button.active {
                         background: #0275d8;
                         border-color: #0275d8;
@@ -12,15 +12,19 @@ import { useDispatch, useSelector } from "react-redux";
 import Loader from "../Loader";
 import Message from "../Message";
 import { addToCart } from "../../actions/cartActions";
+import Product from "../Product";
+import axios from "axios";
 
 function ProductScreen() {
   const navigate = useNavigate();
   const { id } = useParams();
   const [quantity, setQuantity] = useState(1);
   const [showLoginMessage, setShowLoginMessage] = useState(false);
+  const [similarProducts, setSimilarProducts] = useState([]);
   const dispatch = useDispatch();
   const productDetails = useSelector((state) => state.productDetails);
   const { error, loading, product } = productDetails;
+  const detailImage = (product && product.imageVariants && product.imageVariants.detail) || {};
   
   const userLogin = useSelector((state) => state.userLogin);
   const { userInfo } = userLogin;
@@ -100,6 +104,20 @@ function ProductScreen() {
     }
   }, [dispatch, id, userInfo]);
 
+  // Precomputed on the server, so this is a single cheap request
+  useEffect(() => {
+    const fetchSimilar = async () => {
+      try {
+        const { data } = await axios.get(`/api/product/${id}/similar/`);
+        setSimilarProducts(data);
+      } catch (error) {
+        console.error('Error fetching similar products:', error);
+        setSimilarProducts([]);
+      }
+    };
+    fetchSimilar();
+  }, [id]);
+
   const addToCartHandler = () => {
     if (!userInfo) {
       setShowLoginMessage(true);
@@ -137,7 +155,10 @@ function ProductScreen() {
       ) : (
         <Row>
           <Col md={6} className="mb-4">
-            <Image src={product.image} alt={product.productName} fluid className="rounded" />
+            <picture>
+              {detailImage.webp && <source srcSet={detailImage.webp} type="image/webp" />}
+              <Image src={detailImage.jpeg || product.image} alt={product.productName} fluid className="rounded" />
+            </picture>
           </Col>
 
           <Col md={6}>
@@ -230,6 +251,19 @@ function ProductScreen() {
           </Col>
         </Row>
       )}
+
+      {similarProducts.length > 0 && (
+        <div className="mt-5">
+          <h4 className="mb-3">You may also like</h4>
+          <Row>
+            {similarProducts.map((similar) => (
+              <Col key={similar._id} sm={12} md={6} lg={3} className="mb-4">
+                <Product product={similar} />
+              </Col>
+            ))}
+          </Row>
+        </div>
+      )}
     </Container>
   );
 }
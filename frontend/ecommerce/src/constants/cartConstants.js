@@ -1,3 +1,4 @@
 export const CART_ADD_ITEM = 'CART_ADD_ITEM'
 export const CART_REMOVE_ITEM = 'CART_REMOVE_ITEM'
-export const CART_CLEAR_ITEMS = 'CART_CLEAR_ITEMS'
\ No newline at end of file
+export const CART_CLEAR_ITEMS = 'CART_CLEAR_ITEMS'
+export const CART_REFRESH_ITEMS = 'CART_REFRESH_ITEMS'
\ No newline at end of file
@@ -0,0 +1,21 @@
+import axios from 'axios';
+
+const newKey = () =>
+  window.crypto && window.crypto.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
+// POST with an Idempotency-Key, retrying once with the same key when no
+// response arrives (timeout, dropped connection). The server replays the
+// first attempt's response instead of running the write twice.
+export const idempotentPost = async (url, data, config = {}) => {
+  const withKey = { ...config, headers: { ...config.headers, 'Idempotency-Key': newKey() } };
+  try {
+    return await axios.post(url, data, withKey);
+  } catch (error) {
+    if (error.response) {
+      throw error;
+    }
+    return axios.post(url, data, withKey);
+  }
+};
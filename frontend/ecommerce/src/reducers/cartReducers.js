@@ -1,4 +1,4 @@
-import { CART_ADD_ITEM, CART_REMOVE_ITEM, CART_CLEAR_ITEMS } from "../constants/cartConstants";
+import { CART_ADD_ITEM, CART_REMOVE_ITEM, CART_CLEAR_ITEMS, CART_REFRESH_ITEMS } from "../constants/cartConstants";
 
 export const cartReducer = (state = {cartItems:[]}, action) => {
     switch(action.type) {
@@ -25,6 +25,12 @@ export const cartReducer = (state = {cartItems:[]}, action) => {
                 cartItems: state.cartItems.filter(x => x.product !== action.payload)
             }
 
+        case CART_REFRESH_ITEMS:
+            return {
+                ...state,
+                cartItems: action.payload
+            }
+
         case CART_CLEAR_ITEMS:
             return {
                 ...state,
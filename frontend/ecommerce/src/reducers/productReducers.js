@@ -12,7 +12,7 @@ export const productsListReducers =(state={products:[]},action)=>{
         case PRODUCT_LIST_REQUEST:
             return {loading:true,products:[]}
         case PRODUCT_LIST_SUCCESS:
-            return {loading:false,products:action.payload}
+            return {loading:false,products:action.payload,didYouMean:action.didYouMean}
         case PRODUCT_LIST_FAIL:
             return {loading:false,error:action.payload}
 